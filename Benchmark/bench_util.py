@@ -0,0 +1,332 @@
+'''
+    Helpers shared by the per-network benchmark.py scripts.
+
+    Each network builds its own graph (TensorFlow or PyTorch) and wraps it in a
+    predict(points) function that takes a BxNxC numpy batch and returns a dict
+    of numpy outputs. Everything else -- synthetic inputs, warm-up, timing,
+    percentiles, peak RSS, optional energy, optional traces and the JSON result
+    file -- lives here so all five networks report numbers the same way.
+
+    Kept compatible with python2 since F-PointNet still runs under python2.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../PowerMeasurement'))
+import energy
+import quant_util
+import trace_util
+
+VARIANTS = ['baseline', 'limited', 'full']
+
+VARIANT_NAMES = {
+    'baseline' : 'Baseline',
+    'limited' : 'Limited Delayed-Aggr.',
+    'full' : 'Fully Delayed-Aggr.'
+}
+
+# Benchmark command of every network, run from Networks/[NETWORK]
+BENCHMARK_SCRIPTS = {
+    'pointnet2' : 'python benchmark.py',
+    'frustum-pointnets' : 'python2 train/benchmark.py',
+    'ldgcnn' : 'python benchmark.py',
+    'dgcnn' : 'python benchmark.py',
+    'DensePoint' : 'python benchmark.py'
+}
+
+# dgcnn, ldgcnn and DensePoint have no separate limited delayed-aggregation model
+BENCHMARK_VARIANTS = {
+    'pointnet2' : ['baseline', 'limited', 'full'],
+    'frustum-pointnets' : ['baseline', 'limited', 'full'],
+    'ldgcnn' : ['baseline', 'full'],
+    'dgcnn' : ['baseline', 'full'],
+    'DensePoint' : ['baseline', 'full']
+}
+
+# Framework of every network, which decides how traces are collected
+FRAMEWORKS = {
+    'pointnet2' : 'tensorflow',
+    'frustum-pointnets' : 'tensorflow',
+    'ldgcnn' : 'tensorflow',
+    'dgcnn' : 'tensorflow',
+    'DensePoint' : 'pytorch'
+}
+
+# Offset of the seeds of the synthetic calibration clouds, clear of the timed batches
+CALIBRATION_SEED = 100000
+
+# Pre-trained checkpoint of every variant, relative to Networks/[NETWORK]
+CHECKPOINTS = {
+    'pointnet2' : {'baseline': 'log-baseline/model_best_acc.ckpt',
+                   'limited': 'log-limited/model_best_acc.ckpt',
+                   'full': 'log/model_best_acc.ckpt'},
+    'frustum-pointnets' : {'baseline': 'train/log_v2_baseline/model.ckpt',
+                           'limited': 'train/log_v2_limited/model.ckpt',
+                           'full': 'train/log_v2/model.ckpt'},
+    'ldgcnn' : {'baseline': 'log_baseline',
+                'full': 'log_new'},
+    'dgcnn' : {'baseline': 'log-baseline/model-best-acc.ckpt',
+               'full': 'log/model-best-acc.ckpt'},
+    'DensePoint' : {'baseline': 'log-baseline/cls_iter_48042_acc_0.921799.pth',
+                    'full': 'log/cls_iter_60129_acc_0.918152.pth'}
+}
+
+def add_benchmark_args(parser, variants, batch_size, num_point):
+    ''' Register the command line flags every benchmark.py understands. '''
+    parser.add_argument('--variant', default='full', choices=list(variants), help='Aggregation variant to build [default: full]')
+    parser.add_argument('--gpu', type=int, default=0, help='GPU to use [default: GPU 0]')
+    parser.add_argument('--batch_size', type=int, default=batch_size, help='Batch size [default: %d]' % batch_size)
+    parser.add_argument('--num_point', type=int, default=num_point, help='Points per cloud [default: %d]' % num_point)
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed warm-up iterations [default: 10]')
+    parser.add_argument('--iterations', type=int, default=100, help='Timed iterations [default: 100]')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic point clouds [default: 0]')
+    parser.add_argument('--model_path', default=None, help='Checkpoint to restore; random weights if not given [default: None]')
+    parser.add_argument('--result_file', default=None, help='Write the result as JSON to this file [default: None]')
+    parser.add_argument('--input_file', default=None, help='Run on the clouds of this .npz file (data, optional label) instead of synthetic ones [default: None]')
+    parser.add_argument('--energy_backend', default=None, help='Measure energy per batch with this PowerMeasurement backend: auto, jetson or rapl [default: None]')
+    parser.add_argument('--energy_rate', type=float, default=100.0, help='Power sampling rate in Hz [default: 100]')
+    parser.add_argument('--output_file', default=None, help='With --input_file, save the outputs for every cloud to this .npz file [default: None]')
+    parser.add_argument('--trace_file', default=None, help='After timing, save an op-level trace (TF timeline or PyTorch profile) to this file, see trace_report.py [default: None]')
+    parser.add_argument('--trace_iterations', type=int, default=5, help='Traced iterations for --trace_file [default: 5]')
+    parser.add_argument('--precision', default=None, choices=quant_util.PRECISIONS, help='Run the frozen model with the conv and FC layers in this precision, see quant_util.py [default: None, the model as built]')
+    parser.add_argument('--calibration_file', default=None, help='With --precision int8, calibrate the activation ranges on the clouds of this .npz file [default: synthetic clouds]')
+    parser.add_argument('--num_calibration', type=int, default=256, help='Clouds the int8 activation ranges are calibrated on [default: 256]')
+    parser.add_argument('--cpu', action='store_true', help='With --precision, run the layers on the CPU')
+    return parser
+
+def synthetic_batch(batch_size, num_point, num_channel=3, seed=0):
+    ''' Generate a deterministic batch of point clouds.
+        Points are drawn on the surface of random ellipsoids and normalized
+        into the unit sphere like ModelNet40; extra channels are uniform in [0,1].
+        Input:
+          batch_size, num_point, num_channel: output shape
+          seed: random seed, the same seed always gives the same batch
+        Return:
+          BxNxC float32 numpy array
+    '''
+    rng = np.random.RandomState(seed)
+    xyz = rng.randn(batch_size, num_point, 3)
+    xyz /= np.linalg.norm(xyz, axis=2, keepdims=True) + 1e-8
+    xyz *= rng.uniform(0.3, 1.0, size=(batch_size, 1, 3))
+    xyz += rng.normal(scale=0.01, size=xyz.shape)
+    xyz /= np.max(np.linalg.norm(xyz, axis=2), axis=1)[:, None, None]
+    batch = np.zeros((batch_size, num_point, num_channel), dtype=np.float32)
+    batch[:, :, 0:3] = xyz
+    if num_channel > 3:
+        batch[:, :, 3:] = rng.uniform(0.0, 1.0, size=(batch_size, num_point, num_channel-3))
+    return batch
+
+def synthetic_frustum_batch(batch_size, num_point, num_channel=4, seed=0):
+    ''' Synthetic frustum point clouds for F-PointNet in the rotated-to-center
+        frustum coordinate: objects a few meters wide at 5 to 40 meters depth (z),
+        with lidar intensity in the last channel.
+    '''
+    batch = synthetic_batch(batch_size, num_point, num_channel, seed)
+    rng = np.random.RandomState(seed)
+    batch[:,:,0:3] *= np.array([2.0, 1.0, 2.0], dtype=np.float32)
+    batch[:,:,2] += rng.uniform(5.0, 40.0, size=(batch_size, 1)).astype(np.float32)
+    return batch
+
+def peak_rss_mb():
+    ''' Peak resident set size of this process in MB. '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if platform.system() == 'Darwin':
+        return rss / (1024.0 * 1024.0)
+    return rss / 1024.0
+
+def summarize(latencies, batch_size):
+    ''' Reduce per-iteration latencies (seconds) to the reported statistics. '''
+    lat_ms = np.array(latencies, dtype=np.float64) * 1000.0
+    total = np.sum(lat_ms) / 1000.0
+    return {'iterations': len(latencies),
+            'latency_mean_ms': float(np.mean(lat_ms)),
+            'latency_p50_ms': float(np.percentile(lat_ms, 50)),
+            'latency_p95_ms': float(np.percentile(lat_ms, 95)),
+            'latency_p99_ms': float(np.percentile(lat_ms, 99)),
+            'samples_per_sec': float(len(latencies) * batch_size / total) if total > 0 else 0.0}
+
+def load_inputs(filename):
+    ''' Load the clouds written by save_inputs. Return (data, label or None). '''
+    f = np.load(filename)
+    label = f['label'] if 'label' in f.files else None
+    return f['data'], label
+
+def save_inputs(filename, data, label=None):
+    dir_path = os.path.dirname(filename)
+    if dir_path and not os.path.exists(dir_path): os.makedirs(dir_path)
+    if label is None:
+        np.savez(filename, data=data)
+    else:
+        np.savez(filename, data=data, label=label)
+
+def split_batches(data, batch_size):
+    ''' Split MxNxC clouds into full batches, padding the last one with the
+        first clouds so every batch matches the fixed-size placeholders.
+        Return the batches and the number of valid clouds in each.
+    '''
+    batches = []
+    sizes = []
+    for start_idx in range(0, data.shape[0], batch_size):
+        batch = data[start_idx:start_idx+batch_size]
+        sizes.append(batch.shape[0])
+        if batch.shape[0] < batch_size:
+            batch = np.concatenate([batch, data[0:batch_size-batch.shape[0]]], axis=0)
+        batches.append(np.ascontiguousarray(batch, dtype=np.float32))
+    return batches, sizes
+
+def time_predict(predict, batches, warmup, iterations, outputs=None, meter=None):
+    ''' Run predict over the batches round-robin.
+        The first `warmup` calls are not timed. Returns per-call latencies in seconds.
+        If outputs is a list, the outputs of the first pass over the batches
+        are appended to it. If meter is an energy.EnergyMeter, the energy of
+        every call is recorded.
+    '''
+    if meter is None:
+        meter = energy.EnergyMeter()
+    for i in range(warmup):
+        batch = batches[i % len(batches)]
+        with meter.batch(batch.shape[0], warmup=True):
+            predict(batch)
+    latencies = []
+    for i in range(iterations):
+        batch = batches[i % len(batches)]
+        s = time.time()
+        meter.begin_batch()
+        out = predict(batch)
+        meter.end_batch(batch.shape[0])
+        latencies.append(time.time() - s)
+        if outputs is not None and i < len(batches):
+            outputs.append(out)
+    return latencies
+
+def calibration_batches(FLAGS, num_channel=3, make_batch=synthetic_batch):
+    ''' Batches the int8 activation ranges are calibrated on, empty unless
+        FLAGS.precision has int8 activations. The first FLAGS.num_calibration
+        clouds of FLAGS.calibration_file, or synthetic clouds with seeds that
+        the timed batches do not use.
+    '''
+    if FLAGS.precision is None or quant_util.activation_type(FLAGS.precision) != 'int8':
+        return []
+    if FLAGS.calibration_file is not None:
+        data, _ = load_inputs(FLAGS.calibration_file)
+        return split_batches(data[0:FLAGS.num_calibration], FLAGS.batch_size)[0]
+    num_batches = (FLAGS.num_calibration + FLAGS.batch_size - 1) // FLAGS.batch_size
+    return [make_batch(FLAGS.batch_size, FLAGS.num_point, num_channel, FLAGS.seed + CALIBRATION_SEED + i) \
+        for i in range(num_batches)]
+
+def concat_outputs(outputs, sizes):
+    ''' Concatenate per-batch output dicts, dropping the padded clouds. '''
+    return dict((k, np.concatenate([o[k][0:n] for o, n in zip(outputs, sizes)], axis=0)) \
+        for k in outputs[0])
+
+def run_benchmark(network, FLAGS, predict, num_channel=3, make_batch=synthetic_batch, num_batches=4):
+    ''' Benchmark predict on synthetic inputs and report the statistics.
+        Input:
+          network: network name as used by launcher.py
+          FLAGS: parsed flags from add_benchmark_args
+          predict: function from a BxNxC numpy batch to a dict of numpy outputs;
+            for --trace_file, TensorFlow predicts also take the options and
+            run_metadata of session.run as keyword arguments
+          make_batch: function(batch_size, num_point, num_channel, seed) building an input batch
+          num_batches: distinct batches cycled through during timing
+        Return:
+          dict with the configuration, latency percentiles, throughput and peak RSS
+    '''
+    if FLAGS.input_file is not None:
+        data, _ = load_inputs(FLAGS.input_file)
+        assert data.shape[1] == FLAGS.num_point and data.shape[2] == num_channel, \
+            'input file holds %s clouds, expected Nx%d with N=%d' % (str(data.shape), num_channel, FLAGS.num_point)
+        batches, sizes = split_batches(data, FLAGS.batch_size)
+        # Every cloud of the file goes through the model at least once
+        iterations = max(FLAGS.iterations, len(batches))
+    else:
+        batches = [make_batch(FLAGS.batch_size, FLAGS.num_point, num_channel, FLAGS.seed + i) \
+            for i in range(num_batches)]
+        iterations = FLAGS.iterations
+    outputs = [] if FLAGS.output_file is not None else None
+    backend = energy.get_backend(FLAGS.energy_backend) if FLAGS.energy_backend is not None else None
+    meter = energy.EnergyMeter(backend, FLAGS.energy_rate)
+    with meter:
+        latencies = time_predict(predict, batches, FLAGS.warmup, iterations, outputs, meter)
+
+    result = {'network': network,
+              'variant': FLAGS.variant,
+              'batch_size': FLAGS.batch_size,
+              'num_point': FLAGS.num_point,
+              'warmup': FLAGS.warmup,
+              'model_path': FLAGS.model_path,
+              'input_file': FLAGS.input_file,
+              'precision': FLAGS.precision,
+              'cpu': FLAGS.cpu}
+    result.update(summarize(latencies, FLAGS.batch_size))
+    result['peak_rss_mb'] = peak_rss_mb()
+    if meter.enabled:
+        report = meter.report()
+        result['energy_backend'] = FLAGS.energy_backend
+        result['energy_report'] = report
+        # no inference batch ran with --iterations 0 or only warm-up batches
+        inference = report['totals'].get('inference')
+        if inference is not None:
+            result['joules_per_batch'] = inference['joules_per_phase']
+            result['joules_per_sample'] = inference['joules_per_sample']
+            result['avg_watts'] = inference['avg_watts']
+
+    if FLAGS.trace_file is not None:
+        trace_batches = [batches[i % len(batches)] for i in range(FLAGS.trace_iterations)]
+        metadata = dict((k, result[k]) for k in ['network', 'variant', 'batch_size', 'num_point'])
+        if FRAMEWORKS[network] == 'pytorch':
+            trace_util.collect_torch_trace(predict, trace_batches, FLAGS.trace_file, metadata)
+        else:
+            trace_util.collect_tf_trace(predict, trace_batches, FLAGS.trace_file, metadata)
+        result['trace_file'] = FLAGS.trace_file
+
+    print_result(result)
+    if outputs is not None and FLAGS.input_file is not None:
+        out_dir = os.path.dirname(FLAGS.output_file)
+        if out_dir and not os.path.exists(out_dir): os.makedirs(out_dir)
+        np.savez(FLAGS.output_file, **concat_outputs(outputs, sizes))
+    if FLAGS.result_file is not None:
+        write_result(FLAGS.result_file, result)
+    return result
+
+def print_result(result):
+    print('%s [%s] batch %d x %d points' % (result['network'], VARIANT_NAMES[result['variant']],
+        result['batch_size'], result['num_point']))
+    if result.get('precision') is not None:
+        print('  precision: %s on the %s' % (result['precision'], 'CPU' if result['cpu'] else 'GPU'))
+    print('  latency p50/p95/p99 (ms): %.3f / %.3f / %.3f' % (result['latency_p50_ms'],
+        result['latency_p95_ms'], result['latency_p99_ms']))
+    print('  throughput (samples/sec): %.2f' % result['samples_per_sec'])
+    print('  peak RSS (MB): %.1f' % result['peak_rss_mb'])
+    if 'joules_per_sample' in result:
+        print('  energy (J/sample): %.6f at %.2f W' % (result['joules_per_sample'], result['avg_watts']))
+    sys.stdout.flush()
+
+def write_result(filename, result):
+    dir_path = os.path.dirname(filename)
+    if dir_path and not os.path.exists(dir_path): os.makedirs(dir_path)
+    with open(filename, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+def read_result(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def format_table(header, rows):
+    ''' Format a list of rows (lists of strings) as an aligned plain text table. '''
+    widths = [max(len(str(r[i])) for r in [header] + rows) for i in range(len(header))]
+    lines = ['  '.join(str(h).ljust(w) for h, w in zip(header, widths)).rstrip()]
+    lines.append('  '.join('-' * w for w in widths))
+    for r in rows:
+        lines.append('  '.join(str(c).ljust(w) for c, w in zip(r, widths)).rstrip())
+    return '\n'.join(lines)
@@ -0,0 +1,257 @@
+'''
+    Compare the aggregation variants of one network on identical inputs.
+
+    The same clouds are written once to an .npz file and fed through every
+    variant's benchmark.py (each in its own process, since the variants share
+    module names). The outputs are then checked for agreement against the
+    reference variant (baseline by default), and a table of accuracy, output
+    divergence, speedup, memory reduction and, when the results carry power
+    data, energy per sample is printed and saved.
+
+    With --precisions every variant also runs with its conv and FC layers
+    quantized (see quant_util.py), and every precision is compared against
+    the first one of the same variant: the accuracy-vs-speed report of the
+    quantization. int8 activations are calibrated on clouds of the training
+    split (modelnet40) or on other synthetic clouds than the inputs.
+
+    Usage (from the root directory):
+        python Benchmark/compare.py --network pointnet2 --data modelnet40
+        python Benchmark/compare.py --network dgcnn --data modelnet40 --precisions fp32,fp16,int8 --cpu
+'''
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(BASE_DIR)
+import bench_util
+import quant_util
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--network', required=True, choices=sorted(bench_util.BENCHMARK_SCRIPTS.keys()), help='Network to compare')
+parser.add_argument('--variants', default=None, help='Comma separated variants to compare [default: all variants of the network]')
+parser.add_argument('--reference', default='baseline', help='Variant the others are compared against [default: baseline]')
+parser.add_argument('--data', default='synthetic', choices=['synthetic', 'modelnet40'], help='Input clouds; modelnet40 adds labels for accuracy [default: synthetic]')
+parser.add_argument('--num_samples', type=int, default=256, help='Number of clouds fed through every variant [default: 256]')
+parser.add_argument('--batch_size', type=int, default=None, help='Batch size [default: network default]')
+parser.add_argument('--num_point', type=int, default=1024, help='Points per cloud [default: 1024]')
+parser.add_argument('--warmup', type=int, default=10, help='Untimed warm-up iterations [default: 10]')
+parser.add_argument('--iterations', type=int, default=100, help='Timed iterations [default: 100]')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic clouds [default: 0]')
+parser.add_argument('--energy_backend', default=None, help='Measure energy per sample with this PowerMeasurement backend: auto, jetson or rapl [default: None]')
+parser.add_argument('--random_weights', action='store_true', help='Do not restore the pre-trained checkpoints; outputs will not agree')
+parser.add_argument('--precisions', default=None, help='Comma separated precisions every variant runs at, the first is the reference, e.g. fp32,fp16,int8_fp16,int8 [default: None, the models as built]')
+parser.add_argument('--num_calibration', type=int, default=256, help='Clouds the int8 activation ranges are calibrated on [default: 256]')
+parser.add_argument('--cpu', action='store_true', help='With --precisions, run the layers on the CPU')
+parser.add_argument('--output_dir', default=None, help='Where inputs, outputs and the report go [default: Benchmark/results/compare_[NETWORK]]')
+
+DATASET_DIR = os.path.join(ROOT_DIR, 'Datasets')
+NUM_CHANNEL = {'frustum-pointnets': 4}
+# Output holding the class scores used for accuracy and agreement
+PRIMARY_OUTPUT = {'frustum-pointnets': 'mask_logits'}
+SCORE_OUTPUTS = ['logits', 'mask_logits', 'heading_scores', 'size_scores']
+
+def load_modelnet40(num_samples, num_point, split='test'):
+    ''' First num_samples clouds of a ModelNet40 split with labels. '''
+    import h5py
+    list_filename = os.path.join(DATASET_DIR, 'modelnet40_ply_hdf5_2048/%s_files.txt' % split)
+    data = []
+    label = []
+    count = 0
+    for line in open(list_filename):
+        f = h5py.File(os.path.join(DATASET_DIR, line.rstrip().split('data/')[1]), 'r')
+        data.append(f['data'][:, 0:num_point, :])
+        label.append(np.squeeze(f['label'][:]))
+        count += data[-1].shape[0]
+        if count >= num_samples: break
+    return np.concatenate(data)[0:num_samples].astype(np.float32), \
+        np.concatenate(label)[0:num_samples].astype(np.int32)
+
+def make_inputs(FLAGS):
+    channel = NUM_CHANNEL.get(FLAGS.network, 3)
+    if FLAGS.data == 'modelnet40':
+        assert channel == 3, '%s does not take ModelNet40 clouds' % FLAGS.network
+        return load_modelnet40(FLAGS.num_samples, FLAGS.num_point)
+    if FLAGS.network == 'frustum-pointnets':
+        make_batch = bench_util.synthetic_frustum_batch
+    else:
+        make_batch = bench_util.synthetic_batch
+    return make_batch(FLAGS.num_samples, FLAGS.num_point, channel, FLAGS.seed), None
+
+def make_calibration(FLAGS):
+    ''' Clouds the int8 activation ranges are calibrated on, none of them an input. '''
+    if FLAGS.data == 'modelnet40':
+        return load_modelnet40(FLAGS.num_calibration, FLAGS.num_point, 'train')[0]
+    if FLAGS.network == 'frustum-pointnets':
+        make_batch = bench_util.synthetic_frustum_batch
+    else:
+        make_batch = bench_util.synthetic_batch
+    return make_batch(FLAGS.num_calibration, FLAGS.num_point, NUM_CHANNEL.get(FLAGS.network, 3),
+        FLAGS.seed + bench_util.CALIBRATION_SEED)
+
+def run_name(variant, precision):
+    return variant if precision is None else '%s-%s' % (variant, precision)
+
+def run_variant(FLAGS, variant, input_file, output_dir, precision=None, calibration_file=None):
+    ''' Run benchmark.py of one variant on the input file, at precision if given.
+        Return (result dict, outputs dict), or (None, None) if it failed.
+    '''
+    name = run_name(variant, precision)
+    result_file = os.path.join(output_dir, '%s_result.json' % name)
+    output_file = os.path.join(output_dir, '%s_outputs.npz' % name)
+    for f in [result_file, output_file]:
+        if os.path.exists(f): os.remove(f)
+    cmd = '%s --variant %s --num_point %d --warmup %d --iterations %d --input_file %s --output_file %s --result_file %s' % \
+        (bench_util.BENCHMARK_SCRIPTS[FLAGS.network], variant, FLAGS.num_point, FLAGS.warmup,
+        FLAGS.iterations, input_file, output_file, result_file)
+    if FLAGS.batch_size is not None:
+        cmd += ' --batch_size %d' % FLAGS.batch_size
+    if FLAGS.energy_backend is not None:
+        cmd += ' --energy_backend %s' % FLAGS.energy_backend
+    if not FLAGS.random_weights:
+        cmd += ' --model_path %s' % bench_util.CHECKPOINTS[FLAGS.network][variant]
+    if precision is not None:
+        cmd += ' --precision %s --num_calibration %d' % (precision, FLAGS.num_calibration)
+        if calibration_file is not None:
+            cmd += ' --calibration_file %s' % calibration_file
+        if FLAGS.cpu:
+            cmd += ' --cpu'
+    dir_path = os.path.join(ROOT_DIR, 'Networks', FLAGS.network)
+    print('running %s version of %s%s ...\n' % (bench_util.VARIANT_NAMES[variant], FLAGS.network,
+        '' if precision is None else ' in %s' % precision))
+    os.system('cd %s; %s' % (dir_path, cmd))
+    result = bench_util.read_result(result_file)
+    if result is None or not os.path.exists(output_file):
+        return None, None
+    outputs = np.load(output_file)
+    return result, dict((k, outputs[k]) for k in outputs.files)
+
+def softmax(x):
+    probs = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    probs /= np.sum(probs, axis=-1, keepdims=True)
+    return probs
+
+def compare_outputs(ref, out, label=None, primary='logits'):
+    ''' Agreement of one variant's outputs with the reference outputs. '''
+    metrics = {}
+    for k in sorted(set(ref.keys()) & set(out.keys())):
+        diff = np.abs(out[k].astype(np.float64) - ref[k].astype(np.float64))
+        metrics[k] = {'max_abs_diff': float(np.max(diff)), 'mean_abs_diff': float(np.mean(diff))}
+        if k in SCORE_OUTPUTS:
+            p = softmax(ref[k].astype(np.float64))
+            q = softmax(out[k].astype(np.float64))
+            kl = np.sum(p * (np.log(p + 1e-12) - np.log(q + 1e-12)), axis=-1)
+            metrics[k]['top1_agreement'] = float(np.mean(np.argmax(ref[k], -1) == np.argmax(out[k], -1)))
+            metrics[k]['mean_kl'] = float(np.mean(kl))
+    if label is not None and primary in out:
+        metrics['accuracy'] = float(np.mean(np.argmax(out[primary], -1) == label))
+    return metrics
+
+def build_report(FLAGS, runs, results, metrics, references):
+    ''' Build the summary table rows, every run relative to its reference run.
+        runs: [(run name, variant, precision)], references: {run name: reference run name}
+    '''
+    primary = PRIMARY_OUTPUT.get(FLAGS.network, 'logits')
+    has_energy = any('joules_per_sample' in r for r in results.values())
+    has_precision = any(precision is not None for _, _, precision in runs)
+    header = ['variant'] + (['precision'] if has_precision else []) + \
+             ['p50 (ms)', 'speedup', 'samples/sec', 'peak RSS (MB)', 'mem. reduction',
+              'accuracy', 'acc. delta', 'top-1 agree', 'max |d logit|', 'mean KL']
+    if has_energy:
+        header += ['J/sample', 'energy reduction']
+    rows = []
+    for name, variant, precision in runs:
+        r = results[name]
+        m = metrics[name]
+        ref = results[references[name]]
+        row = [variant] + ([precision] if has_precision else [])
+        row += ['%.3f' % r['latency_p50_ms'],
+                '%.2fx' % (ref['latency_p50_ms'] / r['latency_p50_ms']),
+                '%.2f' % r['samples_per_sec'], '%.1f' % r['peak_rss_mb'],
+                '%.1f%%' % (100.0 * (1.0 - r['peak_rss_mb'] / ref['peak_rss_mb']))]
+        if 'accuracy' in m:
+            row += ['%.4f' % m['accuracy'], '%+.4f' % (m['accuracy'] - metrics[references[name]]['accuracy'])]
+        else:
+            row += ['-', '-']
+        row += ['%.4f' % m[primary]['top1_agreement'], '%.4g' % m[primary]['max_abs_diff'],
+                '%.4g' % m[primary]['mean_kl']]
+        if has_energy:
+            if 'joules_per_sample' in r and 'joules_per_sample' in ref:
+                row += ['%.4g' % r['joules_per_sample'],
+                        '%.1f%%' % (100.0 * (1.0 - r['joules_per_sample'] / ref['joules_per_sample']))]
+            else:
+                row += ['-', '-']
+        rows.append(row)
+    return header, rows
+
+def main():
+    FLAGS = parser.parse_args()
+    available = bench_util.BENCHMARK_VARIANTS[FLAGS.network]
+    variants = available if FLAGS.variants is None else FLAGS.variants.split(',')
+    for v in variants + [FLAGS.reference]:
+        if v not in available:
+            print('[ERROR]: %s has no %s version.' % (FLAGS.network, v))
+            exit()
+    if FLAGS.reference not in variants:
+        variants = [FLAGS.reference] + variants
+    variants = [v for v in bench_util.VARIANTS if v in variants]
+    precisions = [None] if FLAGS.precisions is None else FLAGS.precisions.split(',')
+    for p in precisions:
+        if p is not None and p not in quant_util.PRECISIONS:
+            print('[ERROR]: unknown precision %s, choose from %s.' % (p, ', '.join(quant_util.PRECISIONS)))
+            exit()
+    runs = [(run_name(v, p), v, p) for v in variants for p in precisions]
+    # the variants are compared with each other, or with --precisions every
+    # precision with the first one of the same variant
+    if FLAGS.precisions is None:
+        references = dict((name, FLAGS.reference) for name, _, _ in runs)
+        reference = FLAGS.reference
+    else:
+        references = dict((name, run_name(v, precisions[0])) for name, v, _ in runs)
+        reference = '%s of every variant%s' % (precisions[0], ' on the CPU' if FLAGS.cpu else '')
+    output_dir = FLAGS.output_dir
+    if output_dir is None:
+        output_dir = os.path.join(BASE_DIR, 'results', 'compare_%s' % FLAGS.network)
+    output_dir = os.path.abspath(output_dir)
+    if not os.path.exists(output_dir): os.makedirs(output_dir)
+
+    data, label = make_inputs(FLAGS)
+    input_file = os.path.join(output_dir, 'inputs.npz')
+    bench_util.save_inputs(input_file, data, label)
+    calibration_file = None
+    if any(p is not None and quant_util.activation_type(p) == 'int8' for p in precisions):
+        calibration_file = os.path.join(output_dir, 'calibration.npz')
+        bench_util.save_inputs(calibration_file, make_calibration(FLAGS))
+
+    results = {}
+    outputs = {}
+    for name, v, p in runs:
+        results[name], outputs[name] = run_variant(FLAGS, v, input_file, output_dir, p, calibration_file)
+        if results[name] is None:
+            print('[ERROR]: %s version of %s failed.' % (name, FLAGS.network))
+            exit()
+
+    primary = PRIMARY_OUTPUT.get(FLAGS.network, 'logits')
+    metrics = dict((name, compare_outputs(outputs[references[name]], outputs[name], label, primary)) \
+        for name, _, _ in runs)
+    header, rows = build_report(FLAGS, runs, results, metrics, references)
+    table = bench_util.format_table(header, rows)
+    print('\n%s: %d clouds (%s), reference %s' % (FLAGS.network, data.shape[0], FLAGS.data, reference))
+    if FLAGS.random_weights:
+        print('[WARNING]: random weights, outputs of different variants are not expected to agree.')
+    print(table)
+
+    with open(os.path.join(output_dir, 'report.txt'), 'w') as f:
+        f.write(table + '\n')
+    with open(os.path.join(output_dir, 'report.json'), 'w') as f:
+        json.dump({'network': FLAGS.network, 'data': FLAGS.data, 'reference': reference,
+                   'references': references, 'results': results, 'metrics': metrics},
+                  f, indent=2, sort_keys=True)
+
+if __name__=='__main__':
+    main()
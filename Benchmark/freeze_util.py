@@ -0,0 +1,674 @@
+'''
+    Export the TensorFlow networks as frozen inference graphs.
+
+    export_frozen_graph takes a session with a restored checkpoint and
+    rewrites its graph for inference only:
+      - variables become constants and is_training becomes constant False,
+      - the training branches of tf.cond (batch statistics, moving average
+        updates, dropout) are removed,
+      - nodes that only depend on constants are evaluated once and stored
+        as constants, e.g. the idx_ batch offsets of the edge features,
+      - batch norm is folded into the weights and biases of the conv or FC
+        layer in front of it. This works on the graph, so it does not
+        matter whether a network uses tf.contrib.layers.batch_norm or its
+        own moving averages.
+    The inputs and outputs are named inputs/<key> and outputs/<key>, and
+    load_frozen_graph returns them by key.
+
+    quantize_graph rewrites the conv and FC layers of a frozen graph for the
+    fp16 and int8 precisions of quant_util.py, and quantized_session does
+    the freezing, calibration and quantization of a restored session in one
+    go for the benchmarks.
+
+    Networks with custom ops (tf_ops) must import them before exporting or
+    loading, as for any graph that uses them.
+
+    Kept compatible with python2 since F-PointNet still runs under python2.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import tensor_util
+import quant_util
+tfv1 = tf.compat.v1 if hasattr(tf, 'compat') and hasattr(tf.compat, 'v1') else tf
+
+INPUT_SCOPE = 'inputs'
+OUTPUT_SCOPE = 'outputs'
+IMPORT_SCOPE = 'frozen'
+
+SWITCH_OPS = set(['Switch', 'RefSwitch'])
+MERGE_OPS = set(['Merge', 'RefMerge'])
+# Never evaluated ahead of time, besides stateful ops
+UNFOLDABLE_OPS = SWITCH_OPS | MERGE_OPS | set(['Placeholder', 'PlaceholderWithDefault',
+    'Enter', 'RefEnter', 'Exit', 'RefExit', 'NextIteration', 'RefNextIteration',
+    'LoopCond', 'Variable', 'VariableV2', 'VarHandleOp', 'ReadVariableOp', 'NoOp'])
+# Ops with statically known outputs once the input shape is known
+SHAPE_OPS = set(['Shape', 'Size', 'Rank'])
+FUSED_BATCH_NORM_OPS = set(['FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3'])
+# Ops allowed between a layer and its batch norm, they keep the channels last
+PASSTHROUGH_OPS = set(['Identity', 'Reshape', 'Squeeze'])
+# Constants larger than this are left to be computed at run time
+MAX_FOLDED_BYTES = 16 * 1024 * 1024
+
+# ----------------------------------------------------------------------------
+# GraphDef helpers
+# ----------------------------------------------------------------------------
+
+def _parse_input(ref):
+    ''' (node name, output port, is control input) of a NodeDef input. '''
+    if ref.startswith('^'):
+        return ref[1:], -1, True
+    name, _, port = ref.partition(':')
+    return name, int(port) if port else 0, False
+
+def _input_ref(name, port):
+    return name if port == 0 else '%s:%d' % (name, port)
+
+def _consumers(graph_def):
+    ''' {node name: [(consumer node, output port, is control input)]} '''
+    consumers = {}
+    for node in graph_def.node:
+        for ref in node.input:
+            name, port, control = _parse_input(ref)
+            consumers.setdefault(name, []).append((node, port, control))
+    return consumers
+
+def _copy_graph_def(graph_def, nodes):
+    output = tfv1.GraphDef()
+    output.versions.CopyFrom(graph_def.versions)
+    output.library.CopyFrom(graph_def.library)
+    output.node.extend(nodes)
+    return output
+
+def _const_value(node):
+    return tensor_util.MakeNdarray(node.attr['value'].tensor)
+
+def _make_const(name, value, dtype):
+    dtype = tf.as_dtype(dtype)
+    value = np.asarray(value)
+    node = tfv1.NodeDef()
+    node.op = 'Const'
+    node.name = name
+    node.attr['dtype'].type = dtype.as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(
+        tensor_util.make_tensor_proto(value, dtype=dtype, shape=value.shape))
+    return node
+
+def _make_node(op, name, inputs, dtype_enum):
+    node = tfv1.NodeDef()
+    node.op = op
+    node.name = name
+    node.input.extend(inputs)
+    node.attr['T'].type = dtype_enum
+    return node
+
+def _rename_nodes(graph_def, names):
+    ''' Rename nodes {old: new}, along with the references to them. '''
+    for node in graph_def.node:
+        if node.name in names:
+            node.name = names[node.name]
+        for i, ref in enumerate(node.input):
+            name, port, control = _parse_input(ref)
+            if name in names:
+                node.input[i] = '^' + names[name] if control else _input_ref(names[name], port)
+
+def _replace_node(graph_def, new_node):
+    for node in graph_def.node:
+        if node.name == new_node.name:
+            node.CopyFrom(new_node)
+
+# ----------------------------------------------------------------------------
+# Graph rewrites
+# ----------------------------------------------------------------------------
+
+def _strip_dead_branches(graph_def):
+    ''' Replace the switches with a constant predicate by their input, and
+        remove the nodes of the branches that can never run. Merges left with
+        one live input are replaced by it. Return the new graph and the number
+        of switches removed. '''
+    nodes = dict((node.name, node) for node in graph_def.node)
+    alias = {} # (name, port) -> input ref that replaces it
+    dead = set() # nodes that never run
+    dead_ports = set() # (name, port) outputs that are never produced
+    removed_switches = set()
+    for node in graph_def.node:
+        if node.op in SWITCH_OPS:
+            # tf.cond reads the predicate through an identity
+            pred = nodes.get(_parse_input(node.input[1])[0])
+            while pred is not None and pred.op == 'Identity':
+                pred = nodes.get(_parse_input(pred.input[0])[0])
+            if pred is not None and pred.op == 'Const':
+                live = 1 if _const_value(pred) else 0
+                alias[(node.name, live)] = node.input[0]
+                dead_ports.add((node.name, 1 - live))
+                removed_switches.add(node.name)
+    if not removed_switches:
+        return graph_def, 0
+
+    def is_dead(ref):
+        name, port, control = _parse_input(ref)
+        return name in dead or (not control and (name, port) in dead_ports)
+
+    # a node is dead once any input is, a merge once all data inputs are
+    changed = True
+    while changed:
+        changed = False
+        for node in graph_def.node:
+            if node.name in dead or node.name in removed_switches:
+                continue
+            if node.op in MERGE_OPS:
+                node_dead = all(is_dead(ref) for ref in node.input if not ref.startswith('^'))
+            else:
+                node_dead = any(is_dead(ref) for ref in node.input)
+            if node_dead:
+                dead.add(node.name)
+                changed = True
+
+    used_ports = set()
+    for node in graph_def.node:
+        for ref in node.input:
+            name, port, control = _parse_input(ref)
+            if not control:
+                used_ports.add((name, port))
+    removed = dead | removed_switches
+    merges = {} # merges with dead inputs -> their live data inputs
+    for node in graph_def.node:
+        if node.op in MERGE_OPS and node.name not in dead:
+            live = [ref for ref in node.input if not ref.startswith('^') and not is_dead(ref)]
+            if len(live) == 1 and (node.name, 1) not in used_ports:
+                alias[(node.name, 0)] = live[0]
+                removed.add(node.name)
+            elif len(live) < node.attr['N'].i:
+                merges[node.name] = live
+
+    def resolve(ref):
+        name, port, control = _parse_input(ref)
+        if control:
+            port = 0
+        while (name, port) in alias:
+            name, port, _ = _parse_input(alias[(name, port)])
+        if name in removed:
+            return None # control input of a removed switch
+        return '^' + name if control else _input_ref(name, port)
+
+    output = []
+    for node in graph_def.node:
+        if node.name in removed:
+            continue
+        new_node = tfv1.NodeDef()
+        new_node.CopyFrom(node)
+        del new_node.input[:]
+        if node.name in merges:
+            new_node.input.extend(resolve(ref) for ref in merges[node.name])
+            new_node.attr['N'].i = len(merges[node.name])
+        for ref in node.input:
+            if node.name in merges and not ref.startswith('^'):
+                continue
+            ref = resolve(ref)
+            if ref is not None and not (ref.startswith('^') and ref in new_node.input):
+                new_node.input.append(ref)
+        output.append(new_node)
+    return _copy_graph_def(graph_def, output), len(removed_switches)
+
+def _fold_constants(graph_def):
+    ''' Evaluate the nodes that only depend on constants, and replace those
+        of them that have other consumers by constants. Return the new graph
+        and the number of nodes replaced. '''
+    graph = tfv1.Graph()
+    with graph.as_default():
+        tfv1.import_graph_def(graph_def, name='')
+    foldable = set()
+    static = {} # shape ops of inputs with a known shape -> value
+    for op in graph.get_operations(): # in topological order
+        if op.type == 'Const':
+            foldable.add(op.name)
+            continue
+        if op.type in UNFOLDABLE_OPS or len(op.outputs) != 1 or \
+           (op.op_def is not None and op.op_def.is_stateful):
+            continue
+        if op.type in SHAPE_OPS and op.inputs[0].get_shape().is_fully_defined():
+            shape = op.inputs[0].get_shape().as_list()
+            static[op.name] = {'Shape': shape, 'Size': int(np.prod(shape)), 'Rank': len(shape)}[op.type]
+            foldable.add(op.name)
+            continue
+        if any(t.op.name not in foldable for t in op.inputs) or \
+           any(c.name not in foldable for c in op.control_inputs):
+            continue
+        output = op.outputs[0]
+        if output.get_shape().is_fully_defined() and output.dtype != tf.string and \
+           output.get_shape().num_elements() * output.dtype.size > MAX_FOLDED_BYTES:
+            continue
+        foldable.add(op.name)
+
+    frontier = []
+    for op in graph.get_operations():
+        if op.name in foldable and op.type != 'Const' and \
+           any(c.name not in foldable for c in op.outputs[0].consumers()):
+            frontier.append(op)
+    if not frontier:
+        return graph_def, 0
+    evaluated = [op for op in frontier if op.name not in static]
+    values = dict((op.name, static[op.name]) for op in frontier if op.name in static)
+    if evaluated:
+        config = tfv1.ConfigProto()
+        config.allow_soft_placement = True
+        config.gpu_options.allow_growth = True
+        with tfv1.Session(graph=graph, config=config) as sess:
+            results = sess.run([op.outputs[0] for op in evaluated])
+        for op, value in zip(evaluated, results):
+            if np.asarray(value).nbytes <= MAX_FOLDED_BYTES:
+                values[op.name] = value
+
+    dtypes = dict((op.name, op.outputs[0].dtype) for op in frontier)
+    output = []
+    for node in graph_def.node:
+        if node.name in values:
+            output.append(_make_const(node.name, values[node.name], dtypes[node.name]))
+        else:
+            output.append(node)
+    return _copy_graph_def(graph_def, output), len(values)
+
+def _convert_fused_batch_norms(graph_def):
+    ''' Turn the inference mode fused batch norms with constant parameters into
+        a multiplication and an addition, which _fold_batch_norms folds into
+        the layer in front of them. Return the number of batch norms converted. '''
+    nodes = dict((node.name, node) for node in graph_def.node)
+    consumers = _consumers(graph_def)
+    new_nodes = []
+    for node in graph_def.node:
+        if node.op not in FUSED_BATCH_NORM_OPS or node.attr['is_training'].b:
+            continue
+        if any(port != 0 for _, port, control in consumers.get(node.name, []) if not control):
+            continue
+        params = [nodes.get(_parse_input(ref)[0]) for ref in node.input[1:5]]
+        if any(p is None or p.op != 'Const' for p in params):
+            continue
+        gamma, beta, mean, variance = [_const_value(p).astype(np.float64) for p in params]
+        scale = gamma / np.sqrt(variance + node.attr['epsilon'].f)
+        shift = beta - mean * scale
+        if node.attr['data_format'].s == b'NCHW':
+            scale = scale.reshape((-1, 1, 1))
+            shift = shift.reshape((-1, 1, 1))
+        dtype_enum = node.attr['T'].type
+        dtype = tf.as_dtype(dtype_enum)
+        controls = [ref for ref in node.input if ref.startswith('^')]
+        new_nodes.append(_make_const(node.name + '/folded_scale', scale, dtype))
+        new_nodes.append(_make_const(node.name + '/folded_shift', shift, dtype))
+        new_nodes.append(_make_node('Mul', node.name + '/folded_mul',
+            [node.input[0], node.name + '/folded_scale'] + controls, dtype_enum))
+        # keep the name, the consumers now read the addition
+        node.CopyFrom(_make_node('Add', node.name,
+            [node.name + '/folded_mul', node.name + '/folded_shift'], dtype_enum))
+    graph_def.node.extend(new_nodes)
+    return len(new_nodes) // 3
+
+def _channel_vector(value, num_channels):
+    ''' value as a vector over the channels if it only varies along the last
+        axis, else None. '''
+    if value.ndim > 0 and (value.size != value.shape[-1] or value.shape[-1] not in (1, num_channels)):
+        return None
+    return np.broadcast_to(value.reshape(-1), (num_channels,))
+
+def _fold_batch_norms(graph_def):
+    ''' Fold x * scale + shift into the conv or FC layer that computes x:
+            Conv2D/MatMul -> BiasAdd [-> Identity/Reshape/Squeeze]* -> Mul -> Add
+        becomes Conv2D/MatMul with weights * scale -> BiasAdd with
+        bias * scale + shift. Return the number of layers folded. '''
+    nodes = dict((node.name, node) for node in graph_def.node)
+    consumers = _consumers(graph_def)
+
+    def const_operand(node):
+        ''' (constant value, input ref of the other operand) of a binary op. '''
+        if len([ref for ref in node.input if not ref.startswith('^')]) != 2:
+            return None, None
+        for i in range(2):
+            const = nodes.get(_parse_input(node.input[i])[0])
+            if const is not None and const.op == 'Const':
+                return _const_value(const), node.input[1 - i]
+        return None, None
+
+    def single_consumer(name):
+        data = [c for c in consumers.get(name, []) if not c[2]]
+        return len(data) == 1 and data[0][1] == 0
+
+    new_nodes = []
+    folded = 0
+    for add in graph_def.node:
+        if add.op not in ('Add', 'AddV2'):
+            continue
+        shift, mul_ref = const_operand(add)
+        mul = nodes.get(_parse_input(mul_ref)[0]) if mul_ref is not None else None
+        if mul is None or mul.op != 'Mul' or not single_consumer(mul.name):
+            continue
+        scale, x_ref = const_operand(mul)
+        if scale is None:
+            continue
+        chain = []
+        bias_add = nodes.get(_parse_input(x_ref)[0])
+        while bias_add is not None and bias_add.op in PASSTHROUGH_OPS and single_consumer(bias_add.name):
+            chain.append(bias_add)
+            bias_add = nodes.get(_parse_input(bias_add.input[0])[0])
+        if bias_add is None or bias_add.op != 'BiasAdd' or not single_consumer(bias_add.name) or \
+           bias_add.attr['data_format'].s not in (b'', b'NHWC'):
+            continue
+        bias = nodes.get(_parse_input(bias_add.input[1])[0])
+        layer = nodes.get(_parse_input(bias_add.input[0])[0])
+        if bias is None or bias.op != 'Const' or layer is None or not single_consumer(layer.name):
+            continue
+        if layer.op == 'Conv2D' and layer.attr['data_format'].s in (b'', b'NHWC'):
+            axis = -1
+        elif layer.op == 'MatMul':
+            axis = 0 if layer.attr['transpose_b'].b else -1
+        else:
+            continue
+        weights = nodes.get(_parse_input(layer.input[1])[0])
+        if weights is None or weights.op != 'Const':
+            continue
+        bias_value = _const_value(bias)
+        num_channels = bias_value.shape[-1]
+        scale = _channel_vector(scale, num_channels)
+        shift = _channel_vector(shift, num_channels)
+        if scale is None or shift is None:
+            continue
+        # a reshape keeps the channels only if the last dimension stays
+        if any(n.op == 'Reshape' and not _keeps_last_dim(nodes.get(_parse_input(n.input[1])[0]), num_channels) \
+               for n in chain) or any(n.op == 'Squeeze' and num_channels == 1 for n in chain):
+            continue
+
+        weights_value = _const_value(weights)
+        shape = [1] * weights_value.ndim
+        shape[axis] = num_channels
+        new_weights = weights_value * scale.reshape(shape).astype(weights_value.dtype)
+        new_bias = (bias_value * scale + shift).astype(bias_value.dtype)
+        new_nodes.append(_make_const(layer.name + '/folded_weights', new_weights, weights_value.dtype))
+        new_nodes.append(_make_const(bias_add.name + '/folded_bias', new_bias, bias_value.dtype))
+        layer.input[1] = layer.name + '/folded_weights'
+        bias_add.input[1] = bias_add.name + '/folded_bias'
+        controls = [ref for ref in add.input if ref.startswith('^')]
+        dtype_enum = add.attr['T'].type
+        add.CopyFrom(_make_node('Identity', add.name, [x_ref] + controls, dtype_enum))
+        folded += 1
+    graph_def.node.extend(new_nodes)
+    return folded
+
+def _keeps_last_dim(shape_node, num_channels):
+    return shape_node is not None and shape_node.op == 'Const' and \
+        _const_value(shape_node).reshape(-1)[-1:].tolist() == [num_channels]
+
+def _remove_identities(graph_def, protected):
+    ''' Let the consumers of identities without control inputs read the input
+        of the identity directly. '''
+    alias = {}
+    for node in graph_def.node:
+        if node.op == 'Identity' and node.name not in protected and \
+           not any(ref.startswith('^') for ref in node.input):
+            alias[node.name] = node.input[0]
+    output = []
+    for node in graph_def.node:
+        if node.name in alias:
+            continue
+        new_node = tfv1.NodeDef()
+        new_node.CopyFrom(node)
+        del new_node.input[:]
+        for ref in node.input:
+            name, port, control = _parse_input(ref)
+            while name in alias and (control or port == 0):
+                name, port, _ = _parse_input(alias[name])
+            ref = '^' + name if control else _input_ref(name, port)
+            if not (control and ref in new_node.input):
+                new_node.input.append(ref)
+        output.append(new_node)
+    return _copy_graph_def(graph_def, output)
+
+# ----------------------------------------------------------------------------
+# Export and load
+# ----------------------------------------------------------------------------
+
+def export_frozen_graph(sess, inputs, outputs, is_training=None, filename=None):
+    ''' Freeze the graph of sess for inference.
+        inputs: {key: placeholder}, outputs: {key: tensor}; is_training: the
+        boolean placeholder of the model, fixed to False. The frozen graph is
+        written to filename if given.
+        Return the GraphDef and a dict of statistics.
+    '''
+    graph_def = sess.graph.as_graph_def()
+    stats = {'nodes_before': len(graph_def.node)}
+    if is_training is not None:
+        _replace_node(graph_def, _make_const(is_training.op.name, False, tf.bool))
+    _rename_nodes(graph_def, dict((t.op.name, '%s/%s' % (INPUT_SCOPE, key)) \
+        for key, t in inputs.items()))
+    keep = ['%s/%s' % (INPUT_SCOPE, key) for key in inputs]
+    for key, t in sorted(outputs.items()):
+        node = graph_def.node.add()
+        node.op = 'Identity'
+        node.name = '%s/%s' % (OUTPUT_SCOPE, key)
+        ref = t.name[:-2] if t.name.endswith(':0') else t.name
+        node.input.append(ref)
+        node.attr['T'].type = t.dtype.as_datatype_enum
+        keep.append(node.name)
+
+    # drop the training branches before the variables they update are frozen
+    graph_def, switches = _strip_dead_branches(graph_def)
+    graph_def = tfv1.graph_util.extract_sub_graph(graph_def, keep)
+    graph_def = tfv1.graph_util.convert_variables_to_constants(sess, graph_def, keep)
+    for node in graph_def.node:
+        node.device = ''
+        if '_class' in node.attr: # colocation with the former variables
+            del node.attr['_class']
+
+    folded = 0
+    while True:
+        graph_def, num_folded = _fold_constants(graph_def)
+        graph_def, num_switches = _strip_dead_branches(graph_def)
+        graph_def = tfv1.graph_util.extract_sub_graph(graph_def, keep)
+        folded += num_folded
+        switches += num_switches
+        if num_folded == 0 and num_switches == 0:
+            break
+
+    _convert_fused_batch_norms(graph_def)
+    batch_norms = _fold_batch_norms(graph_def)
+    graph_def = _remove_identities(graph_def, set(keep))
+    graph_def = tfv1.graph_util.extract_sub_graph(graph_def, keep)
+    stats.update({'nodes_after': len(graph_def.node), 'switches_removed': switches,
+                  'constants_folded': folded, 'batch_norms_folded': batch_norms})
+
+    if filename is not None:
+        with tfv1.gfile.GFile(filename, 'wb') as f:
+            f.write(graph_def.SerializeToString())
+    return graph_def, stats
+
+def format_stats(filename, stats):
+    return '%s: %d nodes (%d before), %d switches removed, %d constants folded, ' \
+        '%d batch norms folded' % (filename, stats['nodes_after'], stats['nodes_before'],
+        stats['switches_removed'], stats['constants_folded'], stats['batch_norms_folded'])
+
+def load_frozen_graph(filename):
+    ''' Import a graph written by export_frozen_graph into the default graph.
+        Return dicts {key: tensor} of its inputs and outputs.
+    '''
+    graph_def = tfv1.GraphDef()
+    with tfv1.gfile.GFile(filename, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    return _import_frozen_graph(graph_def)
+
+def _import_frozen_graph(graph_def):
+    tfv1.import_graph_def(graph_def, name=IMPORT_SCOPE)
+    graph = tfv1.get_default_graph()
+    inputs, outputs = {}, {}
+    for node in graph_def.node:
+        for scope, tensors in [(INPUT_SCOPE, inputs), (OUTPUT_SCOPE, outputs)]:
+            if node.name.startswith(scope + '/'):
+                tensors[node.name[len(scope) + 1:]] = \
+                    graph.get_tensor_by_name('%s/%s:0' % (IMPORT_SCOPE, node.name))
+    return inputs, outputs
+
+# ----------------------------------------------------------------------------
+# Quantization
+# ----------------------------------------------------------------------------
+
+QUANTIZED_OPS = set(['Conv2D', 'MatMul'])
+
+def _tensor_name(ref):
+    name, port, _ = _parse_input(ref)
+    return '%s:%d' % (name, port)
+
+def _make_cast(name, ref, src_dtype, dst_dtype):
+    node = tfv1.NodeDef()
+    node.op = 'Cast'
+    node.name = name
+    node.input.append(ref)
+    node.attr['SrcT'].type = tf.as_dtype(src_dtype).as_datatype_enum
+    node.attr['DstT'].type = tf.as_dtype(dst_dtype).as_datatype_enum
+    return node
+
+def _make_fake_quant(name, ref, lo, hi):
+    node = tfv1.NodeDef()
+    node.op = 'FakeQuantWithMinMaxArgs'
+    node.name = name
+    node.input.append(ref)
+    node.attr['min'].f = lo
+    node.attr['max'].f = hi
+    node.attr['num_bits'].i = quant_util.NUM_BITS
+    node.attr['narrow_range'].b = False
+    return node
+
+def _quantized_layers(graph_def):
+    ''' [(layer, weights, output channel axis)] of the float32 conv and FC
+        layers with constant weights. Conv2D filters are always HWIO. '''
+    nodes = dict((node.name, node) for node in graph_def.node)
+    layers = []
+    for node in graph_def.node:
+        if node.op not in QUANTIZED_OPS or node.attr['T'].type != tf.float32.as_datatype_enum:
+            continue
+        weights = nodes.get(_parse_input(node.input[1])[0])
+        if weights is None or weights.op != 'Const':
+            continue
+        if node.op == 'MatMul':
+            axis = 0 if node.attr['transpose_b'].b else 1
+        else:
+            axis = 3
+        layers.append((node, weights, axis))
+    return layers
+
+def calibrate_ranges(graph_def, feeds):
+    ''' Range of the input of every conv and FC layer of a frozen graph.
+        feeds: calibration batches, a list of dicts {input key: numpy array}
+        with the keys given to export_frozen_graph
+        Return {input ref of the layer: (min, max)}.
+    '''
+    refs = sorted(set(layer.input[0] for layer, _, _ in _quantized_layers(graph_def)))
+    graph = tfv1.Graph()
+    with graph.as_default():
+        tfv1.import_graph_def(graph_def, name='')
+    fetches = [graph.get_tensor_by_name(_tensor_name(ref)) for ref in refs]
+    config = tfv1.ConfigProto()
+    config.allow_soft_placement = True
+    config.gpu_options.allow_growth = True
+    ranges = {}
+    with tfv1.Session(graph=graph, config=config) as sess:
+        for feed in feeds:
+            feed_dict = dict((graph.get_tensor_by_name('%s/%s:0' % (INPUT_SCOPE, key)), value) \
+                for key, value in feed.items())
+            for ref, value in zip(refs, sess.run(fetches, feed_dict=feed_dict)):
+                quant_util.update_range(ranges, ref, value)
+    return ranges
+
+def quantize_graph(graph_def, precision, ranges=None):
+    ''' Rewrite the conv and FC layers of a frozen graph for a precision of
+        quant_util.PRECISIONS:
+          - int8 weights are stored as int8 constants with one scale per
+            output channel, and dequantized by a Cast and a Mul that
+            TensorFlow folds into a constant when the session starts,
+          - fp16 activations cast the layer input to half and the output
+            back to float, the layer runs in half precision,
+          - int8 activations go through a FakeQuant op with the calibrated
+            range of ranges (from calibrate_ranges); layers whose input has
+            no range keep float activations.
+        Return the new GraphDef and a dict of statistics.
+    '''
+    weights_type = quant_util.weight_type(precision)
+    activations_type = quant_util.activation_type(precision)
+    stats = {'precision': precision, 'layers_quantized': 0,
+             'weight_bytes_fp32': 0, 'weight_bytes': 0}
+    if precision == 'fp32':
+        return graph_def, stats
+    keep = [node.name for node in graph_def.node \
+        if node.name.startswith(INPUT_SCOPE + '/') or node.name.startswith(OUTPUT_SCOPE + '/')]
+    new_nodes = []
+    inputs = {} # input ref -> its cast or fake quantized version, shared by the layers
+    for layer, weights, axis in _quantized_layers(graph_def):
+        scope = layer.name + '/quant'
+        value = _const_value(weights)
+        stats['weight_bytes_fp32'] += value.nbytes
+        if weights_type == 'int8':
+            q, scale = quant_util.quantize_weights(value, axis)
+            stats['weight_bytes'] += q.nbytes + scale.nbytes
+            new_nodes.append(_make_const(scope + '/weights', q, tf.int8))
+            new_nodes.append(_make_const(scope + '/scale', scale, tf.float32))
+            new_nodes.append(_make_cast(scope + '/weights_float', scope + '/weights', tf.int8, tf.float32))
+            new_nodes.append(_make_node('Mul', scope + '/dequantize',
+                [scope + '/weights_float', scope + '/scale'], tf.float32.as_datatype_enum))
+            weights_ref = scope + '/dequantize'
+            if activations_type == 'fp16':
+                new_nodes.append(_make_cast(scope + '/weights_half', weights_ref, tf.float32, tf.float16))
+                weights_ref = scope + '/weights_half'
+        else:
+            new_nodes.append(_make_const(scope + '/weights', value, tf.float16))
+            stats['weight_bytes'] += value.size * 2
+            weights_ref = scope + '/weights'
+        layer.input[1] = weights_ref
+
+        x_ref = layer.input[0]
+        if activations_type == 'fp16':
+            if x_ref not in inputs:
+                inputs[x_ref] = scope + '/input'
+                new_nodes.append(_make_cast(inputs[x_ref], x_ref, tf.float32, tf.float16))
+            layer.input[0] = inputs[x_ref]
+            layer.attr['T'].type = tf.float16.as_datatype_enum
+            # the consumers read the layer name, which now casts back to float
+            new_nodes.append(_make_cast(layer.name, scope + '/compute', tf.float16, tf.float32))
+            layer.name = scope + '/compute'
+        elif activations_type == 'int8' and ranges is not None and x_ref in ranges:
+            if x_ref not in inputs:
+                _, _, lo, hi = quant_util.activation_params(*ranges[x_ref])
+                inputs[x_ref] = scope + '/input'
+                new_nodes.append(_make_fake_quant(inputs[x_ref], x_ref, lo, hi))
+            layer.input[0] = inputs[x_ref]
+        stats['layers_quantized'] += 1
+    graph_def.node.extend(new_nodes)
+    # the float weights are no longer used
+    graph_def = tfv1.graph_util.extract_sub_graph(graph_def, keep)
+    return graph_def, stats
+
+def quantized_session(sess, inputs, outputs, is_training, precision, feeds=None,
+                      cpu=False, gpu=0):
+    ''' Freeze the graph of sess with export_frozen_graph, quantize it to
+        precision and load it into a new session.
+        feeds: calibration batches for int8 activations, a list of dicts
+          {input key: numpy array}
+        cpu: place the graph on the CPU; custom ops without a CPU kernel
+          (sampling, grouping) are still placed on the GPU
+        Return the new session, dicts {key: tensor} of its inputs and outputs
+        and a dict of statistics. sess is left open.
+    '''
+    graph_def, _ = export_frozen_graph(sess, inputs, outputs, is_training)
+    ranges = None
+    if quant_util.activation_type(precision) == 'int8':
+        ranges = calibrate_ranges(graph_def, feeds or [])
+    graph_def, stats = quantize_graph(graph_def, precision, ranges)
+    if ranges is not None:
+        stats['activations_calibrated'] = len(ranges)
+        stats['calibration_clouds'] = sum(list(feed.values())[0].shape[0] for feed in feeds or [])
+    print(quant_util.format_stats(stats))
+
+    graph = tfv1.Graph()
+    with graph.as_default():
+        with tfv1.device('/cpu:0' if cpu else '/gpu:%d' % gpu):
+            frozen_inputs, frozen_outputs = _import_frozen_graph(graph_def)
+    config = tfv1.ConfigProto()
+    config.allow_soft_placement = True
+    config.gpu_options.allow_growth = True
+    return tfv1.Session(graph=graph, config=config), frozen_inputs, frozen_outputs, stats
@@ -0,0 +1,119 @@
+'''
+    Check that export_frozen_graph keeps the outputs of a restored session.
+
+    The network is a small conv + FC stack with the two batch norm flavours
+    of the tf_util.py files: moving averages under tf.cond (dgcnn, ldgcnn)
+    and fused batch norm (tf.contrib.layers.batch_norm), plus a dropout
+    under tf.cond. Run with python freeze_util_test.py.
+'''
+from __future__ import print_function
+
+import os
+import numpy as np
+import tensorflow as tf
+import freeze_util
+tfv1 = tf.compat.v1 if hasattr(tf, 'compat') and hasattr(tf.compat, 'v1') else tf
+
+BATCH_SIZE = 4
+NUM_POINT = 32
+
+def _ema_batch_norm(inputs, is_training, scope, moments_dims):
+    ''' Batch norm with moving averages, as batch_norm_template of dgcnn. '''
+    with tfv1.variable_scope(scope):
+        num_channels = inputs.get_shape()[-1]
+        beta = tfv1.get_variable('beta', [num_channels],
+            initializer=tfv1.random_normal_initializer(stddev=0.5))
+        gamma = tfv1.get_variable('gamma', [num_channels],
+            initializer=tfv1.random_uniform_initializer(0.5, 1.5))
+        batch_mean, batch_var = tf.nn.moments(inputs, moments_dims, name='moments')
+        ema = tfv1.train.ExponentialMovingAverage(decay=0.5)
+        with tfv1.variable_scope(tfv1.get_variable_scope(), reuse=False):
+            ema_apply_op = tf.cond(is_training,
+                                   lambda: ema.apply([batch_mean, batch_var]),
+                                   lambda: tf.no_op())
+        def mean_var_with_update():
+            with tf.control_dependencies([ema_apply_op]):
+                return tf.identity(batch_mean), tf.identity(batch_var)
+        mean, var = tf.cond(is_training, mean_var_with_update,
+                            lambda: (ema.average(batch_mean), ema.average(batch_var)))
+        return tf.nn.batch_normalization(inputs, mean, var, beta, gamma, 1e-3)
+
+def _fused_batch_norm(inputs, is_training, scope):
+    ''' Fused batch norm with a training and an inference branch, as
+        tf.contrib.layers.batch_norm builds it for a tensor is_training. '''
+    with tfv1.variable_scope(scope):
+        num_channels = inputs.get_shape()[-1]
+        beta = tfv1.get_variable('beta', [num_channels],
+            initializer=tfv1.random_normal_initializer(stddev=0.5))
+        gamma = tfv1.get_variable('gamma', [num_channels],
+            initializer=tfv1.random_uniform_initializer(0.5, 1.5))
+        moving_mean = tfv1.get_variable('moving_mean', [num_channels],
+            initializer=tfv1.random_normal_initializer(stddev=0.5), trainable=False)
+        moving_variance = tfv1.get_variable('moving_variance', [num_channels],
+            initializer=tfv1.random_uniform_initializer(0.5, 2.0), trainable=False)
+        return tf.cond(is_training,
+            lambda: tfv1.nn.fused_batch_norm(inputs, gamma, beta, epsilon=1e-3,
+                                             is_training=True)[0],
+            lambda: tfv1.nn.fused_batch_norm(inputs, gamma, beta, moving_mean,
+                                             moving_variance, epsilon=1e-3,
+                                             is_training=False)[0])
+
+def _get_model(point_cloud, is_training):
+    ''' 1x1 conv -> fused BN -> max pool -> FC -> moving average BN -> dropout -> FC '''
+    net = tf.expand_dims(point_cloud, 2)
+    kernel = tfv1.get_variable('conv1/weights', [1, 1, 3, 16])
+    biases = tfv1.get_variable('conv1/biases', [16], initializer=tfv1.random_normal_initializer())
+    net = tf.nn.bias_add(tf.nn.conv2d(net, kernel, [1, 1, 1, 1], 'VALID'), biases)
+    net = tf.nn.relu(_fused_batch_norm(net, is_training, 'conv1/bn'))
+    net = tf.reshape(tf.reduce_max(net, axis=1), [BATCH_SIZE, 16])
+    weights = tfv1.get_variable('fc1/weights', [16, 8])
+    biases = tfv1.get_variable('fc1/biases', [8], initializer=tfv1.random_normal_initializer())
+    net = tf.nn.bias_add(tf.matmul(net, weights), biases)
+    net = tf.nn.relu(_ema_batch_norm(net, is_training, 'fc1/bn', [0]))
+    net = tf.cond(is_training, lambda: tf.nn.dropout(net, 0.5), lambda: net)
+    weights = tfv1.get_variable('fc2/weights', [8, 5])
+    biases = tfv1.get_variable('fc2/biases', [5])
+    return tf.nn.bias_add(tf.matmul(net, weights), biases)
+
+class ExportFrozenGraphTest(tf.test.TestCase):
+    def test_outputs_match(self):
+        np.random.seed(0)
+        batches = [np.random.random((BATCH_SIZE, NUM_POINT, 3)).astype(np.float32)
+                   for _ in range(3)]
+        filename = os.path.join(self.get_temp_dir(), 'frozen.pb')
+
+        graph = tf.Graph()
+        with graph.as_default():
+            tfv1.set_random_seed(0)
+            pointclouds_pl = tfv1.placeholder(tf.float32, (BATCH_SIZE, NUM_POINT, 3))
+            is_training_pl = tfv1.placeholder(tf.bool, shape=())
+            pred = _get_model(pointclouds_pl, is_training_pl)
+            with tfv1.Session() as sess:
+                sess.run(tfv1.global_variables_initializer())
+                # fill the moving averages
+                for batch in batches:
+                    sess.run(pred, {pointclouds_pl: batch, is_training_pl: True})
+                expected = [sess.run(pred, {pointclouds_pl: batch, is_training_pl: False})
+                            for batch in batches]
+                graph_def, stats = freeze_util.export_frozen_graph(sess,
+                    {'pointclouds': pointclouds_pl}, {'pred': pred}, is_training_pl,
+                    filename=filename)
+
+        self.assertEqual(stats['batch_norms_folded'], 2)
+        self.assertGreater(stats['switches_removed'], 0)
+        ops = set(node.op for node in graph_def.node)
+        for op in ['Switch', 'Merge', 'VariableV2', 'VarHandleOp', 'FusedBatchNorm',
+                   'FusedBatchNormV2', 'FusedBatchNormV3', 'Rsqrt']:
+            self.assertNotIn(op, ops)
+
+        with tf.Graph().as_default():
+            inputs, outputs = freeze_util.load_frozen_graph(filename)
+            self.assertEqual(sorted(inputs), ['pointclouds'])
+            self.assertEqual(sorted(outputs), ['pred'])
+            with tfv1.Session() as sess:
+                for batch, value in zip(batches, expected):
+                    frozen = sess.run(outputs['pred'], {inputs['pointclouds']: batch})
+                    self.assertAllClose(frozen, value, rtol=1e-4, atol=1e-4)
+
+if __name__=='__main__':
+    tf.test.main()
@@ -0,0 +1,169 @@
+'''
+    Cache of the built TensorFlow graphs, so evaluate and benchmark runs skip
+    the python model construction.
+
+    Building a graph walks get_model, tf_util and the variable scopes in
+    python, which for short benchmark runs and per-request worker processes
+    takes a large share of the wall time. The first run stores its graph as a
+    MetaGraph; later runs with the same key import it and only restore the
+    weights:
+
+        filename = graph_cache.cache_file(graph_cache.cache_dir(FLAGS), 'dgcnn', 'full',
+            batch_size, num_point, sources=[model_dir, utils_dir, __file__])
+        with tf.Graph().as_default():
+            ops, saver = graph_cache.cached_graph(filename, build)
+            ...
+            saver.restore(sess, model_path)
+
+    The key is the network, variant, batch size, number of points, the
+    TensorFlow version and anything else passed as extra. The weights are
+    restored after loading, so the checkpoint is not part of the key. The
+    .py and .so files under the sources are hashed into it too, so callers
+    pass every directory their graph is built from (model, utils and tf_ops)
+    and the calling script itself. Custom ops (tf_ops) must still be
+    imported before loading, which the scripts do when importing the model
+    module.
+
+    Kept compatible with python2 since F-PointNet still runs under python2.
+'''
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import tensorflow as tf
+from tensorflow.python.framework import meta_graph
+tfv1 = tf.compat.v1 if hasattr(tf, 'compat') and hasattr(tf.compat, 'v1') else tf
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, 'results', 'graph_cache')
+# Collection holding the 'key:tensor name' of the cached tensors
+COLLECTION = 'graph_cache_tensors'
+
+def add_cache_args(parser):
+    ''' Register the flags of the cache. '''
+    parser.add_argument('--graph_cache_dir', default=CACHE_DIR, help='Directory of the cached graphs [default: Benchmark/results/graph_cache]')
+    parser.add_argument('--no_graph_cache', action='store_true', help='Always build the graph in python, do not read or write the cache')
+    return parser
+
+def cache_dir(FLAGS):
+    ''' The cache directory of parsed flags, None if the cache is off. '''
+    return None if FLAGS.no_graph_cache else FLAGS.graph_cache_dir
+
+def _hash_file(sha, filename):
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+# Files under the sources that define the graph: python code and the
+# compiled custom ops
+SOURCE_EXTENSIONS = ('.py', '.so')
+
+def _source_files(source):
+    ''' [(name relative to source, path)] of the source files under source. '''
+    if not os.path.isdir(source):
+        return [(os.path.basename(source), source)] if os.path.exists(source) else []
+    files = []
+    for dir_path, dir_names, file_names in os.walk(source):
+        dir_names.sort()
+        for f in sorted(file_names):
+            if f.endswith(SOURCE_EXTENSIONS):
+                path = os.path.join(dir_path, f)
+                files.append((os.path.relpath(path, source), path))
+    return files
+
+def sources_hash(sources):
+    ''' Hash of the .py and .so files of the given files and directories,
+        subdirectories included. '''
+    sha = hashlib.sha1()
+    for source in sources:
+        for name, filename in _source_files(source):
+            sha.update(name.replace(os.sep, '/').encode('utf-8'))
+            _hash_file(sha, filename)
+    return sha.hexdigest()
+
+def cache_file(directory, network, variant, batch_size, num_point, extra=None, sources=()):
+    ''' Cache file of a graph, None if directory is None (cache off).
+        extra: dict of anything else the graph depends on, e.g. the model name
+        sources: the files and directories (model, utils, tf_ops, the calling
+          script) whose .py and .so files define the graph
+    '''
+    if directory is None:
+        return None
+    key = {'network': network, 'variant': variant, 'batch_size': batch_size,
+           'num_point': num_point, 'sources': sources_hash(sources), 'extra': extra or {},
+           'tensorflow': tf.__version__}
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(directory, '%s_%s_b%d_n%d_%s.meta' % \
+        (network, variant, batch_size, num_point, digest[0:16]))
+
+def _flatten(tensors, prefix=''):
+    ''' [(key, tensor)] of nested dicts of tensors, keys joined by '/' '''
+    items = []
+    for key, value in sorted(tensors.items()):
+        if isinstance(value, dict):
+            items += _flatten(value, '%s%s/' % (prefix, key))
+        else:
+            items.append((prefix + str(key), value))
+    return items
+
+def save_graph(filename, tensors, saver=None):
+    ''' Store the default graph with the tensors to look up, a dict {key:
+        tensor} that may hold nested dicts such as end_points, and the saver
+        to restore it with. '''
+    graph = tfv1.get_default_graph()
+    graph.clear_collection(COLLECTION)
+    for key, tensor in _flatten(tensors):
+        graph.add_to_collection(COLLECTION, '%s:%s' % (key, tensor.name))
+    dir_path = os.path.dirname(filename)
+    if dir_path and not os.path.exists(dir_path): os.makedirs(dir_path)
+    # write then rename, a concurrent run never reads half a file
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    meta_graph.export_scoped_meta_graph(filename=tmp_filename, graph=graph,
+        saver_def=saver.as_saver_def() if saver is not None else None,
+        clear_devices=True)
+    os.rename(tmp_filename, filename)
+    graph.clear_collection(COLLECTION)
+
+def load_graph(filename):
+    ''' Import a cached graph into the default graph.
+        Return the tensors as given to save_graph, with the keys of nested
+        dicts as strings, and the saver, None if it was saved without one. '''
+    meta_graph_def = tfv1.MetaGraphDef()
+    with open(filename, 'rb') as f:
+        meta_graph_def.ParseFromString(f.read())
+    meta_graph.import_scoped_meta_graph(meta_graph_def, clear_devices=True)
+    graph = tfv1.get_default_graph()
+    tensors = {}
+    for entry in graph.get_collection(COLLECTION):
+        if not isinstance(entry, str):
+            entry = entry.decode('utf-8')
+        key, name = entry.split(':', 1)
+        keys = key.split('/')
+        nested = tensors
+        for k in keys[:-1]:
+            nested = nested.setdefault(k, {})
+        nested[keys[-1]] = graph.get_tensor_by_name(name)
+    graph.clear_collection(COLLECTION)
+    saver = None
+    if meta_graph_def.HasField('saver_def'):
+        saver = tfv1.train.Saver(saver_def=meta_graph_def.saver_def)
+    return tensors, saver
+
+def cached_graph(filename, build, saver=True):
+    ''' Import the graph cached in filename into the default graph, or build
+        it and cache it there. filename None always builds.
+        build() creates the graph and returns the tensors {key: tensor} the
+        caller needs. With saver, a tf.train.Saver of all variables is created
+        on build and stored with the graph.
+        Return the tensors and the saver (None without saver).
+    '''
+    if filename is not None and os.path.exists(filename):
+        tensors, cached_saver = load_graph(filename)
+        print('Graph loaded from cache: ' + filename)
+        return tensors, cached_saver if saver else None
+    tensors = build()
+    new_saver = tfv1.train.Saver() if saver else None
+    if filename is not None:
+        save_graph(filename, tensors, new_saver)
+    return tensors, new_saver
@@ -0,0 +1,102 @@
+'''
+    Post-training quantization of the conv and FC layers, shared by the
+    TensorFlow (freeze_util.quantize_graph) and PyTorch (DensePoint
+    quantize.py) implementations.
+
+    After delayed aggregation most of the FLOPs are in the shared MLPs, the
+    1x1 convs over every point. The precisions are:
+      - fp32: the frozen graph as is, the reference
+      - fp16: weights and activations of the layers in half precision
+      - int8_fp16: per-channel int8 weights, fp16 activations
+      - int8: per-channel int8 weights, int8 activations with ranges
+        calibrated on a few hundred clouds
+    Weights are quantized symmetrically per output channel, after batch norm
+    is folded in (or, in PyTorch, in front of a batch norm, which scales
+    every channel on its own and so keeps the per-channel error the same).
+    Activations are quantized per tensor, asymmetrically like TensorFlow's
+    FakeQuant ops, so ReLU outputs use all 256 levels.
+
+    The build_predictor of every benchmark.py takes precision and
+    calibration: with a precision, the restored session is frozen and
+    quantized (freeze_util.quantized_session for TensorFlow), and
+    calibration is the list of input batches (bench_util.calibration_batches)
+    the int8 activation ranges are computed on.
+
+    Kept compatible with python2 since F-PointNet still runs under python2.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+PRECISIONS = ['fp32', 'fp16', 'int8_fp16', 'int8']
+
+# (weights, activations) of every precision
+PRECISION_TYPES = {
+    'fp32' : ('fp32', 'fp32'),
+    'fp16' : ('fp16', 'fp16'),
+    'int8_fp16' : ('int8', 'fp16'),
+    'int8' : ('int8', 'int8')
+}
+
+NUM_BITS = 8
+# Symmetric weights use [-127, 127], so the scale of a channel is max|w| / 127
+WEIGHT_QMAX = 2 ** (NUM_BITS - 1) - 1
+ACTIVATION_LEVELS = 2 ** NUM_BITS - 1
+
+def weight_type(precision):
+    return PRECISION_TYPES[precision][0]
+
+def activation_type(precision):
+    return PRECISION_TYPES[precision][1]
+
+def quantize_weights(weights, axis):
+    ''' Symmetric int8 quantization with one scale per output channel.
+        Input:
+          weights: float numpy array
+          axis: the output channel axis, e.g. 3 for HWIO conv filters
+        Return:
+          int8 weights and float32 scales, the latter with the shape of
+          weights reduced to 1 on every other axis so they broadcast
+    '''
+    weights = np.asarray(weights, dtype=np.float32)
+    axis = axis % weights.ndim
+    reduce_axes = tuple(i for i in range(weights.ndim) if i != axis)
+    scale = np.max(np.abs(weights), axis=reduce_axes, keepdims=True) / WEIGHT_QMAX
+    scale = np.where(scale > 0, scale, 1.0).astype(np.float32) # all-zero channels
+    q = np.clip(np.round(weights / scale), -WEIGHT_QMAX, WEIGHT_QMAX).astype(np.int8)
+    return q, scale
+
+def dequantize_weights(q, scale):
+    return q.astype(np.float32) * scale
+
+def update_range(ranges, key, value):
+    ''' Widen the (min, max) of ranges[key] to cover the numpy array value. '''
+    lo, hi = float(np.min(value)), float(np.max(value))
+    if key in ranges:
+        lo, hi = min(lo, ranges[key][0]), max(hi, ranges[key][1])
+    ranges[key] = (lo, hi)
+
+def activation_params(lo, hi):
+    ''' Scale, zero point and the nudged (min, max) of an activation range.
+        As in TensorFlow's FakeQuant ops the range always holds 0 and is
+        nudged so that 0 is exactly one of the 256 levels, which keeps the
+        zero padding and ReLU outputs exact.
+    '''
+    lo, hi = min(float(lo), 0.0), max(float(hi), 0.0)
+    if hi - lo < 1e-8:
+        hi = lo + 1e-8
+    scale = (hi - lo) / ACTIVATION_LEVELS
+    zero_point = int(np.clip(np.round(-lo / scale), 0, ACTIVATION_LEVELS))
+    return scale, zero_point, -zero_point * scale, (ACTIVATION_LEVELS - zero_point) * scale
+
+def format_stats(stats):
+    ''' One line summary of the statistics of a quantized model. '''
+    line = '%s: %d layers quantized' % (stats['precision'], stats['layers_quantized'])
+    if 'activations_calibrated' in stats:
+        line += ', %d activation ranges calibrated on %d clouds' % \
+            (stats['activations_calibrated'], stats['calibration_clouds'])
+    if stats.get('weight_bytes_fp32'):
+        line += ', layer weights %.2f MB -> %.2f MB' % (stats['weight_bytes_fp32'] / 1e6,
+            stats['weight_bytes'] / 1e6)
+    return line
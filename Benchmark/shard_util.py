@@ -0,0 +1,161 @@
+'''
+    Sharded evaluation: the test set is split across processes, each running
+    its own session with a fixed number of intra/inter-op threads, so the
+    cores of a CPU inference host are all busy. One session per host spends
+    most of its time in small 1x1 convs that do not split well across threads.
+
+    With --num_shards N the evaluate script is the coordinator: it runs
+    itself N more times as shard workers (--shard_index i), each pinned to
+    its own block of cores where the OS allows, and merges what they return:
+
+        shard_util.add_shard_args(parser)
+        ...
+        if shard_util.is_coordinator(FLAGS):
+            results = shard_util.run_shards(FLAGS, DUMP_DIR, num_batches,
+                lambda i: ['--dump_dir', os.path.join(DUMP_DIR, 'shard_%d' % i)])
+            counts = shard_util.merge(results)
+        else:
+            ...
+            for unit, batch in enumerate(batches):
+                if not shard_util.owns(FLAGS, unit):
+                    continue
+                ...
+            shard_util.write_result(FLAGS, counts)
+
+    The work units (batches) are dealt out round robin, which keeps the
+    shards balanced, and there must be at least one per shard. Workers return raw counts (correct, seen, per-class
+    counts, IoU accumulators, ...) rather than metrics, so the merged
+    metrics are exactly those of one process over the whole set.
+
+    Kept compatible with python2 since F-PointNet still runs under python2.
+'''
+from __future__ import print_function
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+
+def add_shard_args(parser):
+    ''' Register the flags of sharded evaluation. '''
+    parser.add_argument('--num_shards', type=int, default=1, help='Split the test set across this many evaluation processes [default: 1]')
+    parser.add_argument('--intra_op_threads', type=int, default=0, help='Intra-op threads per process, 0 for the cores divided by --num_shards (the TensorFlow default without shards) [default: 0]')
+    parser.add_argument('--inter_op_threads', type=int, default=0, help='Inter-op threads per process, 0 for 1 with shards (the TensorFlow default without) [default: 0]')
+    parser.add_argument('--shard_index', type=int, default=None, help='Set by the coordinator: the shard this worker process evaluates')
+    parser.add_argument('--shard_output', default=None, help='Set by the coordinator: file the worker writes its counts to')
+    return parser
+
+def is_worker(FLAGS):
+    return FLAGS.shard_index is not None
+
+def is_coordinator(FLAGS):
+    ''' Whether this process only starts the shards and merges their counts. '''
+    return FLAGS.num_shards > 1 and not is_worker(FLAGS)
+
+def owns(FLAGS, unit):
+    ''' Whether this process evaluates the work unit with index unit, e.g. a
+        batch: every unit without shards, every num_shards-th in a worker. '''
+    return not is_worker(FLAGS) or unit % FLAGS.num_shards == FLAGS.shard_index
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+def thread_counts(FLAGS):
+    ''' (intra, inter) op threads of a process, 0 for the TensorFlow default.
+        Workers get the counts the coordinator resolved as flags, since their
+        own available cores are already the block of their shard. '''
+    if FLAGS.num_shards <= 1:
+        return FLAGS.intra_op_threads, FLAGS.inter_op_threads
+    intra = FLAGS.intra_op_threads or max(1, len(available_cores()) // FLAGS.num_shards)
+    return intra, FLAGS.inter_op_threads or 1
+
+def configure_session(config, FLAGS):
+    ''' Set the thread counts of a tf.ConfigProto and return it. '''
+    intra, inter = thread_counts(FLAGS)
+    config.intra_op_parallelism_threads = intra
+    config.inter_op_parallelism_threads = inter
+    return config
+
+def shard_cores(num_shards, index):
+    ''' The block of cores of a shard, None if there are fewer cores than
+        shards and the OS schedules them. '''
+    cores = available_cores()
+    per_shard = len(cores) // num_shards
+    if per_shard == 0:
+        return None
+    return cores[index * per_shard:(index + 1) * per_shard]
+
+def run_shards(FLAGS, log_dir, num_units, worker_args=None):
+    ''' Run this script once per shard, in parallel, and return the results
+        the workers wrote with write_result, in shard order.
+        log_dir: the output of worker i goes to log_dir/shard_<i>.log
+        num_units: the number of work units; fewer than --num_shards raises
+        a ValueError, as some workers would have nothing to evaluate
+        worker_args: function of the shard index returning extra arguments,
+        e.g. a dump directory of its own; the last value of a flag wins
+    '''
+    if num_units < FLAGS.num_shards:
+        raise ValueError('--num_shards %d is more than the %d batches to evaluate' % \
+            (FLAGS.num_shards, num_units))
+    intra, inter = thread_counts(FLAGS)
+    tmp_dir = tempfile.mkdtemp(prefix='shards_')
+    processes = []
+    try:
+        for i in range(FLAGS.num_shards):
+            output = os.path.join(tmp_dir, 'shard_%d.pkl' % i)
+            args = [sys.executable] + sys.argv + \
+                ['--shard_index', str(i), '--shard_output', output,
+                 '--intra_op_threads', str(intra), '--inter_op_threads', str(inter)]
+            if worker_args is not None:
+                args += worker_args(i)
+            env = dict(os.environ, OMP_NUM_THREADS=str(intra))
+            cores = shard_cores(FLAGS.num_shards, i) if hasattr(os, 'sched_setaffinity') else None
+            # the worker and its thread pools inherit the affinity
+            preexec_fn = (lambda cores=cores: os.sched_setaffinity(0, cores)) if cores else None
+            log = open(os.path.join(log_dir, 'shard_%d.log' % i), 'w')
+            processes.append((subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT,
+                env=env, preexec_fn=preexec_fn), log, output))
+            print('Shard %d/%d started%s, log: %s' % (i, FLAGS.num_shards,
+                ' on cores %d-%d' % (cores[0], cores[-1]) if cores else '', log.name))
+        failed = [log.name for process, log, _ in processes if process.wait() != 0]
+        if failed:
+            raise RuntimeError('Shards failed, see ' + ', '.join(failed))
+        results = []
+        for _, _, output in processes:
+            with open(output, 'rb') as f:
+                results.append(pickle.load(f))
+        return results
+    finally:
+        for process, log, _ in processes:
+            if process.poll() is None:
+                process.kill()
+            log.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def write_result(FLAGS, result):
+    ''' In a worker, hand the counts of its shard to the coordinator. '''
+    if FLAGS.shard_output is None:
+        return
+    with open(FLAGS.shard_output, 'wb') as f:
+        pickle.dump(result, f, protocol=2)
+
+def merge(results):
+    ''' Merge the results of the shards: dicts key by key, numbers and numpy
+        arrays are summed, lists are concatenated in shard order. '''
+    merged = results[0]
+    for result in results[1:]:
+        merged = _merge(merged, result)
+    return merged
+
+def _merge(a, b):
+    if isinstance(a, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = _merge(a[key], value) if key in a else value
+        return merged
+    return a + b
@@ -0,0 +1,165 @@
+'''
+    Per-stage cost report of traces collected with trace_util.py.
+
+    The traces are grouped by network, batch size and number of points. For
+    every group the time per batch and the share of every stage is printed
+    per variant, and, against the reference variant, how much of the total
+    saving every stage accounts for: this shows where the delayed-aggregation
+    gains come from on the machine the traces were taken on. A summary table
+    lists the stage shares of all traces side by side. Tables use fixed
+    formats and orders, so reports of two machines or commits can be diffed.
+
+    Usage (from the root directory):
+        python launcher.py --benchmark pointnet2 --trace
+        python Benchmark/trace_report.py Benchmark/results/traces
+'''
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+import os
+import sys
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+import bench_util
+import trace_util
+
+parser = argparse.ArgumentParser()
+parser.add_argument('traces', nargs='+', help='Trace files, or directories of .json traces')
+parser.add_argument('--reference', default='baseline', help='Variant the others are compared against [default: baseline]')
+parser.add_argument('--rules', default=None, help='JSON list of [stage, regex] pairs matched before the default stage rules [default: None]')
+parser.add_argument('--role', default=None, choices=['device', 'host', 'stage'], help='Events to count [default: stage markers, else device time, else host time]')
+parser.add_argument('--top_ops', type=int, default=10, help='Most expensive ops listed per trace, 0 for none [default: 10]')
+parser.add_argument('--output_dir', default=None, help='Where report.txt and report.json go [default: Benchmark/results/trace_report]')
+
+def trace_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.json'))
+        else:
+            files.append(path)
+    return files
+
+def group_key(profile):
+    label = profile['label']
+    return (label['network'], label.get('batch_size') or 0, label.get('num_point') or 0)
+
+def variant_order(variants):
+    return [v for v in bench_util.VARIANTS if v in variants] + \
+        sorted(v for v in variants if v not in bench_util.VARIANTS)
+
+def merge_profiles(profiles):
+    ''' Average the profiles of repeated traces of the same configuration. '''
+    merged = dict(profiles[0])
+    for key in ['ops', 'stages']:
+        names = set()
+        for p in profiles:
+            names |= set(p[key].keys())
+        merged[key] = dict((n, sum(p[key].get(n, 0.0) for p in profiles) / len(profiles)) \
+            for n in names)
+    merged['op_stages'] = {}
+    for p in profiles:
+        merged['op_stages'].update(p['op_stages'])
+    merged['total_ms'] = sum(p['total_ms'] for p in profiles) / len(profiles)
+    merged['file'] = [p['file'] for p in profiles]
+    return merged
+
+def group_profiles(profiles):
+    ''' {(network, batch, points): {variant: profile}} '''
+    groups = {}
+    for p in profiles:
+        groups.setdefault(group_key(p), {}).setdefault(p['label']['variant'], []).append(p)
+    return dict((key, dict((v, merge_profiles(ps)) for v, ps in variants.items())) \
+        for key, variants in groups.items())
+
+def share(ms, total):
+    return 100.0 * ms / total if total > 0 else 0.0
+
+def group_table(variants, reference):
+    ''' Rows are stages; per variant the ms per batch and share, and for the
+        other variants the change against the reference and the part of the
+        total saving it accounts for. '''
+    names = variant_order(variants.keys())
+    others = [v for v in names if v != reference] if reference in variants else []
+    stages = trace_util.stage_order(set(s for p in variants.values() for s in p['stages']))
+    header = ['stage']
+    for v in names:
+        header += ['%s ms' % v, '%s %%' % v]
+    for v in others:
+        header += ['%s vs %s ms' % (v, reference), 'of saving %']
+    rows = []
+    for stage in stages + ['total']:
+        row = [stage]
+        for v in names:
+            p = variants[v]
+            ms = p['total_ms'] if stage == 'total' else p['stages'].get(stage, 0.0)
+            row += ['%.3f' % ms, '%.1f' % share(ms, p['total_ms'])]
+        for v in others:
+            ref, p = variants[reference], variants[v]
+            if stage == 'total':
+                delta = p['total_ms'] - ref['total_ms']
+            else:
+                delta = p['stages'].get(stage, 0.0) - ref['stages'].get(stage, 0.0)
+            saving = ref['total_ms'] - p['total_ms']
+            row += ['%+.3f' % delta, '%.1f' % (0.0 - 100.0 * delta / saving) if saving != 0 else '-']
+        rows.append(row)
+    return header, rows
+
+def summary_table(groups):
+    ''' Stage shares of all configurations side by side. '''
+    stages = trace_util.stage_order(set(s for variants in groups.values() \
+        for p in variants.values() for s in p['stages']))
+    header = ['network', 'batch', 'points', 'variant', 'total ms'] + ['%s %%' % s for s in stages]
+    rows = []
+    for key in sorted(groups):
+        for v in variant_order(groups[key].keys()):
+            p = groups[key][v]
+            rows.append([key[0], str(key[1] or '-'), str(key[2] or '-'), v, '%.3f' % p['total_ms']] + \
+                ['%.1f' % share(p['stages'].get(s, 0.0), p['total_ms']) for s in stages])
+    return header, rows
+
+def top_ops_table(profile, num):
+    ops = sorted(profile['ops'].items(), key=lambda x: (-x[1], x[0]))[0:num]
+    return ['op', 'stage', 'ms', '%'], [[op, profile['op_stages'][op], '%.3f' % ms,
+        '%.1f' % share(ms, profile['total_ms'])] for op, ms in ops]
+
+def build_report(groups, reference, top_ops):
+    sections = []
+    for key in sorted(groups):
+        variants = groups[key]
+        role = variants[variant_order(variants.keys())[0]]['role']
+        title = '%s, batch %s x %s points (%s time per batch)' % (key[0], key[1] or '-', key[2] or '-', role)
+        sections.append(title + '\n' + bench_util.format_table(*group_table(variants, reference)))
+        if top_ops > 0:
+            for v in variant_order(variants.keys()):
+                sections.append('%s [%s] top ops\n%s' % (key[0], v,
+                    bench_util.format_table(*top_ops_table(variants[v], top_ops))))
+    sections.append('summary\n' + bench_util.format_table(*summary_table(groups)))
+    return '\n\n'.join(sections)
+
+def main():
+    FLAGS = parser.parse_args()
+    rules = trace_util.load_rules(FLAGS.rules) if FLAGS.rules is not None else None
+    files = trace_files(FLAGS.traces)
+    if not files:
+        print('[ERROR]: no traces found.')
+        exit()
+    profiles = [trace_util.trace_profile(f, rules, FLAGS.role) for f in files]
+    groups = group_profiles(profiles)
+    report = build_report(groups, FLAGS.reference, FLAGS.top_ops)
+    print(report)
+
+    output_dir = FLAGS.output_dir
+    if output_dir is None:
+        output_dir = os.path.join(BASE_DIR, 'results', 'trace_report')
+    if not os.path.exists(output_dir): os.makedirs(output_dir)
+    with open(os.path.join(output_dir, 'report.txt'), 'w') as f:
+        f.write(report + '\n')
+    with open(os.path.join(output_dir, 'report.json'), 'w') as f:
+        json.dump(dict(('%s_b%s_n%s' % key, groups[key]) for key in groups), f,
+            indent=2, sort_keys=True)
+
+if __name__=='__main__':
+    main()
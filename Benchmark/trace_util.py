@@ -0,0 +1,255 @@
+'''
+    Collect and analyze execution traces of the networks.
+
+    Three kinds of traces are understood, all stored as Chrome-trace JSON
+    (viewable in chrome://tracing):
+      - TensorFlow timelines (RunOptions.FULL_TRACE, see collect_tf_trace)
+      - PyTorch profiler traces (torch.autograd.profiler, see collect_torch_trace)
+      - our own stage markers, timed around any piece of python code
+        (see StageMarkers)
+
+    The ops of a trace are mapped to logical stages of a point cloud network
+    (sampling, neighbor search, gather, MLP, aggregation, ...) with the
+    regular expressions of STAGE_RULES, and the time per batch of every stage
+    is summed. trace_report.py compares the stage shares across variants and
+    batch sizes.
+
+    Kept compatible with python2 since F-PointNet still runs under python2.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import contextlib
+import json
+import os
+import re
+import time
+
+# Stages in report order
+STAGES = ['sampling', 'neighbor_search', 'gather', 'mlp', 'aggregation',
+          'interpolation', 'transfer', 'other']
+
+# (stage, regular expression) matched in order against the op (or CUDA
+# kernel) names, case-insensitive; unmatched ops are 'other'
+STAGE_RULES = [
+    ('transfer', r'memcpy|memset|^_Recv|^_Send'),
+    ('sampling', r'FarthestPointSample|furthest_?point|ProbSample|RandomUniform'),
+    ('neighbor_search', r'QueryBallPoint|ball_?query|ThreeNN|three_?nn|knn|SelectionSort|TopK|top_?k|sort'),
+    ('interpolation', r'ThreeInterpolate|three_?interpolate'),
+    ('gather', r'Gather|group_?point|Grouping|index_select|aten::index|^Tile$|ConcatV2|aten::cat|^Pack$|^Slice$|StridedSlice'),
+    ('aggregation', r'^Max$|MaxPool|max_?pool|pooling|^Mean$|^Sum$|aten::max$|aten::mean|aten::sum|reduce'),
+    ('mlp', r'Conv|MatMul|BiasAdd|Relu|BatchNorm|batch_?norm|bn_fw|cudnn|gemm|addmm|linear|Rsqrt|Elu'),
+]
+
+def compile_rules(rules=None):
+    ''' Compile (stage, regex) rules, custom rules take precedence over STAGE_RULES. '''
+    rules = list(rules or []) + STAGE_RULES
+    return [(stage, re.compile(pattern, re.IGNORECASE)) for stage, pattern in rules]
+
+def load_rules(filename):
+    ''' Read custom rules from a JSON list of [stage, regex] pairs. '''
+    with open(filename) as f:
+        return [tuple(rule) for rule in json.load(f)]
+
+def op_stage(name, rules):
+    for stage, pattern in rules:
+        if pattern.search(name):
+            return stage
+    return 'other'
+
+# ----------------------------------------------------------------------------
+# Collection
+# ----------------------------------------------------------------------------
+
+class StageMarkers(object):
+    ''' Stage markers timed on the host around any code:
+
+            markers = trace_util.StageMarkers(sync=torch.cuda.synchronize)
+            with markers.stage('neighbor_search'):
+                idx = knn(points)
+            markers.save('stages.json', {'network': 'dgcnn', 'variant': 'full'})
+
+        Pass sync to wait for the device before and after every stage,
+        otherwise asynchronous GPU work is attributed to the stage that
+        waits for it. Stages may be nested; each stage only counts the time
+        not spent in its sub-stages.
+    '''
+    def __init__(self, sync=None):
+        self.sync = sync
+        self.events = []
+        self.iterations = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.sync is not None: self.sync()
+        s = time.time()
+        try:
+            yield
+        finally:
+            if self.sync is not None: self.sync()
+            self.events.append({'name': name, 'cat': 'stage', 'ph': 'X',
+                'pid': 0, 'tid': 0, 'ts': s * 1e6, 'dur': (time.time() - s) * 1e6})
+
+    def next_iteration(self):
+        ''' Count one more batch, so the report shows times per batch. '''
+        self.iterations += 1
+
+    def save(self, filename, metadata=None):
+        metadata = dict(metadata or {})
+        metadata.setdefault('iterations', max(self.iterations, 1))
+        write_trace(filename, self.events, metadata)
+
+def write_trace(filename, events, metadata=None):
+    ''' Write events as a Chrome trace, metadata goes to otherData. '''
+    dir_path = os.path.dirname(filename)
+    if dir_path and not os.path.exists(dir_path): os.makedirs(dir_path)
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'otherData': metadata or {}}, f)
+
+def _append_run(events, run_events):
+    ''' Append the events of one more run, shifted to start after the
+        previous runs so they never look nested in each other. '''
+    timed = [e for e in run_events if 'ts' in e]
+    if events and timed:
+        end = max(e['ts'] + e.get('dur', 0) for e in events if 'ts' in e)
+        shift = end + 1 - min(e['ts'] for e in timed)
+        for e in timed:
+            e['ts'] += shift
+    events.extend(run_events)
+
+def collect_tf_trace(predict, batches, filename, metadata=None):
+    ''' Trace one TensorFlow run per batch and save the timelines as one trace.
+        predict(points, options=None, run_metadata=None) must pass options and
+        run_metadata on to session.run.
+    '''
+    import tensorflow as tf
+    from tensorflow.python.client import timeline
+    tfv1 = tf.compat.v1 if hasattr(tf, 'compat') and hasattr(tf.compat, 'v1') else tf
+    events = []
+    for batch in batches:
+        run_options = tfv1.RunOptions(trace_level=tfv1.RunOptions.FULL_TRACE)
+        run_metadata = tfv1.RunMetadata()
+        predict(batch, options=run_options, run_metadata=run_metadata)
+        trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format()
+        _append_run(events, json.loads(trace)['traceEvents'])
+    metadata = dict(metadata or {})
+    metadata.update({'framework': 'tensorflow', 'iterations': len(batches)})
+    write_trace(filename, events, metadata)
+
+def collect_torch_trace(predict, batches, filename, metadata=None):
+    ''' Profile predict over the batches with the PyTorch autograd profiler. '''
+    import torch
+    with torch.autograd.profiler.profile(use_cuda=torch.cuda.is_available()) as prof:
+        for batch in batches:
+            predict(batch)
+    prof.export_chrome_trace(filename)
+    events, _ = load_trace(filename)
+    metadata = dict(metadata or {})
+    metadata.update({'framework': 'pytorch', 'iterations': len(batches)})
+    write_trace(filename, events, metadata)
+
+# ----------------------------------------------------------------------------
+# Analysis
+# ----------------------------------------------------------------------------
+
+def load_trace(filename):
+    ''' Return the events of a Chrome trace (each with its process name under
+        'process') and the metadata stored in otherData.
+    '''
+    with open(filename) as f:
+        data = json.load(f)
+    if isinstance(data, list): # older PyTorch profilers write a bare list
+        data = {'traceEvents': data}
+    events = data.get('traceEvents', [])
+    process_names = {}
+    for e in events:
+        if e.get('ph') == 'M' and e.get('name') == 'process_name':
+            process_names[e['pid']] = e.get('args', {}).get('name', '')
+    for e in events:
+        e['process'] = process_names.get(e.get('pid'), str(e.get('pid', '')))
+    return events, data.get('otherData', {})
+
+def event_role(event):
+    ''' 'stage' for our markers, 'device' for the time ops spend executing
+        (TF per-device compute, CUDA kernels and copies), 'host' for the host
+        side of ops that run on a GPU (TF op launches, PyTorch CPU ops) and
+        None for everything else.
+    '''
+    if event.get('ph') != 'X' or 'dur' not in event:
+        return None
+    cat = event.get('cat', '')
+    process = event['process']
+    if cat == 'stage':
+        return 'stage'
+    if cat == 'Op': # TensorFlow timeline
+        if 'stream:all' in process:
+            return 'device'
+        # the per stream lanes and the memcpy pseudo-device repeat what
+        # stream:all records, copies included
+        if 'stream:' in process or 'memcpy' in process.lower():
+            return None
+        if 'GPU' in process or 'gpu' in process:
+            return 'host'
+        return 'device'
+    if cat in ('kernel', 'gpu_memcpy', 'gpu_memset') or process == 'CUDA functions':
+        return 'device'
+    if cat == 'cpu_op' or process == 'CPU functions':
+        return 'host'
+    return None
+
+def self_durations(events):
+    ''' Durations (us) of the events minus those of the events nested in them
+        on the same thread, so nested ops or stages are not counted twice.
+    '''
+    durations = [float(e['dur']) for e in events]
+    threads = {}
+    for i, e in enumerate(events):
+        threads.setdefault((e.get('pid'), e.get('tid')), []).append(i)
+    for idxs in threads.values():
+        idxs.sort(key=lambda i: (events[i]['ts'], -events[i]['dur']))
+        stack = [] # (end, idx) of the enclosing events
+        for i in idxs:
+            start = events[i]['ts']
+            end = start + events[i]['dur']
+            while stack and stack[-1][0] <= start:
+                stack.pop()
+            if stack and end <= stack[-1][0]:
+                durations[stack[-1][1]] -= events[i]['dur']
+            stack.append((end, i))
+    return durations
+
+def trace_profile(filename, rules=None, role=None):
+    ''' Time per batch (ms) of every op and stage of a trace.
+        role: 'device' or 'host' events, by default device events when the
+        trace has any. Traces with stage markers use the markers as stages.
+        Return dict with 'label' (the trace metadata), 'role', 'iterations',
+        'ops' {op: ms}, 'op_stages' {op: stage}, 'stages' {stage: ms}, 'total_ms'.
+    '''
+    rules = compile_rules(rules)
+    events, metadata = load_trace(filename)
+    roles = [event_role(e) for e in events]
+    if role is None:
+        for role in ['stage', 'device', 'host']:
+            if role in roles: break
+    selected = [e for e, r in zip(events, roles) if r == role]
+    iterations = float(metadata.get('iterations', 1))
+    ops = {}
+    for e, dur in zip(selected, self_durations(selected)):
+        ops[e['name']] = ops.get(e['name'], 0.0) + dur / 1000.0 / iterations
+    if role == 'stage':
+        op_stages = dict((op, op) for op in ops)
+    else:
+        op_stages = dict((op, op_stage(op, rules)) for op in ops)
+    stages = {}
+    for op, ms in ops.items():
+        stages[op_stages[op]] = stages.get(op_stages[op], 0.0) + ms
+    label = dict(metadata)
+    label.setdefault('network', os.path.splitext(os.path.basename(filename))[0])
+    label.setdefault('variant', '-')
+    return {'label': label, 'file': filename, 'role': role, 'iterations': iterations,
+            'ops': ops, 'op_stages': op_stages, 'stages': stages,
+            'total_ms': sum(ops.values())}
+
+def stage_order(stages):
+    ''' STAGES first, then custom stages in alphabetical order. '''
+    return [s for s in STAGES if s in stages] + sorted(s for s in stages if s not in STAGES)
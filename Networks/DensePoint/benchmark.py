@@ -0,0 +1,71 @@
+import torch
+import numpy as np
+import os
+import sys
+import argparse
+import importlib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = BASE_DIR
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(ROOT_DIR, '../../Benchmark'))
+import bench_util
+import quant_util
+import quantize
+
+torch.backends.cudnn.enabled = True
+torch.backends.cudnn.benchmark = True
+
+# Model dir of each aggregation variant, as in evaluate*.py.
+# DensePoint has no separate limited delayed-aggregation model.
+VARIANT_DIRS = {
+    'full': ('models', 'utils'),
+    'baseline': ('models-baseline', 'utils-baseline')
+}
+
+parser = argparse.ArgumentParser(description='DensePoint Shape Classification Benchmark on synthetic point clouds')
+bench_util.add_benchmark_args(parser, VARIANT_DIRS.keys(), batch_size=32, num_point=1024)
+parser.add_argument('--num_classes', type=int, default=40)
+
+def build_predictor(variant, batch_size, num_point, model_path=None, gpu=0, num_classes=40,
+                    precision=None, calibration=(), cpu=False):
+    ''' Build one variant and return predict(points) -> {'logits': Bx40}.
+        With precision, the conv and FC layers are quantized, see quantize.py;
+        calibration holds the batches int8 activations are calibrated on. '''
+    assert not cpu, 'the DensePoint sampling and grouping ops only run on CUDA'
+    model_dir, utils_dir = VARIANT_DIRS[variant]
+    sys.path.append(os.path.join(ROOT_DIR, model_dir))
+    sys.path.append(os.path.join(ROOT_DIR, utils_dir))
+    DensePoint = importlib.import_module('densepoint_cls_L6_k24_g2').DensePoint
+
+    torch.cuda.set_device(gpu)
+    model = DensePoint(num_classes = num_classes, input_channels = 0, use_xyz = True)
+    model.cuda()
+    if model_path is not None:
+        model.load_state_dict(torch.load(model_path))
+        print('Load model successfully: %s' % (model_path))
+    model.eval()
+    if precision is not None:
+        stats = quantize.quantize_model(model, precision,
+            [torch.from_numpy(batch).cuda() for batch in calibration])
+        print(quant_util.format_stats(stats))
+
+    def predict(points):
+        with torch.no_grad():
+            pred = model(torch.from_numpy(points).cuda())
+        return {'logits': pred.cpu().numpy()}
+    return predict
+
+def predictor_from_flags(args):
+    ''' build_predictor from flags parsed by parser, as used by Serving/worker.py. '''
+    return build_predictor(args.variant, args.batch_size, args.num_point,
+        args.model_path, args.gpu, args.num_classes, args.precision,
+        bench_util.calibration_batches(args), args.cpu)
+
+def main():
+    args = parser.parse_args()
+    predict = predictor_from_flags(args)
+    bench_util.run_benchmark('DensePoint', args, predict, num_channel=3)
+
+if __name__ == '__main__':
+    main()
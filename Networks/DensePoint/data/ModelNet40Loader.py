@@ -2,6 +2,11 @@ import torch
 import torch.utils.data as data
 import numpy as np
 import os, sys, h5py
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
@@ -62,6 +67,152 @@ class ModelNet40Cls(data.Dataset):
     def __len__(self):
         return self.points.shape[0]
 
+class ModelNet40BatchLoader(object):
+    '''
+    Iterate over a ModelNet40Cls in whole batches, in place of a DataLoader
+    with per-item __getitem__ and collate.
+
+    Every batch is sliced out of the in-memory dataset.points with one
+    vectorized index, in the main process, so no cloud is pickled across
+    worker processes. In training mode the points of every cloud are
+    shuffled, as in __getitem__. A background thread prepares the next
+    batch into one of a few reused (pinned) buffers while the current one
+    is used; a batch is overwritten once the next one has been fetched, so
+    copy it to the GPU (or clone it) before that. The thread stops when the
+    iteration ends, also early (break, exception), or on close().
+
+    Yields (points, labels) like a DataLoader over ModelNet40Cls with
+    PointcloudToTensor: (B, N, 3) float and (B, 1) long tensors. The
+    per-item transforms of the dataset are not applied; transforms, if
+    given, is called on every batch (e.g. d_utils.PointcloudAugmentation).
+    '''
+    NUM_BUFFERS = 3
+
+    def __init__(self, dataset, batch_size, shuffle=False, drop_last=False,
+                 pin_memory=True, transforms=None, prefetch=True):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle, self.drop_last = shuffle, drop_last
+        self.transforms = transforms
+        self.prefetch = prefetch
+        self._prefetches = [] # (stop event, queue, thread) of running iterations
+        num_points = dataset.points.shape[1]
+        pin_memory = pin_memory and torch.cuda.is_available()
+        self.buffers = []
+        for _ in range(self.NUM_BUFFERS):
+            points = torch.FloatTensor(batch_size, num_points, dataset.points.shape[2])
+            labels = torch.LongTensor(batch_size, 1)
+            if pin_memory:
+                points, labels = points.pin_memory(), labels.pin_memory()
+            self.buffers.append((points, labels))
+
+    def __len__(self):
+        n = len(self.dataset)
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def _batch_indices(self):
+        n = len(self.dataset)
+        order = np.random.permutation(n) if self.shuffle else None
+        for i in range(len(self)):
+            start, end = i * self.batch_size, min((i + 1) * self.batch_size, n)
+            yield slice(start, end) if order is None else order[start:end]
+
+    def _fill(self, idx, buffer):
+        points, labels = buffer
+        data = self.dataset.points
+        rows = np.arange(idx.start, idx.stop) if isinstance(idx, slice) else idx
+        size = rows.shape[0]
+        out = points[0:size].numpy()
+        if self.dataset.train:
+            # one independent permutation of the points of every cloud,
+            # gathered straight into the buffer
+            pt_idxs = np.argsort(np.random.rand(size, data.shape[1]), axis=1)
+            out[...] = data[rows[:, None], pt_idxs]
+        elif isinstance(idx, slice):
+            out[...] = data[idx]
+        else:
+            np.take(data, rows, axis=0, out=out)
+        labels[0:size].numpy()[...] = self.dataset.labels[rows].reshape(size, 1)
+        return points[0:size], labels[0:size]
+
+    def _batches(self):
+        for i, idx in enumerate(self._batch_indices()):
+            yield self._fill(idx, self.buffers[i % self.NUM_BUFFERS])
+
+    def _prefetched(self):
+        # one batch waits in the queue while the thread fills the next
+        batches = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        def put(item):
+            # give up once the consumer has stopped iterating
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        def produce():
+            try:
+                for batch in self._batches():
+                    if not put(batch):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+        prefetch = (stop, batches, thread)
+        self._prefetches.append(prefetch)
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # also runs when the consumer breaks out early
+            if prefetch in self._prefetches:
+                self._prefetches.remove(prefetch)
+                self._stop_prefetch(*prefetch)
+
+    @staticmethod
+    def _stop_prefetch(stop, batches, thread):
+        def drain():
+            try:
+                while True:
+                    batches.get_nowait()
+            except queue.Empty:
+                pass
+        stop.set()
+        # unblock a producer waiting on the full queue
+        drain()
+        thread.join()
+        # end the iteration of a consumer still waiting for a batch
+        drain()
+        batches.put_nowait(None)
+
+    def close(self):
+        ''' Stop the prefetch threads of unfinished iterations. '''
+        for prefetch in list(self._prefetches):
+            self._prefetches.remove(prefetch)
+            self._stop_prefetch(*prefetch)
+
+    def __del__(self):
+        if getattr(self, '_prefetches', None):
+            self.close()
+
+    def __iter__(self):
+        for points, labels in (self._prefetched() if self.prefetch else self._batches()):
+            if self.transforms is not None:
+                points = self.transforms(points)
+            yield points, labels
+
 if __name__ == "__main__":
     from torchvision import transforms
     import data_utils as d_utils
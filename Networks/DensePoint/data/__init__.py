@@ -1 +1 @@
-from .ModelNet40Loader import ModelNet40Cls
\ No newline at end of file
+from .ModelNet40Loader import ModelNet40Cls, ModelNet40BatchLoader
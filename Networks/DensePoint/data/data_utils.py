@@ -36,32 +36,33 @@ def angle_axis(angle: float, axis: np.ndarray):
     # yapf: enable
     return R.float()    
 
+def _batched(pc):
+    ''' (B, N, C) view of a batch or of a single (N, C) cloud, so the
+    transforms also work inside the dataset transforms. '''
+    return pc.unsqueeze(0) if pc.dim() == 2 else pc
+
+# The transforms below work on a whole (B, N, C) batch at once: the
+# parameters of all clouds are drawn with one call of the torch RNG on the
+# device of the batch, and applied in place with broadcasting.
+
 class PointcloudRotatebyAngle(object):
     def __init__(self, rotation_angle = 0.0):
         self.rotation_angle = rotation_angle
 
+    def affine(self, pc):
+        cosval = np.cos(self.rotation_angle)
+        sinval = np.sin(self.rotation_angle)
+        rotation_matrix = np.array([[cosval, 0, sinval],
+                                    [0, 1, 0],
+                                    [-sinval, 0, cosval]])
+        return torch.from_numpy(rotation_matrix).type_as(pc).unsqueeze(0), None
+
     def __call__(self, pc):
-        normals = pc.size(2) > 3
-        bsize = pc.size(0)
-        for i in range(bsize):
-            cosval = np.cos(self.rotation_angle)
-            sinval = np.sin(self.rotation_angle)
-            rotation_matrix = np.array([[cosval, 0, sinval],
-                                        [0, 1, 0],
-                                        [-sinval, 0, cosval]])
-            rotation_matrix = torch.from_numpy(rotation_matrix).float().cuda()
-            
-            cur_pc = pc[i, :, :]
-            if not normals:
-                cur_pc = cur_pc @ rotation_matrix
-            else:
-                pc_xyz = cur_pc[:, 0:3]
-                pc_normals = cur_pc[:, 3:]
-                cur_pc[:, 0:3] = pc_xyz @ rotation_matrix
-                cur_pc[:, 3:] = pc_normals @ rotation_matrix
-                
-            pc[i, :, :] = cur_pc
-            
+        batch = _batched(pc)
+        rotation_matrix = self.affine(batch)[0]
+        batch[:, :, 0:3] = torch.matmul(batch[:, :, 0:3], rotation_matrix)
+        if batch.size(2) > 3: # normals
+            batch[:, :, 3:] = torch.matmul(batch[:, :, 3:], rotation_matrix)
         return pc
 
 class PointcloudJitter(object):
@@ -69,13 +70,11 @@ class PointcloudJitter(object):
         self.std, self.clip = std, clip
 
     def __call__(self, pc):
-        bsize = pc.size(0)
-        for i in range(bsize):
-            jittered_data = pc.new(pc.size(1), 3).normal_(
-                mean=0.0, std=self.std
-            ).clamp_(-self.clip, self.clip)
-            pc[i, :, 0:3] += jittered_data
-            
+        batch = _batched(pc)
+        jittered_data = batch.new(batch.size(0), batch.size(1), 3).normal_(
+            mean=0.0, std=self.std
+        ).clamp_(-self.clip, self.clip)
+        batch[:, :, 0:3] += jittered_data
         return pc
 
 class PointcloudScaleAndTranslate(object):
@@ -84,41 +83,44 @@ class PointcloudScaleAndTranslate(object):
         self.scale_high = scale_high
         self.translate_range = translate_range
 
+    def affine(self, pc):
+        # one draw for the scales and translations of all clouds
+        params = pc.new(pc.size(0), 2, 3).uniform_()
+        xyz1 = params[:, 0:1, :] * (self.scale_high - self.scale_low) + self.scale_low
+        xyz2 = params[:, 1:2, :] * (2 * self.translate_range) - self.translate_range
+        return xyz1, xyz2
+
     def __call__(self, pc):
-        bsize = pc.size(0)
-        for i in range(bsize):
-            xyz1 = np.random.uniform(low=self.scale_low, high=self.scale_high, size=[3])
-            xyz2 = np.random.uniform(low=-self.translate_range, high=self.translate_range, size=[3])
-            
-            pc[i, :, 0:3] = torch.mul(pc[i, :, 0:3], torch.from_numpy(xyz1).float().cuda()) + torch.from_numpy(xyz2).float().cuda()
-            
+        batch = _batched(pc)
+        xyz1, xyz2 = self.affine(batch)
+        batch[:, :, 0:3] = batch[:, :, 0:3] * xyz1 + xyz2
         return pc
-        
+
 class PointcloudScale(object):
     def __init__(self, scale_low=2. / 3., scale_high=3. / 2.):
         self.scale_low = scale_low
         self.scale_high = scale_high
 
+    def affine(self, pc):
+        xyz1 = pc.new(pc.size(0), 1, 3).uniform_(self.scale_low, self.scale_high)
+        return xyz1, None
+
     def __call__(self, pc):
-        bsize = pc.size(0)
-        for i in range(bsize):
-            xyz1 = np.random.uniform(low=self.scale_low, high=self.scale_high, size=[3])
-            
-            pc[i, :, 0:3] = torch.mul(pc[i, :, 0:3], torch.from_numpy(xyz1).float().cuda())
-            
+        batch = _batched(pc)
+        batch[:, :, 0:3] *= self.affine(batch)[0]
         return pc
-        
+
 class PointcloudTranslate(object):
     def __init__(self, translate_range=0.2):
         self.translate_range = translate_range
 
+    def affine(self, pc):
+        xyz2 = pc.new(pc.size(0), 1, 3).uniform_(-self.translate_range, self.translate_range)
+        return None, xyz2
+
     def __call__(self, pc):
-        bsize = pc.size(0)
-        for i in range(bsize):
-            xyz2 = np.random.uniform(low=-self.translate_range, high=self.translate_range, size=[3])
-            
-            pc[i, :, 0:3] = pc[i, :, 0:3] + torch.from_numpy(xyz2).float().cuda()
-            
+        batch = _batched(pc)
+        batch[:, :, 0:3] += self.affine(batch)[1]
         return pc
 
 class PointcloudRandomInputDropout(object):
@@ -127,13 +129,81 @@ class PointcloudRandomInputDropout(object):
         self.max_dropout_ratio = max_dropout_ratio
 
     def __call__(self, pc):
-        bsize = pc.size(0)
-        for i in range(bsize):
-            dropout_ratio = np.random.random() * self.max_dropout_ratio  # 0~0.875
-            drop_idx = np.where(np.random.random((pc.size()[1])) <= dropout_ratio)[0]
-            if len(drop_idx) > 0:
-                cur_pc = pc[i, :, :]
-                cur_pc[drop_idx.tolist(), 0:3] = cur_pc[0, 0:3].repeat(len(drop_idx), 1)  # set to the first point
-                pc[i, :, :] = cur_pc
+        batch = _batched(pc)
+        bsize, npoint = batch.size(0), batch.size(1)
+        dropout_ratio = batch.new(bsize, 1).uniform_(0, self.max_dropout_ratio)  # 0~0.875
+        drop = (batch.new(bsize, npoint).uniform_() <= dropout_ratio).unsqueeze(2).type_as(batch)
+        first = batch[:, 0:1, 0:3].clone()
+        # set to the first point
+        batch[:, :, 0:3] = batch[:, :, 0:3] * (1 - drop) + first * drop
+        return pc
+
+class PointcloudAugmentation(object):
+    ''' Apply the transforms in order to a (B, N, C) batch, in place:
+
+            augmentation = PointcloudAugmentation([PointcloudScale(), PointcloudTranslate(),
+                                                   PointcloudJitter()])
+            points.data = augmentation(points.data)
+
+    Consecutive scales, translations and rotations of xyz-only clouds are
+    composed into one affine transform per cloud, applied with a single
+    broadcast multiply-add, or a batched matrix multiply once a rotation
+    is involved.
+    '''
+    def __init__(self, transforms):
+        self.transforms = list(transforms)
 
+    def __call__(self, pc):
+        batch = _batched(pc)
+        matrix, offset = None, None
+        for t in self.transforms:
+            if hasattr(t, 'affine') and batch.size(2) == 3:
+                m, o = t.affine(batch)
+                matrix, offset = self._compose(matrix, offset, m, o)
+                continue
+            self._apply(batch, matrix, offset)
+            matrix, offset = None, None
+            t(batch)
+        self._apply(batch, matrix, offset)
         return pc
+
+    @staticmethod
+    def _as_matrix(m):
+        # per axis scales (B, 1, 3) become diagonal (B, 3, 3) matrices
+        if m.size(1) == 1:
+            return m.transpose(1, 2) * torch.eye(3).type_as(m).unsqueeze(0)
+        return m
+
+    @classmethod
+    def _compose(cls, matrix, offset, m, o):
+        ''' (x M1 + o1) M2 + o2 = x (M1 M2) + (o1 M2 + o2), where M is
+        either per axis scales (B, 1, 3) or a (B, 3, 3) matrix '''
+        if m is not None:
+            if offset is not None:
+                offset = offset * m if m.size(1) == 1 else torch.matmul(offset, m)
+            if matrix is None:
+                matrix = m
+            elif matrix.size(1) == 1 and m.size(1) == 1:
+                matrix = matrix * m
+            else:
+                matrix = torch.matmul(cls._as_matrix(matrix), cls._as_matrix(m))
+        if o is not None:
+            offset = o if offset is None else offset + o
+        return matrix, offset
+
+    @staticmethod
+    def _apply(batch, matrix, offset):
+        xyz = batch[:, :, 0:3]
+        if matrix is not None and matrix.size(1) == 3:
+            matrix = matrix.expand(batch.size(0), 3, 3)
+            if offset is not None:
+                xyz = torch.baddbmm(offset.expand(batch.size(0), batch.size(1), 3), xyz, matrix)
+            else:
+                xyz = torch.bmm(xyz, matrix)
+        elif matrix is not None:
+            xyz = xyz * matrix if offset is None else xyz * matrix + offset
+        elif offset is not None:
+            xyz = xyz + offset
+        else:
+            return
+        batch[:, :, 0:3] = xyz
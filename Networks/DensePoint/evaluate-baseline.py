@@ -1,7 +1,6 @@
 import torch
 import torch.optim as optim
 import torch.nn as nn
-from torch.utils.data import DataLoader
 from torch.autograd import Variable
 import torch.nn.functional as F
 import numpy as np
@@ -17,7 +16,7 @@ from densepoint_cls_L6_k24_g2 import DensePoint as DensePoint
 from pytorch_utils import pytorch_utils as pt_utils
 import pointnet2_utils
 from torchvision import transforms
-from data import ModelNet40Cls
+from data import ModelNet40Cls, ModelNet40BatchLoader
 import data.data_utils as d_utils
 import argparse
 import random
@@ -37,10 +36,32 @@ torch.cuda.manual_seed_all(seed)
 
 parser = argparse.ArgumentParser(description='DensePoint Shape Classification Voting Evaluate')
 parser.add_argument('--config', default='cfgs-baseline/config_cls.yaml', type=str)
+parser.add_argument('--vote_batch', action='store_true', help='Gather and scale the votes of a batch at once and forward them stacked along the batch dimension')
+parser.add_argument('--votes_per_run', type=int, default=0, help='Votes per forward pass with --vote_batch, 0 to start with all votes and halve on out-of-memory')
 
 NUM_REPEAT = 300
 NUM_VOTE = 10
 
+def vote_scores(model, points, fps_idx, num_points, augmentation, votes_per_run):
+    ''' Mean softmax scores of NUM_VOTE votes, as the sequential voting loop
+        computes them: one gather_operation samples the points of all votes,
+        one batched augmentation scales all but the first vote, and the votes
+        are forwarded votes_per_run at a time, stacked along the batch dimension.
+    '''
+    B = points.size(0)
+    choice = np.concatenate([np.random.choice(1200, num_points, False) for _ in range(NUM_VOTE)])
+    new_points = pointnet2_utils.gather_operation(points.transpose(1, 2).contiguous(), fps_idx[:, choice].contiguous())
+    # (B, C, NUM_VOTE*num_points) -> (NUM_VOTE*B, num_points, C), vote major
+    new_points = new_points.view(B, -1, NUM_VOTE, num_points).permute(2, 0, 3, 1).contiguous()
+    new_points = new_points.view(NUM_VOTE*B, num_points, -1)
+    augmentation(new_points.data[B:])
+
+    pred = 0
+    for v in range(0, NUM_VOTE, votes_per_run):
+        scores = F.softmax(model(new_points[v*B:(v+votes_per_run)*B]), dim = 1)
+        pred += scores.view(-1, B, scores.size(1)).sum(0)
+    return pred / NUM_VOTE
+
 def main():
     args = parser.parse_args()
     with open(args.config) as f:
@@ -53,13 +74,7 @@ def main():
     ])
 
     test_dataset = ModelNet40Cls(num_points = args.num_points, root = args.data_root, transforms=test_transforms, train=False)
-    test_dataloader = DataLoader(
-        test_dataset, 
-        batch_size=args.batch_size,
-        shuffle=False, 
-        num_workers=int(args.workers), 
-        pin_memory=True
-    )
+    test_dataloader = ModelNet40BatchLoader(test_dataset, batch_size=args.batch_size, shuffle=False)
     
     model = DensePoint(num_classes = args.num_classes, input_channels = args.input_channels, use_xyz = True)
     model.cuda()
@@ -69,9 +84,10 @@ def main():
         print('Load model successfully: %s' % (args.checkpoint))
     
     # evaluate
-    PointcloudScale = d_utils.PointcloudScale()   # initialize random scaling
+    augmentation = d_utils.PointcloudAugmentation([d_utils.PointcloudScale()])   # initialize random scaling
     model.eval()
     global_acc = 0
+    votes_per_run = min(args.votes_per_run or NUM_VOTE, NUM_VOTE)
     for i in range(NUM_REPEAT):
         preds = []
         labels = []
@@ -90,14 +106,26 @@ def main():
             fps_idx = np.random.randint(0, points.shape[1]-1, size=[points.shape[0], 1200])
             fps_idx = torch.from_numpy(fps_idx).type(torch.IntTensor).cuda()
 
-            pred = 0
-            for v in range(NUM_VOTE):
-                new_fps_idx = fps_idx[:, np.random.choice(1200, args.num_points, False)]
-                new_points = pointnet2_utils.gather_operation(points.transpose(1, 2).contiguous(), new_fps_idx).transpose(1, 2).contiguous()
-                if v > 0:
-                    new_points.data = PointcloudScale(new_points.data)
-                pred += F.softmax(model(new_points), dim = 1)
-            pred /= NUM_VOTE
+            if args.vote_batch:
+                while True:
+                    try:
+                        pred = vote_scores(model, points, fps_idx, args.num_points, augmentation, votes_per_run)
+                        break
+                    except RuntimeError as e:
+                        if 'out of memory' not in str(e) or votes_per_run == 1:
+                            raise
+                        votes_per_run = (votes_per_run + 1) // 2
+                        torch.cuda.empty_cache()
+                        print('Out of memory, retrying with %d votes per run' % (votes_per_run))
+            else:
+                pred = 0
+                for v in range(NUM_VOTE):
+                    new_fps_idx = fps_idx[:, np.random.choice(1200, args.num_points, False)]
+                    new_points = pointnet2_utils.gather_operation(points.transpose(1, 2).contiguous(), new_fps_idx).transpose(1, 2).contiguous()
+                    if v > 0:
+                        new_points.data = augmentation(new_points.data)
+                    pred += F.softmax(model(new_points), dim = 1)
+                pred /= NUM_VOTE
             target = target.view(-1)
             _, pred_choice = torch.max(pred.data, -1)
             
@@ -0,0 +1,98 @@
+'''
+    Post-training quantization of the DensePoint conv and FC layers, the
+    PyTorch counterpart of freeze_util.quantize_graph in Benchmark. The
+    precisions and the quantization math are those of Benchmark/quant_util.py.
+
+    Every Conv1d, Conv2d and Linear of the model, which covers the shared MLPs
+    (pt_utils.SharedMLP) and the phi and psi convs of EnhancedPointConv, is
+    wrapped in a QuantizedLayer:
+      - int8 weights are quantized per output channel and stored dequantized,
+        so the layers still run the float kernels with the int8 values,
+      - fp16 activations run the layer in half precision,
+      - int8 activations are fake quantized with the range seen on the
+        calibration batches.
+    Batch norms are left in float; they scale every output channel on its
+    own, so the per-channel weight error is the same as after folding them.
+
+    The sampling and grouping ops of utils/_ext only run on CUDA, so the
+    model stays on the GPU.
+'''
+import torch
+import torch.nn as nn
+import quant_util
+
+QUANTIZED_MODULES = (nn.Conv1d, nn.Conv2d, nn.Linear)
+
+class QuantizedLayer(nn.Module):
+    ''' A conv or FC layer with the weights and inputs of a precision. '''
+    def __init__(self, layer, precision):
+        super(QuantizedLayer, self).__init__()
+        self.layer = layer
+        self.weights_type = quant_util.weight_type(precision)
+        self.activations_type = quant_util.activation_type(precision)
+        self.calibrating = False
+        self.input_range = None
+        self.input_params = None # (scale, zero point) of int8 inputs
+
+        weight = layer.weight.data
+        self.weight_bytes_fp32 = weight.numel() * 4
+        if self.weights_type == 'int8':
+            q, scale = quant_util.quantize_weights(weight.cpu().numpy(), 0)
+            layer.weight.data = torch.from_numpy(quant_util.dequantize_weights(q, scale)).type_as(weight)
+            self.weight_bytes = q.nbytes + scale.nbytes
+        else:
+            self.weight_bytes = weight.numel() * 2
+        if self.activations_type == 'fp16':
+            layer.half()
+
+    def calibrated(self):
+        ''' Fix the int8 input parameters to the range seen so far. '''
+        self.calibrating = False
+        if self.input_range is not None:
+            scale, zero_point, _, _ = quant_util.activation_params(*self.input_range)
+            self.input_params = (scale, zero_point)
+
+    def forward(self, x):
+        if self.calibrating:
+            lo, hi = float(x.min()), float(x.max())
+            if self.input_range is not None:
+                lo, hi = min(lo, self.input_range[0]), max(hi, self.input_range[1])
+            self.input_range = (lo, hi)
+            return self.layer(x)
+        if self.activations_type == 'fp16':
+            return self.layer(x.half()).float()
+        if self.activations_type == 'int8' and self.input_params is not None:
+            scale, zero_point = self.input_params
+            x = torch.clamp(torch.round(x / scale) + zero_point, 0, quant_util.ACTIVATION_LEVELS)
+            x = (x - zero_point) * scale
+        return self.layer(x)
+
+def quantize_model(model, precision, calibration=()):
+    ''' Wrap the conv and FC layers of an eval mode model in QuantizedLayers
+        and, for int8 activations, calibrate their input ranges.
+        calibration: BxNx3 float tensors on the device of the model
+        Return the statistics printed by quant_util.format_stats.
+    '''
+    if precision == 'fp32':
+        return {'precision': precision, 'layers_quantized': 0}
+    layers = []
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, QUANTIZED_MODULES):
+                layers.append(QuantizedLayer(child, precision))
+                setattr(parent, name, layers[-1])
+    stats = {'precision': precision, 'layers_quantized': len(layers),
+             'weight_bytes_fp32': sum(l.weight_bytes_fp32 for l in layers),
+             'weight_bytes': sum(l.weight_bytes for l in layers)}
+
+    if quant_util.activation_type(precision) == 'int8':
+        for l in layers:
+            l.calibrating = True
+        with torch.no_grad():
+            for batch in calibration:
+                model(batch)
+        for l in layers:
+            l.calibrated()
+        stats['activations_calibrated'] = sum(l.input_params is not None for l in layers)
+        stats['calibration_clouds'] = sum(batch.size(0) for batch in calibration)
+    return stats
@@ -2,7 +2,6 @@ import torch
 import torch.optim as optim
 import torch.optim.lr_scheduler as lr_sched
 import torch.nn as nn
-from torch.utils.data import DataLoader
 from torch.autograd import Variable
 import numpy as np
 import os
@@ -17,7 +16,7 @@ from densepoint_cls_L6_k24_g2 import DensePoint as DensePoint
 from pytorch_utils import pytorch_utils as pt_utils
 import pointnet2_utils
 from torchvision import transforms
-from data import ModelNet40Cls
+from data import ModelNet40Cls, ModelNet40BatchLoader
 import data.data_utils as d_utils
 import argparse
 import random
@@ -60,22 +59,10 @@ def main():
     ])
     
     train_dataset = ModelNet40Cls(num_points = args.num_points, root = args.data_root, transforms=train_transforms)
-    train_dataloader = DataLoader(
-        train_dataset, 
-        batch_size=args.batch_size,
-        shuffle=True, 
-        num_workers=int(args.workers), 
-        pin_memory=True
-    )
+    train_dataloader = ModelNet40BatchLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
 
     test_dataset = ModelNet40Cls(num_points = args.num_points, root = args.data_root, transforms=test_transforms, train=False)
-    test_dataloader = DataLoader(
-        test_dataset, 
-        batch_size=args.batch_size,
-        shuffle=False, 
-        num_workers=int(args.workers), 
-        pin_memory=True
-    )
+    test_dataloader = ModelNet40BatchLoader(test_dataset, batch_size=args.batch_size, shuffle=False)
     
     model = DensePoint(num_classes = args.num_classes, input_channels = args.input_channels, use_xyz = True)
     model.cuda()
@@ -99,7 +86,7 @@ def main():
     
 
 def train(train_dataloader, test_dataloader, model, criterion, optimizer, lr_scheduler, bnm_scheduler, args, num_batch):
-    PointcloudScaleAndTranslate = d_utils.PointcloudScaleAndTranslate()   # initialize augmentation
+    augmentation = d_utils.PointcloudAugmentation([d_utils.PointcloudScaleAndTranslate()])   # initialize augmentation
     global g_acc 
     g_acc = 0.91    # only save the model whose acc > 0.91
     batch_count = 0
@@ -125,7 +112,7 @@ def train(train_dataloader, test_dataloader, model, criterion, optimizer, lr_sch
             points = pointnet2_utils.gather_operation(points.transpose(1, 2).contiguous(), fps_idx).transpose(1, 2).contiguous()  # (B, N, 3)
             
             # augmentation
-            points.data = PointcloudScaleAndTranslate(points.data)
+            points.data = augmentation(points.data)
             
             optimizer.zero_grad()
             
@@ -0,0 +1,96 @@
+'''
+    Benchmark DGCNN classification latency and throughput on synthetic point clouds.
+    No dataset is needed. Weights are randomly initialized unless --model_path is given.
+    DGCNN has no separate limited delayed-aggregation model, so only baseline and full exist.
+'''
+import tensorflow as tf
+import numpy as np
+import argparse
+import importlib
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+import sys
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, '../../Benchmark'))
+import bench_util
+import freeze_util
+import graph_cache
+
+# (model dir, utils dir) of each aggregation variant, as in evaluate*.py
+VARIANT_DIRS = {
+    'full' : ('models', 'utils'),
+    'baseline' : ('models-baseline', 'utils-baseline')
+}
+
+parser = argparse.ArgumentParser()
+bench_util.add_benchmark_args(parser, VARIANT_DIRS.keys(), batch_size=16, num_point=1024)
+parser.add_argument('--model', default='dgcnn', help='Model name: dgcnn [default: dgcnn]')
+graph_cache.add_cache_args(parser)
+
+def build_predictor(variant, model_name, batch_size, num_point, model_path=None, gpu=0,
+                    cache_dir=None, precision=None, calibration=(), cpu=False):
+    ''' Build the graph of one variant, or load it from the graph cache in
+        cache_dir, and return predict(points) -> {'logits': Bx40}.
+        precision and calibration as in quant_util.py. The edge convs and
+        FC layers are quantized, the k-NN distances stay in fp32. '''
+    model_dir, utils_dir = VARIANT_DIRS[variant]
+    sys.path.append(os.path.join(BASE_DIR, model_dir))
+    sys.path.append(os.path.join(BASE_DIR, utils_dir))
+    MODEL = importlib.import_module(model_name)
+    cache_file = graph_cache.cache_file(cache_dir, 'dgcnn', variant, batch_size, num_point,
+        extra={'model': model_name},
+        sources=[os.path.join(BASE_DIR, model_dir), os.path.join(BASE_DIR, utils_dir),
+                 os.path.abspath(__file__)])
+
+    def build():
+        pointclouds_pl, _ = MODEL.placeholder_inputs(batch_size, num_point)
+        is_training_pl = tf.placeholder(tf.bool, shape=())
+        pred, _ = MODEL.get_model(pointclouds_pl, is_training_pl)
+        return {'pointclouds_pl': pointclouds_pl, 'is_training_pl': is_training_pl, 'pred': pred}
+
+    with tf.Graph().as_default():
+        with tf.device('/gpu:'+str(gpu)):
+            ops, saver = graph_cache.cached_graph(cache_file, build)
+
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        config.log_device_placement = False
+        sess = tf.Session(config=config)
+        if model_path is not None:
+            saver.restore(sess, model_path)
+            print("Model restored.")
+        else:
+            sess.run(tf.global_variables_initializer())
+
+    if precision is not None:
+        frozen_sess, inputs, outputs, _ = freeze_util.quantized_session(sess,
+            {'pointclouds_pl': ops['pointclouds_pl']}, {'pred': ops['pred']},
+            ops['is_training_pl'], precision, [{'pointclouds_pl': b} for b in calibration],
+            cpu, gpu)
+        sess.close()
+        # is_training_pl is constant False in the frozen graph
+        sess, ops = frozen_sess, dict(inputs, **outputs)
+
+    def predict(points, options=None, run_metadata=None):
+        feed_dict = {ops['pointclouds_pl']: points}
+        if 'is_training_pl' in ops:
+            feed_dict[ops['is_training_pl']] = False
+        return {'logits': sess.run(ops['pred'], feed_dict=feed_dict,
+            options=options, run_metadata=run_metadata)}
+    return predict
+
+def predictor_from_flags(FLAGS):
+    ''' build_predictor from flags parsed by parser, as used by Serving/worker.py. '''
+    return build_predictor(FLAGS.variant, FLAGS.model, FLAGS.batch_size,
+        FLAGS.num_point, FLAGS.model_path, FLAGS.gpu, graph_cache.cache_dir(FLAGS),
+        FLAGS.precision, bench_util.calibration_batches(FLAGS), FLAGS.cpu)
+
+def main():
+    FLAGS = parser.parse_args()
+    predict = predictor_from_flags(FLAGS)
+    bench_util.run_benchmark('dgcnn', FLAGS, predict, num_channel=3)
+
+if __name__=='__main__':
+    main()
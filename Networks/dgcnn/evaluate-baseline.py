@@ -12,7 +12,12 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(BASE_DIR, 'models-baseline'))
 sys.path.append(os.path.join(BASE_DIR, 'utils-baseline'))
+sys.path.append(os.path.join(BASE_DIR, '../../PowerMeasurement'))
+sys.path.append(os.path.join(BASE_DIR, '../../Benchmark'))
 import provider
+import energy
+import freeze_util
+import graph_cache
 import pc_util
 
 parser = argparse.ArgumentParser()
@@ -23,6 +28,11 @@ parser.add_argument('--num_point', type=int, default=1024, help='Point Number [2
 parser.add_argument('--model_path', default='log-baseline/model-best-acc.ckpt', help='model checkpoint file path [default: log/model-best-acc.ckpt]')
 parser.add_argument('--dump_dir', default='dump', help='dump folder path [dump]')
 parser.add_argument('--visu', action='store_true', help='Whether to dump image for error case [default: False]')
+parser.add_argument('--export_graph', default=None, help='Write the restored model as a frozen inference graph with batch norm folded to this file and exit [default: None]')
+parser.add_argument('--frozen_graph', default=None, help='Evaluate the frozen graph written by --export_graph instead of building the model [default: None]')
+parser.add_argument('--energy_backend', default=None, help='Measure energy per batch with this power backend: auto, jetson or rapl [default: None]')
+parser.add_argument('--energy_warmup', type=int, default=10, help='Num of first batches reported as warm-up energy [default: 10]')
+graph_cache.add_cache_args(parser)
 FLAGS = parser.parse_args()
 
 BATCH_SIZE = FLAGS.batch_size
@@ -52,19 +62,30 @@ def log_string(out_str):
     LOG_FOUT.flush()
     print(out_str)
 
-def evaluate(num_votes):
-    is_training = False
-    # run_metadata = tf.compat.v1.RunMetadata()
-    with tf.device('/gpu:'+str(GPU_INDEX)):
-        pointclouds_pl, labels_pl = MODEL.placeholder_inputs(BATCH_SIZE, NUM_POINT)
-        is_training_pl = tf.placeholder(tf.bool, shape=())
+def build_graph():
+    ''' Build the graph in the default graph and return its tensors. '''
+    pointclouds_pl, labels_pl = MODEL.placeholder_inputs(BATCH_SIZE, NUM_POINT)
+    is_training_pl = tf.placeholder(tf.bool, shape=())
 
-        # simple model
-        pred, end_points = MODEL.get_model(pointclouds_pl, is_training_pl)
-        loss = MODEL.get_loss(pred, labels_pl, end_points)
-        
+    # simple model
+    pred, end_points = MODEL.get_model(pointclouds_pl, is_training_pl)
+    loss = MODEL.get_loss(pred, labels_pl, end_points)
+    return {'pointclouds_pl': pointclouds_pl,
+            'labels_pl': labels_pl,
+            'is_training_pl': is_training_pl,
+            'pred': pred,
+            'loss': loss}
+
+def build_model():
+    ''' Build the graph in the default graph, or load it from the graph
+        cache, restore the model and return the session and ops. '''
+    cache_file = graph_cache.cache_file(graph_cache.cache_dir(FLAGS), 'dgcnn', 'baseline',
+        BATCH_SIZE, NUM_POINT, extra={'model': FLAGS.model},
+        sources=[os.path.join(BASE_DIR, 'models-baseline'), os.path.join(BASE_DIR, 'utils-baseline'),
+                 os.path.abspath(__file__)])
+    with tf.device('/gpu:'+str(GPU_INDEX)):
         # Add ops to save and restore all the variables.
-        saver = tf.train.Saver()
+        ops, saver = graph_cache.cached_graph(cache_file, build_graph)
         
     # Create a session
     config = tf.ConfigProto()
@@ -77,20 +98,57 @@ def evaluate(num_votes):
     print("restore models", MODEL_PATH)
     saver.restore(sess, MODEL_PATH) 
     log_string("Model restored.")
+    return sess, ops
+
+def load_frozen_model():
+    ''' Load the graph written by --export_graph into the default graph and
+        return the session and ops. '''
+    inputs, outputs = freeze_util.load_frozen_graph(FLAGS.frozen_graph)
+    # batch norm is folded in, is_training is fed but unused
+    is_training_pl = tf.placeholder(tf.bool, shape=())
+
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    config.allow_soft_placement = True
+    config.log_device_placement = False
+    sess = tf.Session(config=config)
+    log_string("Frozen graph loaded.")
 
-    ops = {'pointclouds_pl': pointclouds_pl,
-           'labels_pl': labels_pl,
-           'is_training_pl': is_training_pl,
-           'pred': pred,
-           'loss': loss}
+    ops = dict(inputs)
+    ops.update(outputs)
+    ops['is_training_pl'] = is_training_pl
+    return sess, ops
+
+def evaluate(num_votes):
+    is_training = False
+    # run_metadata = tf.compat.v1.RunMetadata()
+    if FLAGS.frozen_graph is not None:
+        sess, ops = load_frozen_model()
+    else:
+        sess, ops = build_model()
+    if FLAGS.export_graph is not None:
+        _, stats = freeze_util.export_frozen_graph(sess,
+            {'pointclouds_pl': ops['pointclouds_pl'], 'labels_pl': ops['labels_pl']},
+            {'pred': ops['pred'], 'loss': ops['loss']},
+            ops['is_training_pl'], FLAGS.export_graph)
+        log_string('Frozen graph written to ' + freeze_util.format_stats(FLAGS.export_graph, stats))
+        return
     # print("eval_one_epoch")
     
     s = time.time()
-    eval_one_epoch(sess, ops, num_votes)
+    backend = energy.get_backend(FLAGS.energy_backend) if FLAGS.energy_backend is not None else None
+    meter = energy.EnergyMeter(backend)
+    meter.start()
+    eval_one_epoch(sess, ops, num_votes, meter=meter)
+    meter.stop()
     e = time.time()
     print("time (secs): ", (e - s))
+    if meter.enabled:
+        log_string(energy.format_report(meter.report()))
 
-def eval_one_epoch(sess, ops, num_votes=1, topk=1):
+def eval_one_epoch(sess, ops, num_votes=1, topk=1, meter=None):
+    if meter is None:
+        meter = energy.EnergyMeter()
     error_cnt = 0
     is_training = False
     total_correct = 0
@@ -122,6 +180,7 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
             batch_loss_sum = 0 # sum of losses for the batch
             batch_pred_sum = np.zeros((cur_batch_size, NUM_CLASSES)) # score for classes
             batch_pred_classes = np.zeros((cur_batch_size, NUM_CLASSES)) # 0/1 for classes
+            meter.begin_batch()
             for vote_idx in range(num_votes):
                 # print("batch, vote index", batch_idx, vote_idx)
                 print("batch:", batch_idx)
@@ -150,6 +209,7 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
                 for el_idx in range(cur_batch_size):
                     batch_pred_classes[el_idx, batch_pred_val[el_idx]] += 1
                 batch_loss_sum += (loss_val * cur_batch_size / float(num_votes))
+            meter.end_batch(cur_batch_size, warmup=meter.num_batches < FLAGS.energy_warmup)
             # pred_val_topk = np.argsort(batch_pred_sum, axis=-1)[:,-1*np.array(range(topk))-1]
             # pred_val = np.argmax(batch_pred_classes, 1)
             pred_val = np.argmax(batch_pred_sum, 1)
@@ -8,12 +8,19 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
 import scipy.misc
 import sys
+import h5py
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(BASE_DIR, 'models'))
 sys.path.append(os.path.join(BASE_DIR, 'utils'))
+sys.path.append(os.path.join(BASE_DIR, '../../PowerMeasurement'))
+sys.path.append(os.path.join(BASE_DIR, '../../Benchmark'))
 import provider
+import energy
+import freeze_util
+import graph_cache
 import pc_util
+import shard_util
 
 
 parser = argparse.ArgumentParser()
@@ -24,7 +31,16 @@ parser.add_argument('--num_point', type=int, default=1024, help='Point Number [2
 parser.add_argument('--model_path', default='log/model-best-acc.ckpt', help='model checkpoint file path [default: log/model-best-acc.ckpt]')
 parser.add_argument('--dump_dir', default='dump', help='dump folder path [dump]')
 parser.add_argument('--visu', action='store_true', help='Whether to dump image for error case [default: False]')
+parser.add_argument('--export_graph', default=None, help='Write the restored model as a frozen inference graph with batch norm folded to this file and exit [default: None]')
+parser.add_argument('--frozen_graph', default=None, help='Evaluate the frozen graph written by --export_graph instead of building the model [default: None]')
+parser.add_argument('--energy_backend', default=None, help='Measure energy per batch with this power backend: auto, jetson or rapl [default: None]')
+parser.add_argument('--energy_warmup', type=int, default=10, help='Num of first batches reported as warm-up energy [default: 10]')
+graph_cache.add_cache_args(parser)
+shard_util.add_shard_args(parser)
 FLAGS = parser.parse_args()
+if FLAGS.num_shards > 1 and FLAGS.energy_backend is not None:
+    # the power counters cover the whole device, shards would count each other
+    parser.error('--energy_backend measures a single process, not --num_shards')
 
 BATCH_SIZE = FLAGS.batch_size
 NUM_POINT = FLAGS.num_point
@@ -53,51 +69,134 @@ def log_string(out_str):
     LOG_FOUT.flush()
     print(out_str)
 
-def evaluate(num_votes):
-    is_training = False
-    # run_metadata = tf.compat.v1.RunMetadata()
-    with tf.device('/gpu:'+str(GPU_INDEX)):
-        pointclouds_pl, labels_pl = MODEL.placeholder_inputs(BATCH_SIZE, NUM_POINT)
-        is_training_pl = tf.placeholder(tf.bool, shape=())
+def build_graph():
+    ''' Build the graph in the default graph and return its tensors. '''
+    pointclouds_pl, labels_pl = MODEL.placeholder_inputs(BATCH_SIZE, NUM_POINT)
+    is_training_pl = tf.placeholder(tf.bool, shape=())
 
-        # simple model
-        pred, end_points = MODEL.get_model(pointclouds_pl, is_training_pl)
-        loss = MODEL.get_loss(pred, labels_pl, end_points)
-        
+    # simple model
+    pred, end_points = MODEL.get_model(pointclouds_pl, is_training_pl)
+    loss = MODEL.get_loss(pred, labels_pl, end_points)
+    return {'pointclouds_pl': pointclouds_pl,
+            'labels_pl': labels_pl,
+            'is_training_pl': is_training_pl,
+            'pred': pred,
+            'loss': loss}
+
+def build_model():
+    ''' Build the graph in the default graph, or load it from the graph
+        cache, restore the model and return the session and ops. '''
+    cache_file = graph_cache.cache_file(graph_cache.cache_dir(FLAGS), 'dgcnn', 'full',
+        BATCH_SIZE, NUM_POINT, extra={'model': FLAGS.model},
+        sources=[os.path.join(BASE_DIR, 'models'), os.path.join(BASE_DIR, 'utils'),
+                 os.path.abspath(__file__)])
+    with tf.device('/gpu:'+str(GPU_INDEX)):
         # Add ops to save and restore all the variables.
-        saver = tf.train.Saver()
+        ops, saver = graph_cache.cached_graph(cache_file, build_graph)
         
     # Create a session
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True
     config.allow_soft_placement = True
     config.log_device_placement = False
+    shard_util.configure_session(config, FLAGS)
     sess = tf.Session(config=config)
 
     # Restore variables from disk.
     print("restore models", MODEL_PATH)
     saver.restore(sess, MODEL_PATH) 
     log_string("Model restored.")
+    return sess, ops
+
+def load_frozen_model():
+    ''' Load the graph written by --export_graph into the default graph and
+        return the session and ops. '''
+    inputs, outputs = freeze_util.load_frozen_graph(FLAGS.frozen_graph)
+    # batch norm is folded in, is_training is fed but unused
+    is_training_pl = tf.placeholder(tf.bool, shape=())
+
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    config.allow_soft_placement = True
+    config.log_device_placement = False
+    shard_util.configure_session(config, FLAGS)
+    sess = tf.Session(config=config)
+    log_string("Frozen graph loaded.")
 
-    ops = {'pointclouds_pl': pointclouds_pl,
-           'labels_pl': labels_pl,
-           'is_training_pl': is_training_pl,
-           'pred': pred,
-           'loss': loss}
+    ops = dict(inputs)
+    ops.update(outputs)
+    ops['is_training_pl'] = is_training_pl
+    return sess, ops
+
+def evaluate(num_votes):
+    is_training = False
+    # run_metadata = tf.compat.v1.RunMetadata()
+    if FLAGS.frozen_graph is not None:
+        sess, ops = load_frozen_model()
+    else:
+        sess, ops = build_model()
+    if FLAGS.export_graph is not None:
+        _, stats = freeze_util.export_frozen_graph(sess,
+            {'pointclouds_pl': ops['pointclouds_pl'], 'labels_pl': ops['labels_pl']},
+            {'pred': ops['pred'], 'loss': ops['loss']},
+            ops['is_training_pl'], FLAGS.export_graph)
+        log_string('Frozen graph written to ' + freeze_util.format_stats(FLAGS.export_graph, stats))
+        return
     #print("eval_one_epoch")
     s = time.time()
-    eval_one_epoch(sess, ops, num_votes)
+    backend = energy.get_backend(FLAGS.energy_backend) if FLAGS.energy_backend is not None else None
+    meter = energy.EnergyMeter(backend)
+    meter.start()
+    counts = eval_one_epoch(sess, ops, num_votes, meter=meter)
+    meter.stop()
     e = time.time()
     print("time (sec):", (e - s))
+    if meter.enabled:
+        log_string(energy.format_report(meter.report()))
+    shard_util.write_result(FLAGS, counts)
 
-def eval_one_epoch(sess, ops, num_votes=1, topk=1):
+def evaluate_shards():
+    ''' Evaluate the test set in --num_shards worker processes, each with a
+        dump dir of its own, and log the metrics of their merged counts. '''
+    s = time.time()
+    counts = shard_util.merge(shard_util.run_shards(FLAGS, DUMP_DIR, num_test_batches(),
+        lambda i: ['--dump_dir', os.path.join(DUMP_DIR, 'shard_%d' % i)]))
+    e = time.time()
+    print("time (sec):", (e - s))
+    with open(os.path.join(DUMP_DIR, 'pred_label.txt'), 'w') as fout:
+        for _, lines in sorted(counts['pred_label']):
+            fout.writelines(lines)
+    log_string('Merged %d shards.' % FLAGS.num_shards)
+    log_metrics(counts)
+
+def num_test_batches():
+    ''' Number of batches of eval_one_epoch, from the h5 file headers. '''
+    num_batches = 0
+    for filename in TEST_FILES:
+        with h5py.File(filename, 'r') as f:
+            num_batches += f['data'].shape[0] // BATCH_SIZE
+    return num_batches
+
+def log_metrics(counts):
+    ''' Log the metrics of the counts of the evaluated batches. '''
+    if counts['seen'] == 0:
+        log_string('no batches evaluated')
+        return
+    log_string('eval mean loss: %f' % (counts['loss_sum'] / float(counts['seen'])))
+    log_string('eval accuracy: %f' % (counts['correct'] / float(counts['seen'])))
+    log_string('eval avg class acc: %f' % (np.mean(counts['correct_class']/counts['seen_class'].astype(np.float))))
+
+def eval_one_epoch(sess, ops, num_votes=1, topk=1, meter=None):
+    if meter is None:
+        meter = energy.EnergyMeter()
     error_cnt = 0
     is_training = False
-    total_correct = 0
-    total_seen = 0
-    loss_sum = 0
-    total_seen_class = [0 for _ in range(NUM_CLASSES)]
-    total_correct_class = [0 for _ in range(NUM_CLASSES)]
+    # Raw counts, merged across shards by summing them
+    counts = {'correct': 0, 'seen': 0, 'loss_sum': 0.0,
+              'seen_class': np.zeros(NUM_CLASSES, dtype=np.int64),
+              'correct_class': np.zeros(NUM_CLASSES, dtype=np.int64),
+              'pred_label': []}
+    unit = -1 # index of the batch over all files
     fout = open(os.path.join(DUMP_DIR, 'pred_label.txt'), 'w')
 
     for fn in range(len(TEST_FILES)): 
@@ -113,6 +212,9 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
        
         print("batch number:", num_batches)
         for batch_idx in range(num_batches):
+            unit += 1
+            if not shard_util.owns(FLAGS, unit):
+                continue
             print("batch index: ", batch_idx)
             start_idx = batch_idx * BATCH_SIZE
             end_idx = (batch_idx+1) * BATCH_SIZE
@@ -122,6 +224,7 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
             batch_loss_sum = 0 # sum of losses for the batch
             batch_pred_sum = np.zeros((cur_batch_size, NUM_CLASSES)) # score for classes
             batch_pred_classes = np.zeros((cur_batch_size, NUM_CLASSES)) # 0/1 for classes
+            meter.begin_batch()
             for vote_idx in range(num_votes):
                 # print("batch, vote index", batch_idx, vote_idx)
                 rotated_data = provider.rotate_point_cloud_by_angle(current_data[start_idx:end_idx, :, :],
@@ -148,6 +251,7 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
                 for el_idx in range(cur_batch_size):
                     batch_pred_classes[el_idx, batch_pred_val[el_idx]] += 1
                 batch_loss_sum += (loss_val * cur_batch_size / float(num_votes))
+            meter.end_batch(cur_batch_size, warmup=meter.num_batches < FLAGS.energy_warmup)
             # pred_val_topk = np.argsort(batch_pred_sum, axis=-1)[:,-1*np.array(range(topk))-1]
             # pred_val = np.argmax(batch_pred_classes, 1)
             pred_val = np.argmax(batch_pred_sum, 1)
@@ -155,15 +259,16 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
             
             correct = np.sum(pred_val == current_label[start_idx:end_idx])
             # correct = np.sum(pred_val_topk[:,0:topk] == label_val)
-            total_correct += correct
-            total_seen += cur_batch_size
-            loss_sum += batch_loss_sum
+            counts['correct'] += correct
+            counts['seen'] += cur_batch_size
+            counts['loss_sum'] += batch_loss_sum
 
+            lines = []
             for i in range(start_idx, end_idx):
                 l = current_label[i]
-                total_seen_class[l] += 1
-                total_correct_class[l] += (pred_val[i-start_idx] == l)
-                fout.write('%d, %d\n' % (pred_val[i-start_idx], l))
+                counts['seen_class'][l] += 1
+                counts['correct_class'][l] += (pred_val[i-start_idx] == l)
+                lines.append('%d, %d\n' % (pred_val[i-start_idx], l))
                 
                 if pred_val[i-start_idx] != l and FLAGS.visu: # ERROR CASE, DUMP!
                     img_filename = '%d_label_%s_pred_%s.jpg' % (error_cnt, SHAPE_NAMES[l],
@@ -172,30 +277,37 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
                     output_img = pc_util.point_cloud_three_views(np.squeeze(current_data[i, :, :]))
                     scipy.misc.imsave(img_filename, output_img)
                     error_cnt += 1
+            fout.writelines(lines)
+            counts['pred_label'].append((unit, lines))
         
-    log_string('eval mean loss: %f' % (loss_sum / float(total_seen)))
-    log_string('eval accuracy: %f' % (total_correct / float(total_seen)))
-    log_string('eval avg class acc: %f' % (np.mean(np.array(total_correct_class)/np.array(total_seen_class,dtype=np.float))))
+    fout.close()
+    # the coordinator logs the metrics of the merged counts of the shards
+    if not shard_util.is_worker(FLAGS):
+        log_metrics(counts)
+    return counts
     
     # class_accuracies = np.array(total_correct_class)/np.array(total_seen_class,dtype=np.float)
     # for i, name in enumerate(SHAPE_NAMES):
     #    log_string('%10s:\t%0.3f' % (name, class_accuracies[i]))
 
 if __name__=='__main__':
-    with tf.Graph().as_default(): 
-        # run_metadata = evaluate(num_votes=1)
-        evaluate(num_votes=1)
-        
-        '''
-        opts = tf.contrib.tfprof.model_analyzer.PRINT_ALL_TIMING_MEMORY.copy()
-        #opts['select'] = ["device", "micros"] #,"output_bytes"]
-        #opts['order_by'] = "occurrence"
-        opts['output'] = 'timeline:outfile=dgcnn.json'
-
-        tf.contrib.tfprof.model_analyzer.print_model_analysis(
-            tf.get_default_graph(),
-            run_meta=run_metadata,
-            tfprof_options=opts)
-        '''
+    if shard_util.is_coordinator(FLAGS) and FLAGS.export_graph is None:
+        evaluate_shards()
+    else:
+        with tf.Graph().as_default(): 
+            # run_metadata = evaluate(num_votes=1)
+            evaluate(num_votes=1)
+            
+            '''
+            opts = tf.contrib.tfprof.model_analyzer.PRINT_ALL_TIMING_MEMORY.copy()
+            #opts['select'] = ["device", "micros"] #,"output_bytes"]
+            #opts['order_by'] = "occurrence"
+            opts['output'] = 'timeline:outfile=dgcnn.json'
+
+            tf.contrib.tfprof.model_analyzer.print_model_analysis(
+                tf.get_default_graph(),
+                run_meta=run_metadata,
+                tfprof_options=opts)
+            '''
 
     LOG_FOUT.close()
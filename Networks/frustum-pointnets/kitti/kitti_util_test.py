@@ -0,0 +1,64 @@
+''' Tests of kitti_util.ImageGridIndex against the per-box masks it replaces.
+
+Usage: python kitti_util_test.py
+'''
+import unittest
+import numpy as np
+import kitti_util as utils
+
+def box_masks(pts_2d, valid, boxes):
+    ''' Point indices of every box, as prepare_data.py computed them. '''
+    result = []
+    for xmin,ymin,xmax,ymax in boxes:
+        with np.errstate(invalid='ignore'):
+            box_fov_inds = (pts_2d[:,0]<xmax) & (pts_2d[:,0]>=xmin) & \
+                (pts_2d[:,1]<ymax) & (pts_2d[:,1]>=ymin)
+        result.append(np.nonzero(box_fov_inds & valid)[0])
+    return result
+
+class ImageGridIndexTest(unittest.TestCase):
+    def check(self, pts_2d, valid, boxes, cell_size=16):
+        index = utils.ImageGridIndex(pts_2d, valid, cell_size)
+        result = index.query(boxes)
+        expected = box_masks(pts_2d, valid, boxes)
+        self.assertEqual(len(result), len(expected))
+        for inds, expected_inds in zip(result, expected):
+            np.testing.assert_array_equal(inds, expected_inds)
+
+    def random_boxes(self, rng, num_box):
+        corner = rng.rand(num_box,2)*[1400,450]-[60,30]
+        # negative sizes give empty boxes
+        size = rng.rand(num_box,2)*300-20
+        return np.hstack([corner, corner+size])
+
+    def test_random(self):
+        rng = np.random.RandomState(0)
+        for _ in range(30):
+            num_point = rng.randint(1,5000)
+            pts_2d = rng.rand(num_point,2)*[1300,400]-[30,10]
+            pts_2d[rng.rand(num_point)<0.01] = np.nan
+            valid = rng.rand(num_point)<0.8
+            self.check(pts_2d, valid, self.random_boxes(rng, rng.randint(1,40)),
+                cell_size=rng.choice([4,16,50]))
+
+    def test_box_borders(self):
+        # points on the cell and box borders: xmin/ymin inclusive, xmax/ymax exclusive
+        u, v = np.meshgrid(np.arange(0,100,8.0), np.arange(0,100,8.0))
+        pts_2d = np.stack([u.ravel(), v.ravel()], axis=1)
+        valid = np.ones(len(pts_2d), dtype=bool)
+        boxes = np.array([[16,16,48,48], [0,0,8,8], [-10,-10,200,200], [40,40,40,90]])
+        self.check(pts_2d, valid, boxes)
+
+    def test_no_boxes(self):
+        pts_2d = np.random.RandomState(1).rand(100,2)*100
+        index = utils.ImageGridIndex(pts_2d, np.ones(100, dtype=bool))
+        self.assertEqual(index.query(np.zeros((0,4))), [])
+
+    def test_no_points(self):
+        rng = np.random.RandomState(2)
+        boxes = self.random_boxes(rng, 5)
+        self.check(np.zeros((0,2)), np.zeros(0, dtype=bool), boxes)
+        self.check(rng.rand(50,2)*100, np.zeros(50, dtype=bool), boxes)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import tensorflow as tf
 import numpy as np
-from tf_grouping import query_ball_point, group_point
+from tf_grouping import query_ball_point, group_point, knn_point
 
 class GroupPointTest(tf.test.TestCase):
   def test(self):
@@ -24,5 +24,17 @@ class GroupPointTest(tf.test.TestCase):
       print err
       self.assertLess(err, 1e-4) 
 
+  def test_knn_point(self):
+    xyz1_np = np.random.random((2,1024,3)).astype('float32')
+    xyz2_np = np.random.random((2,128,3)).astype('float32')
+    d = np.sum((xyz2_np[:,:,None,:]-xyz1_np[:,None,:,:])**2, axis=-1)
+    expected_idx = np.argsort(d, axis=-1, kind='mergesort')[:,:,0:16]
+    for device in ['/cpu:0', '/gpu:0']:
+      with tf.device(device):
+        val, idx = knn_point(16, tf.constant(xyz1_np), tf.constant(xyz2_np))
+      with self.test_session():
+        self.assertAllEqual(idx.eval(), expected_idx)
+        self.assertAllClose(val.eval(), np.sort(d, axis=-1)[:,:,0:16])
+
 if __name__=='__main__':
   tf.test.main() 
@@ -13,7 +13,7 @@ sys.path.append(os.path.join(BASE_DIR, 'tf_ops/grouping'))
 sys.path.append(os.path.join(BASE_DIR, 'tf_ops/3d_interpolation'))
 from tf_sampling import farthest_point_sample, gather_point
 from tf_grouping import query_ball_point, group_point, knn_point
-from tf_interpolate import three_nn, three_interpolate
+from tf_interpolate import three_nn, three_interpolate, three_nn_interpolate
 import tensorflow as tf
 import numpy as np
 import tf_util
@@ -294,12 +294,8 @@ def pointnet_fp_module(xyz1, xyz2, points1, points2, mlp, is_training, bn_decay,
             new_points: (batch_size, ndataset1, mlp[-1]) TF tensor
     '''
     with tf.variable_scope(scope) as sc:
-        dist, idx = three_nn(xyz1, xyz2)
-        dist = tf.maximum(dist, 1e-10)
-        norm = tf.reduce_sum((1.0/dist),axis=2,keep_dims=True)
-        norm = tf.tile(norm,[1,1,3])
-        weight = (1.0/dist) / norm
-        interpolated_points = three_interpolate(points2, idx, weight)
+        # three_nn, the inverse square distance weights and three_interpolate in one op
+        interpolated_points, _, _ = three_nn_interpolate(xyz1, xyz2, points2)
 
         if points1 is not None:
             new_points1 = tf.concat(axis=2, values=[interpolated_points, points1]) # B,ndataset1,nchannel1+nchannel2
@@ -3,6 +3,8 @@
 #include <cstring> // memset
 #include <cstdlib> // rand, RAND_MAX
 #include <cmath> // sqrtf
+#include <vector>
+#include <algorithm> // min, max
 #include "tensorflow/core/framework/op.h"
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/shape_inference.h"
@@ -19,6 +21,25 @@ REGISTER_OP("ThreeNN")
         c->set_output(1, c->input(0));
         return Status::OK();
     });
+REGISTER_OP("ThreeNNInterpolate")
+    .Input("xyz1: float32")
+    .Input("xyz2: float32")
+    .Input("points: float32")
+    .Output("out: float32")
+    .Output("idx: int32")
+    .Output("weight: float32")
+    .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+        ::tensorflow::shape_inference::ShapeHandle dims1; // (b,n,3)
+        c->WithRank(c->input(0), 3, &dims1);
+        ::tensorflow::shape_inference::ShapeHandle dims2; // (b,m,c)
+        c->WithRank(c->input(2), 3, &dims2);
+        // (b,n,c)
+        ::tensorflow::shape_inference::ShapeHandle output = c->MakeShape({c->Dim(dims1, 0), c->Dim(dims1, 1), c->Dim(dims2, 2)});
+        c->set_output(0, output);
+        c->set_output(1, c->input(0));
+        c->set_output(2, c->input(0));
+        return Status::OK();
+    });
 REGISTER_OP("ThreeInterpolate")
     .Input("points: float32")
     .Input("idx: int32")
@@ -57,7 +78,7 @@ static double get_time(){
 // Find three nearest neigbors with square distance
 // input: xyz1 (b,n,3), xyz2(b,m,3)
 // output: dist (b,n,3), idx (b,n,3)
-void threenn_cpu(int b, int n, int m, const float *xyz1, const float *xyz2, float *dist, int *idx) {
+void threenn_brute_cpu(int b, int n, int m, const float *xyz1, const float *xyz2, float *dist, int *idx) {
      for (int i=0;i<b;++i) {
         for (int j=0;j<n;++j) {
 	    float x1=xyz1[j*3+0];
@@ -102,6 +123,208 @@ void threenn_cpu(int b, int n, int m, const float *xyz1, const float *xyz2, floa
     }
 } 
 
+// Below GRID_MIN_POINTS known points the brute force search is faster than
+// building a grid.
+const int GRID_MIN_POINTS = 256;
+// Average number of known points per grid cell
+const double GRID_POINTS_PER_CELL = 2.0;
+const int GRID_MAX_DIM = 1024;
+
+// Uniform grid over the known points of one batch element: order holds the
+// point indices sorted by cell, the points of cell c are
+// order[cell_start[c]] to order[cell_start[c+1]-1].
+struct PointGrid {
+    float lo[3];
+    float cell;
+    int dims[3];
+    std::vector<int> cell_start;
+    std::vector<int> order;
+
+    // Cell coordinate along an axis, points outside the grid (and NaNs) are
+    // clamped into the border cells.
+    int coord(float v, int axis) const {
+        float f = floorf((v - lo[axis]) / cell);
+        if (!(f >= 0)) return 0;
+        if (f >= dims[axis]) return dims[axis] - 1;
+        return (int)f;
+    }
+    int index(int cx, int cy, int cz) const {
+        return (cx * dims[1] + cy) * dims[2] + cz;
+    }
+};
+
+// Bucket the m known points into a grid of about GRID_POINTS_PER_CELL points
+// per cell. Return false for non finite coordinates.
+bool build_grid(int m, const float *xyz2, PointGrid &grid) {
+    float hi[3];
+    for (int a=0;a<3;++a) {
+        grid.lo[a] = hi[a] = xyz2[a];
+    }
+    for (int k=1;k<m;++k) {
+        for (int a=0;a<3;++a) {
+            grid.lo[a] = std::min(grid.lo[a], xyz2[k*3+a]);
+            hi[a] = std::max(hi[a], xyz2[k*3+a]);
+        }
+    }
+    float extent[3];
+    float max_extent = 0;
+    for (int a=0;a<3;++a) {
+        extent[a] = hi[a] - grid.lo[a];
+        if (!std::isfinite(extent[a])) return false;
+        max_extent = std::max(max_extent, extent[a]);
+    }
+    // Flat axes count as 1% of the largest one, so planar clouds (e.g. the
+    // ground in a frustum) do not end up with a single point per cell.
+    double volume = 1;
+    for (int a=0;a<3;++a) {
+        volume *= std::max(extent[a], std::max(0.01f*max_extent, 1e-6f));
+    }
+    grid.cell = (float)cbrt(volume * GRID_POINTS_PER_CELL / m);
+
+    // Counting sort of the points by cell. Points on a surface only fill a
+    // few of the cells, so when the occupied cells hold too few points the
+    // cells are enlarged once to match the surface.
+    std::vector<int> point_cell(m);
+    for (int pass=0;;++pass) {
+        int num_cells = 1;
+        for (int a=0;a<3;++a) {
+            grid.dims[a] = std::min(std::max((int)ceilf(extent[a] / grid.cell), 1), GRID_MAX_DIM);
+            num_cells *= grid.dims[a];
+        }
+        grid.cell_start.assign(num_cells+1, 0);
+        int occupied = 0;
+        for (int k=0;k<m;++k) {
+            point_cell[k] = grid.index(grid.coord(xyz2[k*3+0],0), grid.coord(xyz2[k*3+1],1),
+                                       grid.coord(xyz2[k*3+2],2));
+            if (grid.cell_start[point_cell[k]+1]++ == 0) ++occupied;
+        }
+        double occupied_points = (double)m / occupied;
+        if (pass > 0 || occupied_points >= 0.5 * GRID_POINTS_PER_CELL) break;
+        // points per occupied cell grow with the square of the cell size
+        grid.cell *= (float)sqrt(GRID_POINTS_PER_CELL / occupied_points);
+    }
+    for (size_t c=0;c+1<grid.cell_start.size();++c) {
+        grid.cell_start[c+1] += grid.cell_start[c];
+    }
+    std::vector<int> next(grid.cell_start.begin(), grid.cell_start.end()-1);
+    grid.order.resize(m);
+    for (int k=0;k<m;++k) {
+        grid.order[next[point_cell[k]]++] = k;
+    }
+    return true;
+}
+
+// Insert the known point k at square distance d into the three nearest
+// neighbors, kept ordered by distance and then by index. This does not
+// depend on the order the points are visited in and gives the result of the
+// brute force search, which keeps the first of equally distant points.
+inline void insert_nearest(double d, int k, double *best, int *besti) {
+    if (!(d < best[2] || (d == best[2] && k < besti[2]))) return;
+    int slot = 2;
+    while (slot > 0 && (d < best[slot-1] || (d == best[slot-1] && k < besti[slot-1]))) {
+        best[slot] = best[slot-1];
+        besti[slot] = besti[slot-1];
+        --slot;
+    }
+    best[slot] = d;
+    besti[slot] = k;
+}
+
+inline void visit_cell(const PointGrid &grid, int cell, const float *xyz2,
+                       float x1, float y1, float z1, double *best, int *besti) {
+    for (int p=grid.cell_start[cell];p<grid.cell_start[cell+1];++p) {
+        int k = grid.order[p];
+        float x2=xyz2[k*3+0];
+        float y2=xyz2[k*3+1];
+        float z2=xyz2[k*3+2];
+        // the expression of the brute force search, for the same distances
+        double d=(x2-x1)*(x2-x1)+(y2-y1)*(y2-y1)+(z2-z1)*(z2-z1);
+        insert_nearest(d, k, best, besti);
+    }
+}
+
+// Three nearest neighbors of a point from the grid: visit the cells in
+// shells of growing radius around its cell until the third neighbor is
+// closer than any cell outside the shells.
+void grid_three_nn(const PointGrid &grid, const float *xyz2, float x1, float y1, float z1,
+                   double *best, int *besti) {
+    const float q[3] = {x1, y1, z1};
+    int c[3];
+    for (int a=0;a<3;++a) {
+        c[a] = grid.coord(q[a], a);
+    }
+    // keeps the rounding of the cell bounds from pruning a neighbor
+    const double margin = 1e-4 * grid.cell;
+    for (int r=0;;++r) {
+        int lo_c[3], hi_c[3];
+        for (int a=0;a<3;++a) {
+            lo_c[a] = std::max(c[a]-r, 0);
+            hi_c[a] = std::min(c[a]+r, grid.dims[a]-1);
+        }
+        for (int i=lo_c[0];i<=hi_c[0];++i) {
+            for (int j=lo_c[1];j<=hi_c[1];++j) {
+                if (abs(i-c[0])==r || abs(j-c[1])==r) {
+                    for (int k=lo_c[2];k<=hi_c[2];++k) {
+                        visit_cell(grid, grid.index(i,j,k), xyz2, x1, y1, z1, best, besti);
+                    }
+                } else {
+                    // only the two faces of the shell along z
+                    if (c[2]-r >= 0)
+                        visit_cell(grid, grid.index(i,j,c[2]-r), xyz2, x1, y1, z1, best, besti);
+                    if (c[2]+r < grid.dims[2])
+                        visit_cell(grid, grid.index(i,j,c[2]+r), xyz2, x1, y1, z1, best, besti);
+                }
+            }
+        }
+        // Distance from the point to the cells outside the shells
+        bool covered = true;
+        double bound = 1e40;
+        for (int a=0;a<3;++a) {
+            if (c[a]-r > 0) {
+                covered = false;
+                bound = std::min(bound, (double)q[a] - (grid.lo[a] + (c[a]-r)*(double)grid.cell) - margin);
+            }
+            if (c[a]+r < grid.dims[a]-1) {
+                covered = false;
+                bound = std::min(bound, grid.lo[a] + (c[a]+r+1)*(double)grid.cell - q[a] - margin);
+            }
+        }
+        if (covered || (bound > 0 && best[2] < bound*bound)) return;
+    }
+}
+
+// Find three nearest neigbors with square distance, through a uniform grid
+// over the known points when there are enough of them. The result is the
+// one of the brute force search.
+// input: xyz1 (b,n,3), xyz2(b,m,3)
+// output: dist (b,n,3), idx (b,n,3)
+void threenn_cpu(int b, int n, int m, const float *xyz1, const float *xyz2, float *dist, int *idx) {
+    if (m < GRID_MIN_POINTS) {
+        threenn_brute_cpu(b,n,m,xyz1,xyz2,dist,idx);
+        return;
+    }
+    PointGrid grid;
+    for (int i=0;i<b;++i) {
+        if (!build_grid(m, xyz2, grid)) {
+            threenn_brute_cpu(1,n,m,xyz1,xyz2,dist,idx);
+        } else {
+            for (int j=0;j<n;++j) {
+                double best[3] = {1e40, 1e40, 1e40};
+                int besti[3] = {0, 0, 0};
+                grid_three_nn(grid, xyz2, xyz1[j*3+0], xyz1[j*3+1], xyz1[j*3+2], best, besti);
+                for (int t=0;t<3;++t) {
+                    dist[j*3+t]=best[t];
+                    idx[j*3+t]=besti[t];
+                }
+            }
+        }
+        xyz1+=n*3;
+        xyz2+=m*3;
+        dist+=n*3;
+        idx+=n*3;
+    }
+}
+
 // input: points (b,m,c), idx (b,n,3), weight (b,n,3)
 // output: out (b,n,c)
 void threeinterpolate_cpu(int b, int m, int c, int n, const float *points, const int *idx, const float *weight, float *out) {
@@ -154,6 +377,28 @@ void threeinterpolate_grad_cpu(int b, int n, int c, int m, const float *grad_out
 
 
 
+// Three nearest neighbors and the interpolation with their inverse square
+// distance weights in one op, the weights of pointnet_fp_module:
+// weight = (1/max(dist,1e-10)) / sum(1/max(dist,1e-10))
+// input: xyz1 (b,n,3), xyz2 (b,m,3), points (b,m,c)
+// output: out (b,n,c), idx (b,n,3), weight (b,n,3)
+void threenn_interpolate_cpu(int b, int n, int m, int c, const float *xyz1, const float *xyz2, const float *points, float *out, int *idx, float *weight) {
+    // the distances go to the weight buffer and are turned into weights
+    threenn_cpu(b,n,m,xyz1,xyz2,weight,idx);
+    for (int j=0;j<b*n;++j) {
+        float w1=1.0f/std::max(weight[j*3],1e-10f);
+        float w2=1.0f/std::max(weight[j*3+1],1e-10f);
+        float w3=1.0f/std::max(weight[j*3+2],1e-10f);
+        float norm=w1+w2+w3;
+        weight[j*3]=w1/norm;
+        weight[j*3+1]=w2/norm;
+        weight[j*3+2]=w3/norm;
+    }
+    threeinterpolate_cpu(b,m,c,n,points,idx,weight,out);
+}
+
+
+
 class ThreeNNOp : public OpKernel {
     public:
         explicit ThreeNNOp(OpKernelConstruction* context) : OpKernel(context) {}
@@ -188,6 +433,50 @@ REGISTER_KERNEL_BUILDER(Name("ThreeNN").Device(DEVICE_CPU), ThreeNNOp);
 
 
 
+class ThreeNNInterpolateOp : public OpKernel {
+    public:
+        explicit ThreeNNInterpolateOp(OpKernelConstruction* context) : OpKernel(context) {}
+
+        void Compute(OpKernelContext* context) override {
+            const Tensor& xyz1_tensor = context->input(0);
+            OP_REQUIRES(context, xyz1_tensor.dims()==3 && xyz1_tensor.shape().dim_size(2)==3, errors::InvalidArgument("ThreeNNInterpolate expects (b,n,3) xyz1 shape."));
+            int b = xyz1_tensor.shape().dim_size(0);
+            int n = xyz1_tensor.shape().dim_size(1);
+
+            const Tensor& xyz2_tensor = context->input(1);
+            OP_REQUIRES(context, xyz2_tensor.dims()==3 && xyz2_tensor.shape().dim_size(0)==b && xyz2_tensor.shape().dim_size(2)==3, errors::InvalidArgument("ThreeNNInterpolate expects (b,m,3) xyz2 shape."));
+            int m = xyz2_tensor.shape().dim_size(1);
+
+            const Tensor& points_tensor = context->input(2);
+            OP_REQUIRES(context, points_tensor.dims()==3 && points_tensor.shape().dim_size(0)==b && points_tensor.shape().dim_size(1)==m, errors::InvalidArgument("ThreeNNInterpolate expects (b,m,c) points shape."));
+            int c = points_tensor.shape().dim_size(2);
+
+            Tensor *out_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(0, TensorShape{b,n,c}, &out_tensor));
+            Tensor *idx_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(1, TensorShape{b,n,3}, &idx_tensor));
+            Tensor *weight_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(2, TensorShape{b,n,3}, &weight_tensor));
+
+            auto xyz1_flat = xyz1_tensor.flat<float>();
+            const float *xyz1 = &(xyz1_flat(0));
+            auto xyz2_flat = xyz2_tensor.flat<float>();
+            const float *xyz2 = &(xyz2_flat(0));
+            auto points_flat = points_tensor.flat<float>();
+            const float *points = &(points_flat(0));
+            auto out_flat = out_tensor->flat<float>();
+            float *out = &(out_flat(0));
+            auto idx_flat = idx_tensor->flat<int>();
+            int *idx = &(idx_flat(0));
+            auto weight_flat = weight_tensor->flat<float>();
+            float *weight = &(weight_flat(0));
+            threenn_interpolate_cpu(b,n,m,c,xyz1,xyz2,points,out,idx,weight);
+        }
+};
+REGISTER_KERNEL_BUILDER(Name("ThreeNNInterpolate").Device(DEVICE_CPU), ThreeNNInterpolateOp);
+
+
+
 class ThreeInterpolateOp: public OpKernel{
     public:
         explicit ThreeInterpolateOp(OpKernelConstruction * context):OpKernel(context){}
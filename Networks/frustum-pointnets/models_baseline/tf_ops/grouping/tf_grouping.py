@@ -54,23 +54,13 @@ def knn_point(k, xyz1, xyz2):
     Output:
         val: (batch_size, npoint, k) float32 array, L2 distances
         idx: (batch_size, npoint, k) int32 array, indices to input points
+    The KnnPoint op (CPU and GPU) streams the input points and keeps the k
+    nearest of every query point sorted, nearest first and the lower index
+    first among equal distances, so no (batch_size, npoint, ndataset)
+    distance matrix is built. The distances are squared, as before.
     '''
-    b = xyz1.get_shape()[0].value
-    n = xyz1.get_shape()[1].value
-    c = xyz1.get_shape()[2].value
-    m = xyz2.get_shape()[1].value
-    print b, n, c, m
-    print xyz1, (b,1,n,c)
-    xyz1 = tf.tile(tf.reshape(xyz1, (b,1,n,c)), [1,m,1,1])
-    xyz2 = tf.tile(tf.reshape(xyz2, (b,m,1,c)), [1,1,n,1])
-    dist = tf.reduce_sum((xyz1-xyz2)**2, -1)
-    print dist, k
-    outi, out = select_top_k(k, dist)
-    idx = tf.slice(outi, [0,0,0], [-1,-1,k])
-    val = tf.slice(out, [0,0,0], [-1,-1,k])
-    print idx, val
-    #val, idx = tf.nn.top_k(-dist, k=k) # ONLY SUPPORT CPU
-    return val, idx
+    return grouping_module.knn_point(xyz1, xyz2, k)
+ops.NoGradient('KnnPoint')
 
 if __name__=='__main__':
     knn=True
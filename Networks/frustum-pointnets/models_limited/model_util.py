@@ -42,26 +42,42 @@ def tf_gather_object_pc(point_cloud, mask, npoints=512):
     Output:
         object_pc: TF tensor in shape (B,npoint,C)
         indices: TF int tensor in shape (B,npoint,2)
+
+    Sampling is done in the graph, on the device of the model: if more than
+    npoints points are picked, npoints of them are chosen without
+    replacement, otherwise all of them are kept and the rest is resampled
+    with replacement; the result is shuffled. Samples without any picked
+    point gather point 0.
     '''
-    def mask_to_indices(mask):
-        indices = np.zeros((mask.shape[0], npoints, 2), dtype=np.int32)
-        for i in range(mask.shape[0]):
-            pos_indices = np.where(mask[i,:]>0.5)[0]
-            # skip cases when pos_indices is empty
-            if len(pos_indices) > 0: 
-                if len(pos_indices) > npoints:
-                    choice = np.random.choice(len(pos_indices),
-                        npoints, replace=False)
-                else:
-                    choice = np.random.choice(len(pos_indices),
-                        npoints-len(pos_indices), replace=True)
-                    choice = np.concatenate((np.arange(len(pos_indices)), choice))
-                np.random.shuffle(choice)
-                indices[i,:,1] = pos_indices[choice]
-            indices[i,:,0] = i
-        return indices
-
-    indices = tf.py_func(mask_to_indices, [mask], tf.int32)  
+    batch_size = tf.shape(mask)[0]
+    num_point = mask.get_shape()[1].value
+    if num_point is None:
+        num_point = tf.shape(mask)[1]
+        k = tf.minimum(num_point, npoints)
+    else:
+        k = min(num_point, npoints)
+    picked = tf.to_float(mask > 0.5)
+    count = tf.to_int32(tf.reduce_sum(picked, axis=1, keep_dims=True)) # Bx1
+    batch_idx = tf.tile(tf.expand_dims(tf.range(batch_size), 1), [1, npoints]) # Bxnpoints
+
+    # Picked points get keys in [1,2) and the others in [0,1), so the top k
+    # keys are a random permutation of the picked points (up to k of them)
+    keys = picked + tf.random_uniform(tf.shape(mask))
+    _, ranked = tf.nn.top_k(keys, k=k, sorted=True) # Bxk
+
+    # Slot j keeps the j-th picked point while j < count, then resamples one
+    slots = tf.tile(tf.expand_dims(tf.range(npoints), 0), [batch_size, 1])
+    resampled = tf.to_int32(tf.random_uniform([batch_size, npoints]) * \
+        tf.to_float(tf.maximum(count, 1)))
+    resampled = tf.minimum(resampled, tf.maximum(count, 1) - 1)
+    choice = tf.where(slots < count, slots, resampled)
+    # Shuffle the slots so the resampled points are not all at the end
+    _, perm = tf.nn.top_k(tf.random_uniform([batch_size, npoints]), k=npoints)
+    choice = tf.gather_nd(choice, tf.stack([batch_idx, perm], axis=2))
+    point_idx = tf.gather_nd(ranked, tf.stack([batch_idx, choice], axis=2))
+    point_idx = point_idx * tf.to_int32(count > 0)
+
+    indices = tf.stack([batch_idx, point_idx], axis=2)
     object_pc = tf.gather_nd(point_cloud, indices)
     return object_pc, indices
 
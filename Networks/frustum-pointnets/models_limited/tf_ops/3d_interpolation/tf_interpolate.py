@@ -16,6 +16,26 @@ def three_nn(xyz1, xyz2):
     '''
     return interpolate_module.three_nn(xyz1, xyz2)
 ops.NoGradient('ThreeNN')
+def three_nn_interpolate(xyz1, xyz2, points):
+    '''
+    three_nn and three_interpolate in one op, with the inverse square distance
+    weights of pointnet_fp_module
+    Input:
+        xyz1: (b,n,3) float32 array, unknown points
+        xyz2: (b,m,3) float32 array, known points
+        points: (b,m,c) float32 array, features of the known points
+    Output:
+        out: (b,n,c) float32 array, interpolated point values
+        idx: (b,n,3) int32 array, indices to known points
+        weight: (b,n,3) float32 array, weights on known points
+    '''
+    return interpolate_module.three_nn_interpolate(xyz1, xyz2, points)
+@tf.RegisterGradient('ThreeNNInterpolate')
+def _three_nn_interpolate_grad(op, grad_out, grad_idx, grad_weight):
+    points = op.inputs[2]
+    idx = op.outputs[1]
+    weight = op.outputs[2]
+    return [None, None, interpolate_module.three_interpolate_grad(points, idx, weight, grad_out)]
 def three_interpolate(points, idx, weight):
     '''
     Input:
@@ -38,6 +38,22 @@ REGISTER_OP("SelectionSort")
         c->set_output(1, c->input(0));
         return Status::OK();
     });
+REGISTER_OP("KnnPoint")
+    .Attr("k: int")
+    .Input("xyz1: float32")
+    .Input("xyz2: float32")
+    .Output("dist: float32")
+    .Output("idx: int32")
+    .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+        ::tensorflow::shape_inference::ShapeHandle dims2; // batch_size * npoint * c
+        c->WithRank(c->input(1), 3, &dims2);
+        int k;
+        TF_RETURN_IF_ERROR(c->GetAttr("k", &k));
+        ::tensorflow::shape_inference::ShapeHandle output = c->MakeShape({c->Dim(dims2, 0), c->Dim(dims2, 1), k});
+        c->set_output(0, output);
+        c->set_output(1, output);
+        return Status::OK();
+    });
 REGISTER_OP("GroupPoint")
     .Input("points: float32")
     .Input("idx: int32")
@@ -139,6 +155,95 @@ class SelectionSortGpuOp : public OpKernel {
 REGISTER_KERNEL_BUILDER(Name("SelectionSort").Device(DEVICE_GPU), SelectionSortGpuOp);
 
 
+// input: k (1), xyz1 (b,n,c), xyz2 (b,m,c)
+// output: dist (b,m,k), idx (b,m,k)
+// k nearest neighbors by square distance without a distance matrix, the
+// CPU counterpart of knn_point_gpu: the k best of every query point are kept
+// sorted in the outputs while xyz1 is streamed in index order.
+void knn_point_cpu(int b, int n, int m, int c, int k, const float *xyz1, const float *xyz2, float *dist, int *idx) {
+    for (int i=0;i<b;++i) {
+        for (int j=0;j<m;++j) {
+            const float *q = xyz2+j*c;
+            float *best = dist+j*k;
+            int *besti = idx+j*k;
+            for (int t=0;t<k;++t) {
+                best[t] = INFINITY;
+                besti[t] = 0;
+            }
+            for (int s=0;s<n;++s) {
+                const float *p = xyz1+s*c;
+                float d=0;
+                for (int l=0;l<c;++l) {
+                    float diff = p[l]-q[l];
+                    d += diff*diff;
+                }
+                if (d<best[k-1]) {
+                    int t=k-1;
+                    while (t>0 && best[t-1]>d) {
+                        best[t] = best[t-1];
+                        besti[t] = besti[t-1];
+                        --t;
+                    }
+                    best[t] = d;
+                    besti[t] = s;
+                }
+            }
+        }
+        xyz1+=n*c;
+        xyz2+=m*c;
+        dist+=m*k;
+        idx+=m*k;
+    }
+}
+
+void knnPointLauncher(int b, int n, int m, int c, int k, const float *xyz1, const float *xyz2, float *dist, int *idx);
+template <bool gpu>
+class KnnPointOp : public OpKernel {
+    public:
+        explicit KnnPointOp(OpKernelConstruction* context) : OpKernel(context) {
+            OP_REQUIRES_OK(context, context->GetAttr("k", &k_));
+            OP_REQUIRES(context, k_ > 0, errors::InvalidArgument("KnnPoint expects positive k"));
+        }
+
+        void Compute(OpKernelContext* context) override {
+            const Tensor& xyz1_tensor = context->input(0);
+            OP_REQUIRES(context, xyz1_tensor.dims()==3, errors::InvalidArgument("KnnPoint expects (batch_size, ndataset, c) xyz1 shape."));
+            int b = xyz1_tensor.shape().dim_size(0);
+            int n = xyz1_tensor.shape().dim_size(1);
+            int c = xyz1_tensor.shape().dim_size(2);
+            OP_REQUIRES(context, k_ <= n, errors::InvalidArgument("KnnPoint expects k <= ndataset"));
+
+            const Tensor& xyz2_tensor = context->input(1);
+            OP_REQUIRES(context, xyz2_tensor.dims()==3 && xyz2_tensor.shape().dim_size(0)==b && xyz2_tensor.shape().dim_size(2)==c, errors::InvalidArgument("KnnPoint expects (batch_size, npoint, c) xyz2 shape."));
+            int m = xyz2_tensor.shape().dim_size(1);
+
+            Tensor *dist_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(0, TensorShape{b,m,k_}, &dist_tensor));
+            Tensor *idx_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(1, TensorShape{b,m,k_}, &idx_tensor));
+            if (b*m == 0)
+                return;
+
+            auto xyz1_flat = xyz1_tensor.flat<float>();
+            const float *xyz1 = &(xyz1_flat(0));
+            auto xyz2_flat = xyz2_tensor.flat<float>();
+            const float *xyz2 = &(xyz2_flat(0));
+            auto dist_flat = dist_tensor->flat<float>();
+            float *dist = &(dist_flat(0));
+            auto idx_flat = idx_tensor->flat<int>();
+            int *idx = &(idx_flat(0));
+            if (gpu)
+                knnPointLauncher(b,n,m,c,k_,xyz1,xyz2,dist,idx);
+            else
+                knn_point_cpu(b,n,m,c,k_,xyz1,xyz2,dist,idx);
+        }
+    private:
+        int k_;
+};
+REGISTER_KERNEL_BUILDER(Name("KnnPoint").Device(DEVICE_CPU), KnnPointOp<false>);
+REGISTER_KERNEL_BUILDER(Name("KnnPoint").Device(DEVICE_GPU), KnnPointOp<true>);
+
+
 void groupPointLauncher(int b, int n, int c, int m, int nsample, const float *points, const int *idx, float *out);
 class GroupPointGpuOp: public OpKernel{
     public:
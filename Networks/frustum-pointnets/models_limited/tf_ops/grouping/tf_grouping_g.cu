@@ -122,6 +122,58 @@ __global__ void selection_sort_gpu(int b, int n, int m, int k, const float *dist
     }
 }
 
+// input: k (1), xyz1 (b,n,c), xyz2 (b,m,c)
+// output: dist (b,m,k), idx (b,m,k)
+// k nearest neighbors by square distance without a distance matrix: one
+// thread per query point keeps its k best sorted in the outputs, while the
+// block streams xyz1 through shared memory a tile at a time. Points come in
+// index order and only replace a strictly farther one, so equally distant
+// points keep the lower index first.
+__global__ void knn_point_gpu(int b, int n, int m, int c, int k, int tile, const float *xyz1, const float *xyz2, float *dist, int *idx) {
+    extern __shared__ float tile_xyz1[];
+    int batch_index = blockIdx.x;
+    xyz1 += n*c*batch_index;
+    xyz2 += m*c*batch_index;
+    dist += m*k*batch_index;
+    idx += m*k*batch_index;
+
+    int j = blockIdx.y*blockDim.x + threadIdx.x;
+    float worst = INFINITY;
+    if (j<m) {
+        for (int t=0;t<k;++t) {
+            dist[j*k+t] = INFINITY;
+            idx[j*k+t] = 0;
+        }
+    }
+    for (int start=0;start<n;start+=tile) {
+        int count = min(tile, n-start);
+        __syncthreads();
+        for (int l=threadIdx.x;l<count*c;l+=blockDim.x)
+            tile_xyz1[l] = xyz1[start*c+l];
+        __syncthreads();
+        if (j>=m)
+            continue;
+        for (int s=0;s<count;++s) {
+            float d=0;
+            for (int l=0;l<c;++l) {
+                float diff = tile_xyz1[s*c+l]-xyz2[j*c+l];
+                d += diff*diff;
+            }
+            if (d<worst) {
+                int t=k-1;
+                while (t>0 && dist[j*k+t-1]>d) {
+                    dist[j*k+t] = dist[j*k+t-1];
+                    idx[j*k+t] = idx[j*k+t-1];
+                    --t;
+                }
+                dist[j*k+t] = d;
+                idx[j*k+t] = start+s;
+                worst = dist[j*k+k-1];
+            }
+        }
+    }
+}
+
 void queryBallPointLauncher(int b, int n, int m, float radius, int nsample, const float *xyz1, const float *xyz2, int *idx, int *pts_cnt) {
     query_ball_point_gpu<<<b,256>>>(b,n,m,radius,nsample,xyz1,xyz2,idx,pts_cnt);
     //cudaDeviceSynchronize();
@@ -130,6 +182,12 @@ void selectionSortLauncher(int b, int n, int m, int k, const float *dist, int *o
     selection_sort_gpu<<<b,256>>>(b,n,m,k,dist,outi,out); 
     //cudaDeviceSynchronize();
 }
+void knnPointLauncher(int b, int n, int m, int c, int k, const float *xyz1, const float *xyz2, float *dist, int *idx) {
+    // at most 48KB of shared memory per block
+    int tile = max(1, min(1024, 12288/c));
+    knn_point_gpu<<<dim3(b,(m+255)/256),256,tile*c*sizeof(float)>>>(b,n,m,c,k,tile,xyz1,xyz2,dist,idx);
+    //cudaDeviceSynchronize();
+}
 void groupPointLauncher(int b, int n, int c, int m, int nsample, const float *points, const int *idx, float *out){
     group_point_gpu<<<b,256>>>(b,n,c,m,nsample,points,idx,out);
     //cudaDeviceSynchronize();
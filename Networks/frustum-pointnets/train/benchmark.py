@@ -0,0 +1,116 @@
+''' Benchmark Frustum PointNets latency and throughput on synthetic frustums.
+
+No KITTI data is needed. Weights are randomly initialized unless
+--model_path is given.
+'''
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+import importlib
+import numpy as np
+import tensorflow as tf
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(ROOT_DIR, '../../Benchmark'))
+import bench_util
+import freeze_util
+import graph_cache
+
+# Model dir of each aggregation variant, as in test.py
+VARIANT_DIRS = {
+    'full' : 'models',
+    'limited' : 'models_limited',
+    'baseline' : 'models_baseline'
+}
+
+parser = argparse.ArgumentParser()
+bench_util.add_benchmark_args(parser, VARIANT_DIRS.keys(), batch_size=32, num_point=1024)
+parser.add_argument('--model', default='frustum_pointnets_v2', help='Model name [default: frustum_pointnets_v2]')
+graph_cache.add_cache_args(parser)
+
+NUM_CHANNEL = 4
+# End points returned by predict
+FETCHES = ['mask_logits', 'center', 'heading_scores', 'heading_residuals',
+           'size_scores', 'size_residuals']
+
+def build_predictor(variant, model_name, batch_size, num_point, model_path=None, gpu=0,
+                    cache_dir=None, precision=None, calibration=(), cpu=False):
+    ''' Build the graph of one variant, or load it from the graph cache in
+    cache_dir, and return predict(points) -> dict of mask logits and box
+    estimation outputs. The one-hot class vectors cycle through Car,
+    Pedestrian and Cyclist.
+    precision and calibration as in quant_util.py; the calibration
+    batches get the same one-hot class vectors.
+    '''
+    sys.path.append(os.path.join(ROOT_DIR, VARIANT_DIRS[variant]))
+    MODEL = importlib.import_module(model_name)
+    cache_file = graph_cache.cache_file(cache_dir, 'frustum-pointnets', variant,
+        batch_size, num_point, extra={'model': model_name},
+        sources=[os.path.join(ROOT_DIR, VARIANT_DIRS[variant]), os.path.abspath(__file__)])
+
+    def build():
+        pointclouds_pl, one_hot_vec_pl = \
+            MODEL.placeholder_inputs(batch_size, num_point)[0:2]
+        is_training_pl = tf.placeholder(tf.bool, shape=())
+        end_points = MODEL.get_model(pointclouds_pl, one_hot_vec_pl,
+            is_training_pl)
+        tensors = dict((key, end_points[key]) for key in FETCHES)
+        tensors.update({'pointclouds_pl': pointclouds_pl,
+                        'one_hot_vec_pl': one_hot_vec_pl,
+                        'is_training_pl': is_training_pl})
+        return tensors
+
+    with tf.Graph().as_default():
+        with tf.device('/gpu:'+str(gpu)):
+            ops, saver = graph_cache.cached_graph(cache_file, build)
+
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        sess = tf.Session(config=config)
+        if model_path is not None:
+            saver.restore(sess, model_path)
+            print('Model restored.')
+        else:
+            sess.run(tf.global_variables_initializer())
+
+    one_hot_vec = np.eye(3, dtype=np.float32)[np.arange(batch_size) % 3]
+    if precision is not None:
+        inputs = {'pointclouds_pl': ops['pointclouds_pl'],
+                  'one_hot_vec_pl': ops['one_hot_vec_pl']}
+        feeds = [{'pointclouds_pl': b, 'one_hot_vec_pl': one_hot_vec} for b in calibration]
+        frozen_sess, inputs, outputs, _ = freeze_util.quantized_session(sess,
+            inputs, dict((key, ops[key]) for key in FETCHES), ops['is_training_pl'],
+            precision, feeds, cpu, gpu)
+        sess.close()
+        # is_training_pl is constant False in the frozen graph
+        sess, ops = frozen_sess, dict(inputs, **outputs)
+    fetches = dict((key, ops[key]) for key in FETCHES)
+
+    def predict(points, options=None, run_metadata=None):
+        feed_dict = {ops['pointclouds_pl']: points,
+                     ops['one_hot_vec_pl']: one_hot_vec}
+        if 'is_training_pl' in ops:
+            feed_dict[ops['is_training_pl']] = False
+        return sess.run(fetches, feed_dict=feed_dict,
+            options=options, run_metadata=run_metadata)
+    return predict
+
+def predictor_from_flags(FLAGS):
+    ''' build_predictor from flags parsed by parser, as used by Serving/worker.py. '''
+    return build_predictor(FLAGS.variant, FLAGS.model, FLAGS.batch_size,
+        FLAGS.num_point, FLAGS.model_path, FLAGS.gpu, graph_cache.cache_dir(FLAGS),
+        FLAGS.precision, bench_util.calibration_batches(FLAGS, NUM_CHANNEL,
+        bench_util.synthetic_frustum_batch), FLAGS.cpu)
+
+def main():
+    FLAGS = parser.parse_args()
+    predict = predictor_from_flags(FLAGS)
+    bench_util.run_benchmark('frustum-pointnets', FLAGS, predict,
+        num_channel=NUM_CHANNEL, make_batch=bench_util.synthetic_frustum_batch)
+
+if __name__=='__main__':
+    main()
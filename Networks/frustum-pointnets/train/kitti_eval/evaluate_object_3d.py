@@ -0,0 +1,469 @@
+''' KITTI object detection evaluation in Python/NumPy.
+
+Port of evaluate_object_3d_offline.cpp: the same difficulty levels, ignore
+rules, DontCare handling, 41-point recall sampling and 11-point AP, for the
+2D image boxes, the bird's eye view boxes and the 3D boxes. It evaluates
+detections held in memory (see detections_from_arrays), so test.py and
+train.py can compute AP without writing and re-reading label files, and it
+spreads the work over processes: the box overlaps frame by frame, the
+precision curves class by class.
+
+Usage (same arguments as the compiled evaluator):
+    python evaluate_object_3d.py groundtruth_dir result_dir
+'''
+from __future__ import print_function
+
+import os
+import argparse
+import multiprocessing
+import numpy as np
+
+CLASS_NAMES = ['car', 'pedestrian', 'cyclist']
+# Neighboring classes are ignored instead of counted as false negatives
+NEIGHBOR_CLASSES = {'car': 'van', 'pedestrian': 'person_sitting'}
+METRICS = ['image', 'ground', '3d']
+DIFFICULTIES = ['easy', 'moderate', 'hard']
+
+MIN_HEIGHT = [40, 25, 25] # minimum height of evaluated groundtruth/detections
+MAX_OCCLUSION = [0, 1, 2] # maximum occlusion level of the groundtruth
+MAX_TRUNCATION = [0.15, 0.3, 0.5] # maximum truncation level of the groundtruth
+# minimum overlap per metric (image, ground, 3d) and class (car, pedestrian, cyclist)
+MIN_OVERLAP = np.array([[0.7, 0.5, 0.5], [0.7, 0.5, 0.5], [0.7, 0.5, 0.5]])
+N_SAMPLE_PTS = 41 # no. of recall steps that are evaluated
+
+# ----------------------------------------------------------------------------
+# Label loading
+# ----------------------------------------------------------------------------
+
+def make_frame(types, bbox, alpha, dims, loc, ry,
+               score=None, truncated=None, occluded=None):
+    ''' Objects of one frame as a dict of arrays.
+    types: list of N type strings, bbox: Nx4 (x1,y1,x2,y2), alpha: N,
+    dims: Nx3 (h,w,l), loc: Nx3 (x,y,z) in camera coords, ry: N.
+    Detections have a score, ground truths truncated/occluded.
+    '''
+    n = len(types)
+    frame = {'type': np.array([t.lower() for t in types], dtype=str),
+             'bbox': np.asarray(bbox, dtype=np.float64).reshape(n, 4),
+             'alpha': np.asarray(alpha, dtype=np.float64).reshape(n),
+             'dims': np.asarray(dims, dtype=np.float64).reshape(n, 3),
+             'loc': np.asarray(loc, dtype=np.float64).reshape(n, 3),
+             'ry': np.asarray(ry, dtype=np.float64).reshape(n)}
+    if score is not None:
+        frame['score'] = np.asarray(score, dtype=np.float64).reshape(n)
+    if truncated is not None:
+        frame['truncated'] = np.asarray(truncated, dtype=np.float64).reshape(n)
+        frame['occluded'] = np.asarray(occluded, dtype=np.float64).reshape(n)
+    return frame
+
+def read_label_file(filename, detection=False):
+    ''' Read a KITTI label file (ground truth) or result file (detection=True,
+    with a score as 16th field). A missing result file means no detections. '''
+    if detection and not os.path.exists(filename):
+        lines = []
+    else:
+        lines = [line.split() for line in open(filename)]
+    num_field = 16 if detection else 15
+    lines = [l for l in lines if len(l) >= num_field]
+    values = np.array([[float(x) for x in l[1:num_field]] for l in lines],
+        dtype=np.float64).reshape(-1, num_field-1)
+    return make_frame([l[0] for l in lines], values[:,3:7], values[:,2],
+        values[:,7:10], values[:,10:13], values[:,13],
+        score=values[:,14] if detection else None,
+        truncated=None if detection else values[:,0],
+        occluded=None if detection else values[:,1])
+
+def load_groundtruth(label_dir, frame_ids, num_workers=None):
+    ''' Read the label files of frame_ids, returns map from frame id to frame. '''
+    filenames = [os.path.join(label_dir, '%06d.txt' % (idx)) for idx in frame_ids]
+    frames = _map(read_label_file, filenames, num_workers)
+    return dict(zip(frame_ids, frames))
+
+def load_detections(result_dir):
+    ''' Read result_dir/data/*.txt, returns map from frame id to frame. '''
+    data_dir = os.path.join(result_dir, 'data')
+    detections = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith('.txt'): continue
+        detections[int(filename[:-4])] = \
+            read_label_file(os.path.join(data_dir, filename), detection=True)
+    return detections
+
+def detections_from_arrays(id_list, type_list, box2d_list,
+                           h, w, l, tx, ty, tz, ry, score, alpha=None):
+    ''' Group per-object predictions (e.g. the outputs of test.py, one
+    entry per frustum) by frame. Returns map from frame id to frame.
+    Without alpha the orientation similarity (AOS) is not evaluated.
+    '''
+    id_list = np.asarray(id_list)
+    box2d = np.asarray(box2d_list, dtype=np.float64).reshape(-1, 4)
+    dims = np.stack([h, w, l], 1)
+    loc = np.stack([tx, ty, tz], 1)
+    ry = np.asarray(ry)
+    score = np.asarray(score)
+    if alpha is None:
+        alpha = -10 * np.ones(len(id_list))
+    alpha = np.asarray(alpha)
+    detections = {}
+    order = np.argsort(id_list, kind='mergesort')
+    frame_ids, starts = np.unique(id_list[order], return_index=True)
+    for idx, objs in zip(frame_ids, np.split(order, starts[1:])):
+        detections[int(idx)] = make_frame([type_list[i] for i in objs],
+            box2d[objs], alpha[objs], dims[objs], loc[objs], ry[objs],
+            score=score[objs])
+    return detections
+
+def empty_frame(detection=False):
+    return make_frame([], [], [], [], [], [], score=[] if detection else None,
+        truncated=None if detection else [], occluded=None if detection else [])
+
+# ----------------------------------------------------------------------------
+# Box overlaps
+# ----------------------------------------------------------------------------
+
+def image_box_overlap(a, b, criterion=-1):
+    ''' Overlap of Nx4 boxes a and Mx4 boxes b, returns NxM.
+    criterion -1: intersection over union, 0: intersection over area of a.
+    '''
+    x1 = np.maximum(a[:,None,0], b[None,:,0])
+    y1 = np.maximum(a[:,None,1], b[None,:,1])
+    x2 = np.minimum(a[:,None,2], b[None,:,2])
+    y2 = np.minimum(a[:,None,3], b[None,:,3])
+    w = x2 - x1
+    h = y2 - y1
+    inter = np.where((w > 0) & (h > 0), w * h, 0)
+    a_area = ((a[:,2] - a[:,0]) * (a[:,3] - a[:,1]))[:,None]
+    b_area = ((b[:,2] - b[:,0]) * (b[:,3] - b[:,1]))[None,:]
+    if criterion == -1:
+        return inter / (a_area + b_area - inter)
+    return inter / a_area
+
+def ground_corners(loc, dims, ry):
+    ''' Bird's eye view corners (x,z) of N boxes, returns Nx4x2. '''
+    l = dims[:,2] / 2.0
+    w = dims[:,1] / 2.0
+    corners = np.stack([np.stack([l, l, -l, -l], 1),
+                        np.stack([w, -w, -w, w], 1)], 2) # Nx4x2
+    c = np.cos(ry)[:,None]
+    s = np.sin(ry)[:,None]
+    x = c * corners[:,:,0] + s * corners[:,:,1] + loc[:,None,0]
+    z = -s * corners[:,:,0] + c * corners[:,:,1] + loc[:,None,2]
+    return np.stack([x, z], 2)
+
+def _cross(u, v):
+    return u[...,0] * v[...,1] - u[...,1] * v[...,0]
+
+def _inside(points, rect, eps=1e-8):
+    ''' Whether points (...,K,2) are inside rectangles (...,4,2). '''
+    origin = rect[...,0:1,:]
+    ab = rect[...,1:2,:] - origin
+    ad = rect[...,3:4,:] - origin
+    ap = points - origin
+    pab = np.sum(ap * ab, -1)
+    pad = np.sum(ap * ad, -1)
+    return (pab >= -eps) & (pab <= np.sum(ab * ab, -1) + eps) & \
+        (pad >= -eps) & (pad <= np.sum(ad * ad, -1) + eps)
+
+def rect_intersection_area(a, b):
+    ''' Intersection areas of rectangles a[i] and b[i], a and b are Kx4x2.
+    The intersection polygon is made of the corners of each rectangle
+    inside the other one and of the edge crossings; its vertices are sorted
+    by angle around their mean and the area is given by the shoelace formula.
+    '''
+    k = a.shape[0]
+    if k == 0: return np.zeros(0)
+    # Edge crossings, Kx4x4
+    p = a[:,:,None,:]
+    r = (np.roll(a, -1, axis=1) - a)[:,:,None,:]
+    q = b[:,None,:,:]
+    s = (np.roll(b, -1, axis=1) - b)[:,None,:,:]
+    denom = _cross(r, s)
+    parallel = np.abs(denom) < 1e-12
+    denom = np.where(parallel, 1.0, denom)
+    t = _cross(q - p, s) / denom
+    u = _cross(q - p, r) / denom
+    crossing = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    crossing_pts = (p + t[...,None] * r).reshape(k, 16, 2)
+
+    points = np.concatenate([a, b, crossing_pts], 1) # Kx24x2
+    valid = np.concatenate([_inside(a, b), _inside(b, a),
+        crossing.reshape(k, 16)], 1)
+    count = np.sum(valid, 1)
+    center = np.sum(points * valid[...,None], 1) / np.maximum(count, 1)[:,None]
+    angle = np.arctan2(points[...,1] - center[:,None,1],
+        points[...,0] - center[:,None,0])
+    angle = np.where(valid, angle, np.inf)
+    order = np.argsort(angle, 1)
+    points = points[np.arange(k)[:,None], order]
+    # Invalid vertices (sorted last) collapse onto the first vertex
+    valid = np.arange(24)[None,:] < count[:,None]
+    points = np.where(valid[...,None], points, points[:,0:1,:])
+    area = 0.5 * np.abs(np.sum(_cross(points, np.roll(points, -1, axis=1)), 1))
+    return np.where(count >= 3, area, 0)
+
+def box_overlaps(det, gt, metric, criterion=-1):
+    ''' Overlaps of the detections and ground truth objects of a frame under
+    metric ('image', 'ground' or '3d'), returns NxM.
+    criterion -1: intersection over union, 0: intersection over detection.
+    '''
+    n, m = len(det['type']), len(gt['type'])
+    if n == 0 or m == 0:
+        return np.zeros((n, m))
+    if metric == 'image':
+        return image_box_overlap(det['bbox'], gt['bbox'], criterion)
+    dc = ground_corners(det['loc'], det['dims'], det['ry'])
+    gc = ground_corners(gt['loc'], gt['dims'], gt['ry'])
+    inter = rect_intersection_area(np.repeat(dc, m, 0),
+        np.tile(gc, (n, 1, 1))).reshape(n, m)
+    if metric == 'ground':
+        det_size = np.abs(det['dims'][:,1] * det['dims'][:,2])[:,None]
+        gt_size = np.abs(gt['dims'][:,1] * gt['dims'][:,2])[None,:]
+    else:
+        ymax = np.minimum(det['loc'][:,None,1], gt['loc'][None,:,1])
+        ymin = np.maximum(det['loc'][:,None,1] - det['dims'][:,None,0],
+            gt['loc'][None,:,1] - gt['dims'][None,:,0])
+        inter = inter * np.maximum(0, ymax - ymin)
+        det_size = np.prod(det['dims'], 1)[:,None]
+        gt_size = np.prod(gt['dims'], 1)[None,:]
+    if criterion == -1:
+        return inter / (det_size + gt_size - inter)
+    return inter / det_size
+
+def frame_overlaps(frame):
+    ''' Overlaps of a (gt, det) frame pair for all metrics: detections vs.
+    ground truth (IoU) and vs. DontCare areas (over the detection). '''
+    gt, det = frame
+    dontcare = gt['type'] == 'dontcare'
+    dc = dict((k, v[dontcare]) for k, v in gt.items())
+    overlaps = {}
+    for metric in METRICS:
+        overlaps[metric] = (box_overlaps(det, gt, metric),
+            box_overlaps(det, dc, metric, criterion=0))
+    return overlaps
+
+# ----------------------------------------------------------------------------
+# Precision/recall statistics
+# ----------------------------------------------------------------------------
+
+def clean_data(class_name, gt, det, difficulty):
+    ''' Ignore flags of a frame as in cleanData of the C++ evaluator.
+    ground truth: 0 evaluated, 1 ignored (neighboring class or too hard),
+    -1 other class. detections: 0 evaluated, 1 too small, -1 other class.
+    '''
+    height = gt['bbox'][:,3] - gt['bbox'][:,1]
+    ignore = (gt['occluded'] > MAX_OCCLUSION[difficulty]) | \
+        (gt['truncated'] > MAX_TRUNCATION[difficulty]) | \
+        (height < MIN_HEIGHT[difficulty])
+    same = gt['type'] == class_name
+    neighbor = gt['type'] == NEIGHBOR_CLASSES.get(class_name)
+    ignored_gt = -np.ones(len(same), dtype=np.int32)
+    ignored_gt[neighbor | (same & ignore)] = 1
+    ignored_gt[same & ~ignore] = 0
+
+    # heights of detections are truncated to int as in the C++ evaluator
+    height = np.fix(np.abs(det['bbox'][:,1] - det['bbox'][:,3]))
+    ignored_det = np.where(det['type'] == class_name, 0, -1).astype(np.int32)
+    ignored_det[height < MIN_HEIGHT[difficulty]] = 1
+    return ignored_gt, ignored_det
+
+def match_scores(overlap, ignored_gt, ignored_det, score, min_overlap):
+    ''' Scores of the true positives of a frame, each ground truth taking the
+    overlapping detection with the highest score (no score threshold). '''
+    assigned = np.zeros(len(score), dtype=bool)
+    tp_scores = []
+    for i in np.where(ignored_gt != -1)[0]:
+        candidate = (ignored_det != -1) & ~assigned & (overlap[:,i] > min_overlap)
+        if not np.any(candidate): continue
+        j = np.argmax(np.where(candidate, score, -np.inf))
+        assigned[j] = True
+        if ignored_gt[i] == 0 and ignored_det[j] == 0:
+            tp_scores.append(score[j])
+    return tp_scores
+
+def match_thresholds(overlap, dc_overlap, ignored_gt, ignored_det, score,
+                     min_overlap, thresholds, delta=None):
+    ''' TP, FP, FN and orientation similarity of a frame for all score
+    thresholds at once (computeStatistics with compute_fp of the C++
+    evaluator). Each ground truth takes the evaluated detection with the
+    greatest overlap, or else an overlapping detection that is too small.
+    delta: NxM alpha differences of detections and ground truth, for AOS.
+    Returns Tx4 array.
+    '''
+    stats = np.zeros((len(thresholds), 4))
+    active = (score[None,:] >= thresholds[:,None]) & (ignored_det != -1)[None,:]
+    evaluated = ignored_det == 0
+    assigned = np.zeros(active.shape, dtype=bool)
+    rows = np.arange(len(thresholds))
+    for i in np.where(ignored_gt != -1)[0]:
+        over = overlap[:,i] > min_overlap
+        candidate = active & ~assigned & over[None,:]
+        good = candidate & evaluated[None,:]
+        small = candidate & ~evaluated[None,:]
+        has_good = np.any(good, 1)
+        found = has_good | np.any(small, 1)
+        j = np.where(has_good,
+            np.argmax(np.where(good, overlap[None,:,i], -1), 1),
+            np.argmax(small, 1))
+        assigned[rows[found], j[found]] = True
+        if ignored_gt[i] == 0:
+            stats[:,2] += ~found
+            tp = found & evaluated[j]
+            stats[:,0] += tp
+            if delta is not None:
+                stats[:,3] += np.where(tp, (1.0 + np.cos(delta[j,i])) / 2.0, 0)
+    # Unassigned detections are false positives, unless in a DontCare area
+    unassigned = active & evaluated[None,:] & ~assigned
+    for k in range(dc_overlap.shape[1]):
+        unassigned &= ~(dc_overlap[None,:,k] > min_overlap)
+    stats[:,1] = np.sum(unassigned, 1)
+    return stats
+
+def get_thresholds(scores, n_gt):
+    ''' Scores giving N_SAMPLE_PTS linearly spaced recall values. '''
+    scores = np.sort(scores)[::-1]
+    thresholds = []
+    current_recall = 0.0
+    for i in range(len(scores)):
+        l_recall = (i+1) / float(n_gt)
+        r_recall = (i+2) / float(n_gt) if i < len(scores)-1 else l_recall
+        if (r_recall - current_recall) < (current_recall - l_recall) \
+                and i < len(scores)-1:
+            continue
+        thresholds.append(scores[i])
+        current_recall += 1.0 / (N_SAMPLE_PTS - 1.0)
+    return np.array(thresholds)
+
+_FRAMES = None
+_OVERLAPS = None
+
+def _init_worker(frames, overlaps):
+    global _FRAMES, _OVERLAPS
+    _FRAMES = frames
+    _OVERLAPS = overlaps
+
+def eval_class(task):
+    ''' Precision (and AOS) curves of one class under one metric for the
+    three difficulties, over the frames given to _init_worker. '''
+    class_name, metric, compute_aos = task
+    class_idx = CLASS_NAMES.index(class_name)
+    min_overlap = MIN_OVERLAP[METRICS.index(metric), class_idx]
+    precision = np.zeros((len(DIFFICULTIES), N_SAMPLE_PTS))
+    aos = np.zeros((len(DIFFICULTIES), N_SAMPLE_PTS))
+    for difficulty in range(len(DIFFICULTIES)):
+        flags = []
+        scores = []
+        n_gt = 0
+        for (gt, det), overlaps in zip(_FRAMES, _OVERLAPS):
+            ignored_gt, ignored_det = clean_data(class_name, gt, det, difficulty)
+            n_gt += np.sum(ignored_gt == 0)
+            flags.append((ignored_gt, ignored_det))
+            scores += match_scores(overlaps[metric][0], ignored_gt,
+                ignored_det, det['score'], min_overlap)
+        if n_gt == 0: continue
+        thresholds = get_thresholds(scores, n_gt)
+        stats = np.zeros((len(thresholds), 4))
+        for (gt, det), overlaps, (ignored_gt, ignored_det) in \
+                zip(_FRAMES, _OVERLAPS, flags):
+            if not np.any(ignored_det != -1) and not np.any(ignored_gt == 0):
+                continue
+            delta = None
+            if compute_aos:
+                delta = gt['alpha'][None,:] - det['alpha'][:,None]
+            stats += match_thresholds(overlaps[metric][0], overlaps[metric][1],
+                ignored_gt, ignored_det, det['score'], min_overlap,
+                thresholds, delta)
+        tp, fp = stats[:,0], stats[:,1]
+        n = len(thresholds)
+        precision[difficulty,:n] = tp / np.maximum(tp + fp, 1)
+        aos[difficulty,:n] = stats[:,3] / np.maximum(tp + fp, 1)
+    # Filter precision and AOS using max_{i..end}
+    precision = np.maximum.accumulate(precision[:,::-1], 1)[:,::-1]
+    aos = np.maximum.accumulate(aos[:,::-1], 1)[:,::-1]
+    return precision, aos
+
+def average_precision(precision):
+    ''' 11-point interpolated AP (in percent) of 41-point precision curves,
+    as printed by the C++ evaluator. '''
+    return np.sum(precision[...,0::4], -1) / 11.0 * 100
+
+def _map(func, items, num_workers, initargs=None):
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if num_workers <= 1 or len(items) <= 1:
+        if initargs is not None:
+            _init_worker(*initargs)
+        return [func(item) for item in items]
+    pool = multiprocessing.Pool(min(num_workers, len(items)),
+        _init_worker if initargs is not None else None, initargs or ())
+    try:
+        return pool.map(func, items, chunksize=max(1, len(items) // (4*num_workers)))
+    finally:
+        pool.close()
+        pool.join()
+
+def evaluate(groundtruth, detections, frame_ids=None, num_workers=None):
+    ''' Evaluate detections against ground truth, both maps from frame id to
+    frame (see read_label_file, detections_from_arrays). Frames without
+    detections count as empty; frames without ground truth are skipped.
+    As in the C++ evaluator, a class is only evaluated under a metric if it
+    was detected at least once with that kind of box.
+    Returns results[class][metric] = {'precision': 3x41, 'ap': 3,
+        ['aos': 3x41, 'aos_ap': 3]} for easy, moderate and hard.
+    '''
+    if frame_ids is None:
+        frame_ids = sorted(set(detections.keys()) & set(groundtruth.keys()))
+    frames = [(groundtruth[idx], detections.get(idx, empty_frame(True))) \
+        for idx in frame_ids]
+    overlaps = _map(frame_overlaps, frames, num_workers)
+
+    det_types = np.concatenate([det['type'] for _, det in frames] + [np.zeros(0, dtype=str)])
+    det_bbox = np.concatenate([det['bbox'] for _, det in frames] + [np.zeros((0,4))])
+    det_loc = np.concatenate([det['loc'] for _, det in frames] + [np.zeros((0,3))])
+    det_alpha = np.concatenate([det['alpha'] for _, det in frames] + [np.zeros(0)])
+    compute_aos = not np.any(det_alpha == -10)
+    tasks = []
+    for class_name in CLASS_NAMES:
+        detected = det_types == class_name
+        if np.any(detected & (det_bbox[:,0] >= 0)):
+            tasks.append((class_name, 'image', compute_aos))
+        if np.any(detected & (det_loc[:,0] != -1000)):
+            tasks.append((class_name, 'ground', False))
+        if np.any(detected & (det_loc[:,1] != -1000)):
+            tasks.append((class_name, '3d', False))
+    curves = _map(eval_class, tasks, num_workers, (frames, overlaps))
+
+    results = {}
+    for (class_name, metric, task_aos), (precision, aos) in zip(tasks, curves):
+        result = {'precision': precision, 'ap': average_precision(precision)}
+        if task_aos:
+            result['aos'] = aos
+            result['aos_ap'] = average_precision(aos)
+        results.setdefault(class_name, {})[metric] = result
+    return results
+
+def format_results(results):
+    ''' One line per class and metric with easy, moderate and hard AP. '''
+    names = {'image': '_detection', 'ground': '_detection_ground', '3d': '_detection_3d'}
+    lines = []
+    for class_name in CLASS_NAMES:
+        for metric in METRICS:
+            if metric not in results.get(class_name, {}): continue
+            result = results[class_name][metric]
+            lines.append('%s%s AP: %f %f %f' % ((class_name, names[metric]) + \
+                tuple(result['ap'])))
+            if 'aos_ap' in result:
+                lines.append('%s_orientation AP: %f %f %f' % ((class_name,) + \
+                    tuple(result['aos_ap'])))
+    return '\n'.join(lines)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('gt_dir', help='KITTI label_2 directory')
+    parser.add_argument('result_dir', help='Results directory, with label files in result_dir/data')
+    parser.add_argument('--num_workers', type=int, default=None, help='Worker processes [default: number of CPUs]')
+    FLAGS = parser.parse_args()
+    detections = load_detections(FLAGS.result_dir)
+    print('number of files for evaluation: %d' % (len(detections)))
+    frame_ids = sorted(detections.keys())
+    groundtruth = load_groundtruth(FLAGS.gt_dir, frame_ids, FLAGS.num_workers)
+    print(format_results(evaluate(groundtruth, detections, frame_ids, FLAGS.num_workers)))
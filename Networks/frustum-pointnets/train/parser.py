@@ -1,34 +1,23 @@
-import json
+import os
+import sys
 import numpy as np
 import math
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '../../../Benchmark'))
+import trace_util
 
 pointnet_ops = ['RealDiv', 'Slice', 'Sub', 'Sum', 'GatherNd', 'ThreeInterpolate', 'Relu', 'Max', 'Add', 'QueryBallPoint', 'Tile', 'Mul', 'GatherPoint', 'GatherV2', 'Transpose', 'BiasAdd', 'ConcatV2', 'Reciprocal', 'ThreeNN', 'Maximum', 'Cast', 'SquaredDifference', 'RandomUniformInt', 'MaxPool', 'Mean', 'Less', 'FusedBatchNorm', 'MatMul', 'Rsqrt', 'Conv2D', 'other']
 
 
 def parse_timeline(fn):
-
-    with open(fn) as f:
-        data = json.load(f)
-        main_pid = None
-        pid2name = {}
-        op_cat = {}
-        for item in data["traceEvents"]:
-        # print(item)
-            if "ts" not in item:
-                # print(item["args"]["name"])
-                pid2name[item["pid"]] = item["args"]["name"]
-                if "all Compute" in item["args"]["name"]:
-                    main_pid = item["pid"]
-
-            else:
-                if item["pid"] == main_pid:
-                    if item["ph"] == 'X' and item["cat"] == "Op" and "dur" in item:
-                        if item["name"] not in op_cat:
-                            op_cat[item["name"]] = item["dur"]
-                        else:
-                            op_cat[item["name"]] += item["dur"]
-                            
-        return op_cat
+    ''' Sum the device time (us) of every op type of a TF timeline.
+    See Benchmark/trace_util.py for the stage-level analysis. '''
+    events, _ = trace_util.load_trace(fn)
+    events = [e for e in events if trace_util.event_role(e) == 'device']
+    op_cat = {}
+    for e, dur in zip(events, trace_util.self_durations(events)):
+        op_cat[e['name']] = op_cat.get(e['name'], 0) + dur
+    return op_cat
 
 
 def dict2list(ops, ops_name):
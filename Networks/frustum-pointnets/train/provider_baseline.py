@@ -103,6 +103,7 @@ class FrustumDataset(object):
         '''
         Input:
             npoints: int scalar, number of points for frustum point cloud.
+                if None, keep all points of every frustum (variable length).
             split: string, train or val
             random_flip: bool, in 50% randomly flip the point cloud
                 in left and right (after the frustum rotation if any)
@@ -168,7 +169,10 @@ class FrustumDataset(object):
         else:
             point_set = self.input_list[index]
         # Resample
-        choice = np.random.choice(point_set.shape[0], self.npoints, replace=True)
+        if self.npoints is None:
+            choice = np.arange(point_set.shape[0])
+        else:
+            choice = np.random.choice(point_set.shape[0], self.npoints, replace=True)
         point_set = point_set[choice, :]
 
         if self.from_rgb_detection:
@@ -11,12 +11,23 @@ import os
 import sys
 import argparse
 import importlib
+import threading
 import numpy as np
 import tensorflow as tf
 import cPickle as pickle
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, 'kitti_eval'))
+sys.path.append(os.path.join(ROOT_DIR, '../../Benchmark'))
+import evaluate_object_3d
+import freeze_util
+import graph_cache
+import shard_util
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--gpu', type=int, default=0, help='GPU to use [default: GPU 0]')
@@ -31,6 +42,14 @@ parser.add_argument('--data_path', default=None, help='frustum dataset pickle fi
 parser.add_argument('--from_rgb_detection', action='store_true', help='test from dataset files from rgb detection.')
 parser.add_argument('--idx_path', default=None, help='filename of txt where each line is a data idx, used for rgb detection -- write <id>.txt for all frames. [default: None]')
 parser.add_argument('--dump_result', action='store_true', help='If true, also dump results to .pickle file')
+parser.add_argument('--variable_points', action='store_true', help='Keep all points of every frustum and run each one in the smallest graph of --buckets that fits it, instead of resampling all frustums to --num_point')
+parser.add_argument('--buckets', default='128,256,512,1024', help='Graph sizes used with --variable_points, larger frustums are subsampled to the largest [default: 128,256,512,1024]')
+parser.add_argument('--eval_label_dir', default=None, help='KITTI label_2 directory; if given, the 2D/BEV/3D AP of the results is computed in-process [default: None]')
+parser.add_argument('--export_graph', default=None, help='Write the restored model (one graph per bucket with --variable_points) as a frozen inference graph with batch norm folded to this file and exit [default: None]')
+parser.add_argument('--frozen_graph', default=None, help='Test the frozen graph written by --export_graph instead of building the model [default: None]')
+parser.add_argument('--eval_workers', type=int, default=None, help='Processes used by the AP evaluation [default: number of CPUs]')
+graph_cache.add_cache_args(parser)
+shard_util.add_shard_args(parser)
 FLAGS = parser.parse_args()
 
 MODEL_PATH = None
@@ -45,9 +64,11 @@ else:
     import provider
 
 sys.path.append(os.path.join(ROOT_DIR, MODEL_PATH)) 
+MODEL_DIR = MODEL_PATH
 
-from train_util import get_batch 
-from model_util import NUM_HEADING_BIN, NUM_SIZE_CLUSTER
+from train_util import get_batch, get_packed_batch, unpack_point_sets, \
+    bucket_of, resample_to_bucket
+from model_util import NUM_HEADING_BIN, NUM_SIZE_CLUSTER, g_mean_size_arr
 # Set training configurations
 BATCH_SIZE = FLAGS.batch_size
 MODEL_PATH = FLAGS.model_path
@@ -56,53 +77,166 @@ NUM_POINT = FLAGS.num_point
 MODEL = importlib.import_module(FLAGS.model)
 NUM_CLASSES = 2
 NUM_CHANNEL = 4
+BUCKET_SIZES = [int(size) for size in FLAGS.buckets.split(',')]
 
 # Load Frustum Datasets.
-TEST_DATASET = provider.FrustumDataset(npoints=NUM_POINT, split='val',
+TEST_DATASET = provider.FrustumDataset(
+    npoints=None if FLAGS.variable_points else NUM_POINT, split='val',
     rotate_to_center=True, overwritten_data_path=FLAGS.data_path,
     from_rgb_detection=FLAGS.from_rgb_detection, one_hot=True)
 
+# Tensors kept in frozen graphs, the end points are those inference reads
+FROZEN_INPUTS = ['pointclouds_pl', 'one_hot_vec_pl']
+FROZEN_END_POINTS = ['heading_scores', 'heading_residuals', 'size_scores',
+                     'size_residuals']
+
+# Per frustum results of test and test_from_rgb_detection, in the order
+# they are dumped to the result pickle
+TEST_RESULTS = ['ps_list', 'seg_list', 'segp_list', 'center_list',
+                'heading_cls_list', 'heading_res_list', 'size_cls_list',
+                'size_res_list', 'rot_angle_list', 'score_list']
+RGB_DETECTION_RESULTS = ['ps_list', 'segp_list', 'center_list',
+                         'heading_cls_list', 'heading_res_list', 'size_cls_list',
+                         'size_res_list', 'rot_angle_list', 'score_list', 'onehot_list']
+# Only passed from the shards if the results are dumped
+POINT_RESULTS = ['ps_list', 'seg_list', 'segp_list']
+
+def frozen_tensors(ops, suffix=''):
+    ''' Inputs and outputs of ops to export, keys end with suffix '''
+    inputs = dict((key+suffix, ops[key]) for key in FROZEN_INPUTS)
+    outputs = {'logits'+suffix: ops['logits'], 'center'+suffix: ops['center']}
+    for key in FROZEN_END_POINTS:
+        outputs[key+suffix] = ops['end_points'][key]
+    return inputs, outputs
+
+def frozen_ops(inputs, outputs, is_training_pl, suffix=''):
+    ''' ops as returned by get_session_and_ops from the tensors of a
+    frozen graph, reverse of frozen_tensors
+    '''
+    ops = dict((key, inputs[key+suffix]) for key in FROZEN_INPUTS)
+    ops.update({'is_training_pl': is_training_pl,
+                'logits': outputs['logits'+suffix],
+                'center': outputs['center'+suffix],
+                'end_points': dict((key, outputs[key+suffix]) \
+                    for key in FROZEN_END_POINTS)})
+    return ops
+
+def load_frozen_graph():
+    ''' Load the graph written by --export_graph, create session and
+    return session handle and input and output tensors by key
+    '''
+    with tf.Graph().as_default():
+        inputs, outputs = freeze_util.load_frozen_graph(FLAGS.frozen_graph)
+        # batch norm and dropout are folded in, is_training is fed but unused
+        is_training_pl = tf.placeholder(tf.bool, shape=())
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        shard_util.configure_session(config, FLAGS)
+        sess = tf.Session(config=config)
+    return sess, inputs, outputs, is_training_pl
+
 def get_session_and_ops(batch_size, num_point):
     ''' Define model graph, load model parameters,
     create session and return session handle and tensors
     '''
+    if FLAGS.frozen_graph is not None:
+        sess, inputs, outputs, is_training_pl = load_frozen_graph()
+        return sess, frozen_ops(inputs, outputs, is_training_pl)
+    def build():
+        pointclouds_pl, one_hot_vec_pl, labels_pl, centers_pl, \
+        heading_class_label_pl, heading_residual_label_pl, \
+        size_class_label_pl, size_residual_label_pl = \
+            MODEL.placeholder_inputs(batch_size, num_point)
+        is_training_pl = tf.placeholder(tf.bool, shape=())
+        end_points = MODEL.get_model(pointclouds_pl, one_hot_vec_pl,
+            is_training_pl)
+        loss = MODEL.get_loss(labels_pl, centers_pl,
+            heading_class_label_pl, heading_residual_label_pl,
+            size_class_label_pl, size_residual_label_pl, end_points)
+        return {'pointclouds_pl': pointclouds_pl,
+                'one_hot_vec_pl': one_hot_vec_pl,
+                'labels_pl': labels_pl,
+                'centers_pl': centers_pl,
+                'heading_class_label_pl': heading_class_label_pl,
+                'heading_residual_label_pl': heading_residual_label_pl,
+                'size_class_label_pl': size_class_label_pl,
+                'size_residual_label_pl': size_residual_label_pl,
+                'is_training_pl': is_training_pl,
+                'logits': end_points['mask_logits'],
+                'center': end_points['center'],
+                'end_points': end_points,
+                'loss': loss}
+
+    cache_file = graph_cache.cache_file(graph_cache.cache_dir(FLAGS),
+        'frustum-pointnets', MODEL_DIR, batch_size, num_point,
+        extra={'model': FLAGS.model, 'test': True},
+        sources=[os.path.join(ROOT_DIR, MODEL_DIR), os.path.abspath(__file__)])
     with tf.Graph().as_default():
         with tf.device('/gpu:'+str(GPU_INDEX)):
-            pointclouds_pl, one_hot_vec_pl, labels_pl, centers_pl, \
-            heading_class_label_pl, heading_residual_label_pl, \
-            size_class_label_pl, size_residual_label_pl = \
-                MODEL.placeholder_inputs(batch_size, num_point)
-            is_training_pl = tf.placeholder(tf.bool, shape=())
-            end_points = MODEL.get_model(pointclouds_pl, one_hot_vec_pl,
-                is_training_pl)
-            loss = MODEL.get_loss(labels_pl, centers_pl,
-                heading_class_label_pl, heading_residual_label_pl,
-                size_class_label_pl, size_residual_label_pl, end_points)
-            saver = tf.train.Saver()
+            ops, saver = graph_cache.cached_graph(cache_file, build)
 
         # Create a session
         config = tf.ConfigProto()
         config.gpu_options.allow_growth = True
         config.allow_soft_placement = True
+        shard_util.configure_session(config, FLAGS)
         sess = tf.Session(config=config)
 
         # Restore variables from disk.
         saver.restore(sess, MODEL_PATH)
-        ops = {'pointclouds_pl': pointclouds_pl,
-               'one_hot_vec_pl': one_hot_vec_pl,
-               'labels_pl': labels_pl,
-               'centers_pl': centers_pl,
-               'heading_class_label_pl': heading_class_label_pl,
-               'heading_residual_label_pl': heading_residual_label_pl,
-               'size_class_label_pl': size_class_label_pl,
-               'size_residual_label_pl': size_residual_label_pl,
-               'is_training_pl': is_training_pl,
-               'logits': end_points['mask_logits'],
-               'center': end_points['center'],
-               'end_points': end_points,
-               'loss': loss}
         return sess, ops
 
+def get_session_and_bucket_ops(batch_size, bucket_sizes):
+    ''' Define one model graph per bucket size, all sharing the same
+    variables, load model parameters, create session and return session
+    handle and a dict from bucket size to the tensors of its graph
+    '''
+    if FLAGS.frozen_graph is not None:
+        # the keys of the frozen bucket graphs end with _<bucket size>
+        sess, inputs, outputs, is_training_pl = load_frozen_graph()
+        sizes = [int(key.split('_')[-1]) for key in inputs \
+            if key.startswith('pointclouds_pl_')]
+        return sess, dict((size, frozen_ops(inputs, outputs, is_training_pl,
+            '_%d' % (size))) for size in sizes)
+    def build():
+        is_training_pl = tf.placeholder(tf.bool, shape=())
+        bucket_ops = {}
+        for i, size in enumerate(sorted(bucket_sizes)):
+            with tf.variable_scope(tf.get_variable_scope(), reuse=i>0):
+                pointclouds_pl, one_hot_vec_pl = \
+                    MODEL.placeholder_inputs(batch_size, size)[0:2]
+                end_points = MODEL.get_model(pointclouds_pl,
+                    one_hot_vec_pl, is_training_pl)
+            bucket_ops[str(size)] = {'pointclouds_pl': pointclouds_pl,
+                                     'one_hot_vec_pl': one_hot_vec_pl,
+                                     'is_training_pl': is_training_pl,
+                                     'logits': end_points['mask_logits'],
+                                     'center': end_points['center'],
+                                     'end_points': end_points}
+        return bucket_ops
+
+    cache_file = graph_cache.cache_file(graph_cache.cache_dir(FLAGS),
+        'frustum-pointnets', MODEL_DIR, batch_size, max(bucket_sizes),
+        extra={'model': FLAGS.model, 'buckets': sorted(bucket_sizes)},
+        sources=[os.path.join(ROOT_DIR, MODEL_DIR), os.path.abspath(__file__)])
+    with tf.Graph().as_default():
+        with tf.device('/gpu:'+str(GPU_INDEX)):
+            # keys of the cached graphs are strings
+            bucket_ops, saver = graph_cache.cached_graph(cache_file, build)
+            bucket_ops = dict((int(size), ops) for size, ops in bucket_ops.items())
+
+        # Create a session
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        shard_util.configure_session(config, FLAGS)
+        sess = tf.Session(config=config)
+
+        # Restore variables from disk.
+        saver.restore(sess, MODEL_PATH)
+        return sess, bucket_ops
+
 def softmax(x):
     ''' Numpy function for softmax'''
     shape = x.shape
@@ -120,7 +254,6 @@ def inference(sess, ops, pc, one_hot_vec, batch_size):
     heading_residuals = np.zeros((pc.shape[0], NUM_HEADING_BIN))
     size_logits = np.zeros((pc.shape[0], NUM_SIZE_CLUSTER))
     size_residuals = np.zeros((pc.shape[0], NUM_SIZE_CLUSTER, 3))
-    scores = np.zeros((pc.shape[0],)) # 3D box score 
    
     ep = ops['end_points'] 
     for i in range(num_batches):
@@ -144,57 +277,249 @@ def inference(sess, ops, pc, one_hot_vec, batch_size):
         size_logits[i*batch_size:(i+1)*batch_size,...] = batch_size_scores
         size_residuals[i*batch_size:(i+1)*batch_size,...] = batch_size_residuals
 
-        # Compute scores
-        batch_seg_prob = softmax(batch_logits)[:,:,1] # BxN
-        batch_seg_mask = np.argmax(batch_logits, 2) # BxN
-        mask_mean_prob = np.sum(batch_seg_prob * batch_seg_mask, 1) # B,
-        mask_mean_prob = mask_mean_prob / np.sum(batch_seg_mask,1) # B,
-        heading_prob = np.max(softmax(batch_heading_scores),1) # B
-        size_prob = np.max(softmax(batch_size_scores),1) # B,
-        batch_scores = np.log(mask_mean_prob) + np.log(heading_prob) + np.log(size_prob)
-        scores[i*batch_size:(i+1)*batch_size] = batch_scores 
-        # Finished computing scores
+    # Compute scores of all frustums at once
+    seg_prob = softmax(logits)[:,:,1] # BxN
+    seg_mask = np.argmax(logits, 2) # BxN
+    mask_mean_prob = np.sum(seg_prob * seg_mask, 1) # B,
+    mask_mean_prob = mask_mean_prob / np.sum(seg_mask,1) # B,
+    heading_prob = np.max(softmax(heading_logits),1) # B
+    size_prob = np.max(softmax(size_logits),1) # B,
+    scores = np.log(mask_mean_prob) + np.log(heading_prob) + np.log(size_prob)
 
     heading_cls = np.argmax(heading_logits, 1) # B
     size_cls = np.argmax(size_logits, 1) # B
-    heading_res = np.array([heading_residuals[i,heading_cls[i]] \
-        for i in range(pc.shape[0])])
-    size_res = np.vstack([size_residuals[i,size_cls[i],:] \
-        for i in range(pc.shape[0])])
+    heading_res = heading_residuals[np.arange(pc.shape[0]), heading_cls] # B
+    size_res = size_residuals[np.arange(pc.shape[0]), size_cls, :] # Bx3
 
-    return np.argmax(logits, 2), centers, heading_cls, heading_res, \
+    return seg_mask, centers, heading_cls, heading_res, \
         size_cls, size_res, scores
 
+def inference_packed(sess, bucket_ops, points, row_splits, one_hot_vec, batch_size):
+    ''' Run inference for variable-length frustums.
+    Input:
+        bucket_ops: dict from bucket size to tensors, see get_session_and_bucket_ops
+        points: (sum of N_i,C) packed frustum points, see get_packed_batch
+        row_splits: (B+1,) start of every frustum in points
+        one_hot_vec: (B,3)
+    Output:
+        seg: list of (M_i,) predicted masks of the points choice[i]
+        choice: list of (M_i,) indices of the frustum points seen by the
+            model, all N_i points unless N_i is larger than the largest bucket
+        and centers, heading/size classes and residuals and scores as in inference
+    '''
+    point_sets = unpack_point_sets(points, row_splits)
+    num_frustum = len(point_sets)
+    seg = [None] * num_frustum
+    choice = [None] * num_frustum
+    centers = np.zeros((num_frustum, 3))
+    heading_cls = np.zeros((num_frustum,), dtype=np.int32)
+    heading_res = np.zeros((num_frustum,))
+    size_cls = np.zeros((num_frustum,), dtype=np.int32)
+    size_res = np.zeros((num_frustum, 3))
+    scores = np.zeros((num_frustum,)) # 3D box score
+
+    # Group the frustums by the smallest graph that holds them
+    groups = {}
+    for i in range(num_frustum):
+        size = bucket_of(point_sets[i].shape[0], bucket_ops.keys())
+        groups.setdefault(size, []).append(i)
+
+    for size in sorted(groups):
+        ops = bucket_ops[size]
+        ep = ops['end_points']
+        members = groups[size]
+        for start in range(0, len(members), batch_size):
+            batch_members = members[start:start+batch_size]
+            batch_data = np.zeros((batch_size, size, points.shape[1]))
+            batch_one_hot_vec = np.zeros((batch_size, 3))
+            batch_choice = []
+            for j, i in enumerate(batch_members):
+                batch_data[j], frustum_choice = \
+                    resample_to_bucket(point_sets[i], size)
+                batch_one_hot_vec[j] = one_hot_vec[i]
+                batch_choice.append(frustum_choice)
+            # Fill the rest of the last batch with copies of its first frustum
+            batch_data[len(batch_members):] = batch_data[0]
+            batch_one_hot_vec[len(batch_members):] = batch_one_hot_vec[0]
+
+            feed_dict = {\
+                ops['pointclouds_pl']: batch_data,
+                ops['one_hot_vec_pl']: batch_one_hot_vec,
+                ops['is_training_pl']: False}
+            batch_logits, batch_centers, \
+            batch_heading_scores, batch_heading_residuals, \
+            batch_size_scores, batch_size_residuals = \
+                sess.run([ops['logits'], ops['center'],
+                    ep['heading_scores'], ep['heading_residuals'],
+                    ep['size_scores'], ep['size_residuals']],
+                    feed_dict=feed_dict)
+
+            heading_prob = np.max(softmax(batch_heading_scores),1) # B
+            size_prob = np.max(softmax(batch_size_scores),1) # B,
+            for j, i in enumerate(batch_members):
+                # The padding duplicates are not part of the prediction
+                num_seen = min(point_sets[i].shape[0], size)
+                logits = batch_logits[j,0:num_seen,:]
+                seg[i] = np.argmax(logits, 1)
+                choice[i] = batch_choice[j][0:num_seen]
+                centers[i] = batch_centers[j]
+                heading_cls[i] = np.argmax(batch_heading_scores[j])
+                heading_res[i] = batch_heading_residuals[j,heading_cls[i]]
+                size_cls[i] = np.argmax(batch_size_scores[j])
+                size_res[i] = batch_size_residuals[j,size_cls[i],:]
+                mask_mean_prob = np.sum(softmax(logits)[:,1] * seg[i]) / \
+                    np.sum(seg[i])
+                scores[i] = np.log(mask_mean_prob) + np.log(heading_prob[j]) + \
+                    np.log(size_prob[j])
+
+    return seg, choice, centers, heading_cls, heading_res, \
+        size_cls, size_res, scores
+
+def prefetch(load_batch, num_batches, depth=2):
+    ''' Yield load_batch(0), ..., load_batch(num_batches-1), loading up to
+    depth batches ahead on a background thread so that reading and
+    resampling the frustums overlaps with inference.
+    '''
+    batches = queue.Queue(maxsize=depth)
+    def load():
+        try:
+            for batch_idx in range(num_batches):
+                batches.put((None, load_batch(batch_idx)))
+        except Exception as e:
+            batches.put((e, None))
+    thread = threading.Thread(target=load)
+    thread.daemon = True
+    thread.start()
+    for batch_idx in range(num_batches):
+        error, batch = batches.get()
+        if error is not None:
+            raise error
+        yield batch
+
+def from_prediction_to_label_format(center, angle_class, angle_res,
+                                    size_class, size_res, rot_angle):
+    ''' Batch version of provider.from_prediction_to_label_format.
+    Input: (B,3), (B,), (B,), (B,), (B,3), (B,) arrays
+    Output: h,w,l,tx,ty,tz,ry arrays of shape (B,)
+    '''
+    size = g_mean_size_arr[size_class] + size_res # Bx3 (l,w,h)
+    angle = angle_class * (2*np.pi/float(NUM_HEADING_BIN)) + angle_res
+    angle = np.where(angle > np.pi, angle - 2*np.pi, angle)
+    ry = angle + rot_angle
+    # Rotate the centers back by -rot_angle around the y axis
+    cosval = np.cos(-rot_angle)
+    sinval = np.sin(-rot_angle)
+    tx = cosval * center[:,0] - sinval * center[:,2]
+    tz = sinval * center[:,0] + cosval * center[:,2]
+    ty = center[:,1] + size[:,2]/2.0
+    return size[:,2], size[:,1], size[:,0], tx, ty, tz, ry
+
+class DetectionWriter(object):
+    ''' Write frustum pointnets results to KITTI format label files on a
+    background thread. Results are added batch by batch with put(), and the
+    file of a frame is written as soon as all its frustums are in, so
+    inference never waits on formatting or file I/O.
+    '''
+    def __init__(self, result_dir, id_list, type_list, box2d_list):
+        self.result_dir = result_dir
+        self.id_list = id_list
+        self.type_list = type_list
+        self.box2d_list = box2d_list
+        self.results = {} # map from idx to list of strings, each string is a line (without \n)
+        self.remaining = {} # map from idx to number of frustums not written yet
+        for idx in id_list:
+            self.remaining[idx] = self.remaining.get(idx, 0) + 1
+        if result_dir is None: return
+        self.output_dir = os.path.join(result_dir, 'data')
+        if not os.path.exists(self.output_dir): os.makedirs(self.output_dir)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, start_idx, center, heading_cls, heading_res,
+            size_cls, size_res, rot_angle, score):
+        ''' Add the results of frustums start_idx... of the dataset. The
+        number of frustums is len(rot_angle), other arrays may be longer. '''
+        num = len(rot_angle)
+        if self.result_dir is None or num == 0: return
+        self.queue.put((start_idx, [np.asarray(x)[0:num] for x in \
+            [center, heading_cls, heading_res, size_cls, size_res, rot_angle, score]]))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None: break
+            self.add(item[0], *item[1])
+
+    def add(self, start_idx, center, heading_cls, heading_res,
+            size_cls, size_res, rot_angle, score):
+        h,w,l,tx,ty,tz,ry = from_prediction_to_label_format(center,
+            heading_cls, heading_res, size_cls, size_res, rot_angle)
+        for i in range(len(rot_angle)):
+            idx = self.id_list[start_idx+i]
+            box2d = self.box2d_list[start_idx+i]
+            output_str = self.type_list[start_idx+i] + " -1 -1 -10 "
+            output_str += "%f %f %f %f " % (box2d[0],box2d[1],box2d[2],box2d[3])
+            output_str += "%f %f %f %f %f %f %f %f" % \
+                (h[i],w[i],l[i],tx[i],ty[i],tz[i],ry[i],score[i])
+            if idx not in self.results: self.results[idx] = []
+            self.results[idx].append(output_str)
+            self.remaining[idx] -= 1
+            if self.remaining[idx] == 0:
+                self.write(idx)
+
+    def write(self, idx):
+        pred_filename = os.path.join(self.output_dir, '%06d.txt'%(idx))
+        fout = open(pred_filename, 'w')
+        for line in self.results.pop(idx):
+            fout.write(line+'\n')
+        fout.close()
+
+    def close(self):
+        ''' Wait for the queued results and write the frames that only got
+        part of their frustums. '''
+        if self.result_dir is None: return
+        self.queue.put(None)
+        self.thread.join()
+        for idx in list(self.results.keys()):
+            self.write(idx)
+
 def write_detection_results(result_dir, id_list, type_list, box2d_list, center_list, \
                             heading_cls_list, heading_res_list, \
                             size_cls_list, size_res_list, \
                             rot_angle_list, score_list):
     ''' Write frustum pointnets results to KITTI format label files. '''
     if result_dir is None: return
-    results = {} # map from idx to list of strings, each string is a line (without \n)
-    for i in range(len(center_list)):
-        idx = id_list[i]
-        output_str = type_list[i] + " -1 -1 -10 "
-        box2d = box2d_list[i]
-        output_str += "%f %f %f %f " % (box2d[0],box2d[1],box2d[2],box2d[3])
-        h,w,l,tx,ty,tz,ry = provider.from_prediction_to_label_format(center_list[i],
-            heading_cls_list[i], heading_res_list[i],
-            size_cls_list[i], size_res_list[i], rot_angle_list[i])
-        score = score_list[i]
-        output_str += "%f %f %f %f %f %f %f %f" % (h,w,l,tx,ty,tz,ry,score)
-        if idx not in results: results[idx] = []
-        results[idx].append(output_str)
-
-    # Write TXT files
-    if not os.path.exists(result_dir): os.mkdir(result_dir)
-    output_dir = os.path.join(result_dir, 'data')
-    if not os.path.exists(output_dir): os.mkdir(output_dir)
-    for idx in results:
-        pred_filename = os.path.join(output_dir, '%06d.txt'%(idx))
-        fout = open(pred_filename, 'w')
-        for line in results[idx]:
-            fout.write(line+'\n')
-        fout.close() 
+    writer = DetectionWriter(result_dir, id_list, type_list, box2d_list)
+    writer.put(0, np.array(center_list), np.array(heading_cls_list),
+        np.array(heading_res_list), np.array(size_cls_list),
+        np.array(size_res_list), np.array(rot_angle_list), np.array(score_list))
+    writer.close()
+
+def evaluate_detection_results(center_list, heading_cls_list, heading_res_list,
+                               size_cls_list, size_res_list,
+                               rot_angle_list, score_list):
+    ''' Compute the KITTI AP of the results in memory against the labels
+    in --eval_label_dir, as the C++ evaluator would on the written files. '''
+    num = len(center_list)
+    h,w,l,tx,ty,tz,ry = from_prediction_to_label_format(np.array(center_list),
+        np.array(heading_cls_list), np.array(heading_res_list),
+        np.array(size_cls_list), np.array(size_res_list),
+        np.array(rot_angle_list))
+    detections = evaluate_object_3d.detections_from_arrays(
+        TEST_DATASET.id_list[0:num], TEST_DATASET.type_list[0:num],
+        TEST_DATASET.box2d_list[0:num], h, w, l, tx, ty, tz, ry, score_list)
+    if FLAGS.idx_path is not None:
+        frame_ids = [int(line.rstrip()) for line in open(FLAGS.idx_path)]
+    else:
+        frame_ids = sorted(detections.keys())
+    groundtruth = evaluate_object_3d.load_groundtruth(FLAGS.eval_label_dir,
+        frame_ids, FLAGS.eval_workers)
+    results = evaluate_object_3d.evaluate(groundtruth, detections, frame_ids,
+        FLAGS.eval_workers)
+    print(evaluate_object_3d.format_results(results))
+    return results
 
 def fill_files(output_dir, to_fill_filename_list):
     ''' Create empty files if not exist for the filelist. '''
@@ -204,11 +529,66 @@ def fill_files(output_dir, to_fill_filename_list):
             fout = open(filepath, 'w')
             fout.close()
 
+def fill_frames(result_dir):
+    ''' Make sure for each frame of --idx_path (no matter if we have
+    measurment for that frame), there is a TXT file '''
+    if FLAGS.idx_path is not None:
+        to_fill_filename_list = [line.rstrip()+'.txt' \
+            for line in open(FLAGS.idx_path)]
+        fill_files(os.path.join(result_dir, 'data'), to_fill_filename_list)
+
+def shard_result(keys, lists, frustum_idx_list, **counts):
+    ''' Results of a shard worker for the coordinator: the per frustum lists
+    by key, the dataset index of every frustum and the counts. '''
+    result = dict(counts)
+    result['frustum_idx'] = frustum_idx_list
+    for key, value in zip(keys, lists):
+        if FLAGS.dump_result or key not in POINT_RESULTS:
+            result[key] = value
+    return result
+
+def test_shards(output_filename, result_dir, keys, num_batches):
+    ''' Run the test in --num_shards worker processes, put the frustums they
+    return back in dataset order, then dump, write and evaluate them as a
+    single process does. Return the merged results by key.
+    '''
+    log_dir = result_dir if result_dir is not None else '.'
+    if not os.path.exists(log_dir): os.makedirs(log_dir)
+    results = shard_util.merge(shard_util.run_shards(FLAGS, log_dir, num_batches))
+    order = np.argsort(results.pop('frustum_idx'), kind='mergesort')
+    for key in keys:
+        if key in results:
+            results[key] = [results[key][i] for i in order]
+    print('Merged %d shards, number of point clouds: %d' % \
+        (FLAGS.num_shards, len(order)))
+
+    if FLAGS.dump_result:
+        with open(output_filename, 'wp') as fp:
+            for key in keys:
+                pickle.dump(results[key], fp)
+    write_detection_results(result_dir, TEST_DATASET.id_list,
+        TEST_DATASET.type_list, TEST_DATASET.box2d_list,
+        results['center_list'], results['heading_cls_list'],
+        results['heading_res_list'], results['size_cls_list'],
+        results['size_res_list'], results['rot_angle_list'],
+        results['score_list'])
+    if FLAGS.eval_label_dir is not None:
+        evaluate_detection_results(results['center_list'],
+            results['heading_cls_list'], results['heading_res_list'],
+            results['size_cls_list'], results['size_res_list'],
+            results['rot_angle_list'], results['score_list'])
+    return results
+
 def test_from_rgb_detection(output_filename, result_dir=None):
     ''' Test frustum pointents with 2D boxes from a RGB detector.
     Write test results to KITTI format label files.
-    todo (rqi): support variable number of points.
+    With --variable_points, frustums keep their own number of points.
     '''
+    if shard_util.is_coordinator(FLAGS):
+        test_shards(output_filename, result_dir, RGB_DETECTION_RESULTS,
+            int((len(TEST_DATASET)+BATCH_SIZE-1)/BATCH_SIZE))
+        fill_frames(result_dir)
+        return
     ps_list = []
     segp_list = []
     center_list = []
@@ -219,6 +599,7 @@ def test_from_rgb_detection(output_filename, result_dir=None):
     rot_angle_list = []
     score_list = []
     onehot_list = []
+    frustum_idx_list = []
 
     test_idxs = np.arange(0, len(TEST_DATASET))
     print(len(TEST_DATASET))
@@ -227,29 +608,62 @@ def test_from_rgb_detection(output_filename, result_dir=None):
     
     batch_data_to_feed = np.zeros((batch_size, NUM_POINT, NUM_CHANNEL))
     batch_one_hot_to_feed = np.zeros((batch_size, 3))
-    sess, ops = get_session_and_ops(batch_size=batch_size, num_point=NUM_POINT)
-    for batch_idx in range(num_batches):
+    if FLAGS.variable_points:
+        sess, bucket_ops = get_session_and_bucket_ops(batch_size, BUCKET_SIZES)
+    else:
+        sess, ops = get_session_and_ops(batch_size=batch_size, num_point=NUM_POINT)
+
+    def load_batch(batch_idx):
+        start_idx = batch_idx * batch_size
+        end_idx = min(len(TEST_DATASET), (batch_idx+1) * batch_size)
+        if FLAGS.variable_points:
+            return get_packed_batch(TEST_DATASET, test_idxs, start_idx, end_idx,
+                NUM_CHANNEL, from_rgb_detection=True)
+        return get_batch(TEST_DATASET, test_idxs, start_idx, end_idx,
+            NUM_POINT, NUM_CHANNEL, from_rgb_detection=True)
+
+    # A shard worker only runs every num_shards-th batch
+    batch_idxs = [b for b in range(num_batches) if shard_util.owns(FLAGS, b)]
+    writer = DetectionWriter(result_dir, TEST_DATASET.id_list,
+        TEST_DATASET.type_list, TEST_DATASET.box2d_list)
+    for k, batch in enumerate(prefetch(lambda k: load_batch(batch_idxs[k]),
+                                       len(batch_idxs))):
+        batch_idx = batch_idxs[k]
         print('batch idx: %d' % (batch_idx))
         start_idx = batch_idx * batch_size
         end_idx = min(len(TEST_DATASET), (batch_idx+1) * batch_size)
         cur_batch_size = end_idx - start_idx
 
-        batch_data, batch_rot_angle, batch_rgb_prob, batch_one_hot_vec = \
-            get_batch(TEST_DATASET, test_idxs, start_idx, end_idx,
-                NUM_POINT, NUM_CHANNEL, from_rgb_detection=True)
-        batch_data_to_feed[0:cur_batch_size,...] = batch_data
-        batch_one_hot_to_feed[0:cur_batch_size,:] = batch_one_hot_vec
-
-        # Run one batch inference
-	batch_output, batch_center_pred, \
-        batch_hclass_pred, batch_hres_pred, \
-        batch_sclass_pred, batch_sres_pred, batch_scores = \
-            inference(sess, ops, batch_data_to_feed,
-                batch_one_hot_to_feed, batch_size=batch_size)
-	
+        if FLAGS.variable_points:
+            batch_data, batch_row_splits, batch_rot_angle, \
+            batch_rgb_prob, batch_one_hot_vec = batch
+            batch_output, batch_choice, batch_center_pred, \
+            batch_hclass_pred, batch_hres_pred, \
+            batch_sclass_pred, batch_sres_pred, batch_scores = \
+                inference_packed(sess, bucket_ops, batch_data, batch_row_splits,
+                    batch_one_hot_vec, batch_size=batch_size)
+            # Keep the points the predictions refer to
+            batch_data = [ps[c] for ps, c in \
+                zip(unpack_point_sets(batch_data, batch_row_splits), batch_choice)]
+        else:
+            batch_data, batch_rot_angle, batch_rgb_prob, batch_one_hot_vec = batch
+            batch_data_to_feed[0:cur_batch_size,...] = batch_data
+            batch_one_hot_to_feed[0:cur_batch_size,:] = batch_one_hot_vec
+
+            # Run one batch inference
+            batch_output, batch_center_pred, \
+            batch_hclass_pred, batch_hres_pred, \
+            batch_sclass_pred, batch_sres_pred, batch_scores = \
+                inference(sess, ops, batch_data_to_feed,
+                    batch_one_hot_to_feed, batch_size=batch_size)
+
+        # 2D RGB detection scores are used as the box scores
+        writer.put(start_idx, batch_center_pred, batch_hclass_pred,
+            batch_hres_pred, batch_sclass_pred, batch_sres_pred,
+            batch_rot_angle, batch_rgb_prob)
         for i in range(cur_batch_size):
-            ps_list.append(batch_data[i,...])
-            segp_list.append(batch_output[i,...])
+            ps_list.append(batch_data[i])
+            segp_list.append(batch_output[i])
             center_list.append(batch_center_pred[i,:])
             heading_cls_list.append(batch_hclass_pred[i])
             heading_res_list.append(batch_hres_pred[i])
@@ -259,6 +673,15 @@ def test_from_rgb_detection(output_filename, result_dir=None):
             #score_list.append(batch_scores[i])
             score_list.append(batch_rgb_prob[i]) # 2D RGB detection score
             onehot_list.append(batch_one_hot_vec[i])
+            frustum_idx_list.append(start_idx+i)
+
+    if shard_util.is_worker(FLAGS):
+        writer.close()
+        shard_util.write_result(FLAGS, shard_result(RGB_DETECTION_RESULTS,
+            [ps_list, segp_list, center_list, heading_cls_list,
+             heading_res_list, size_cls_list, size_res_list, rot_angle_list,
+             score_list, onehot_list], frustum_idx_list))
+        return
 
     if FLAGS.dump_result:
         with open(output_filename, 'wp') as fp:
@@ -273,25 +696,27 @@ def test_from_rgb_detection(output_filename, result_dir=None):
             pickle.dump(score_list, fp)
             pickle.dump(onehot_list, fp)
 
-    # Write detection results for KITTI evaluation
+    # Finish writing detection results for KITTI evaluation
     print('Number of point clouds: %d' % (len(ps_list)))
-    write_detection_results(result_dir, TEST_DATASET.id_list,
-        TEST_DATASET.type_list, TEST_DATASET.box2d_list,
-        center_list, heading_cls_list, heading_res_list,
-        size_cls_list, size_res_list, rot_angle_list, score_list)
-    # Make sure for each frame (no matter if we have measurment for that frame),
-    # there is a TXT file
-    output_dir = os.path.join(result_dir, 'data')
-    if FLAGS.idx_path is not None:
-        to_fill_filename_list = [line.rstrip()+'.txt' \
-            for line in open(FLAGS.idx_path)]
-        fill_files(output_dir, to_fill_filename_list)
+    writer.close()
+    fill_frames(result_dir)
+
+    if FLAGS.eval_label_dir is not None:
+        evaluate_detection_results(center_list, heading_cls_list,
+            heading_res_list, size_cls_list, size_res_list,
+            rot_angle_list, score_list)
 
 def test(output_filename, result_dir=None):
     ''' Test frustum pointnets with GT 2D boxes.
     Write test results to KITTI format label files.
-    todo (rqi): support variable number of points.
+    With --variable_points, frustums keep their own number of points.
     '''
+    if shard_util.is_coordinator(FLAGS):
+        results = test_shards(output_filename, result_dir, TEST_RESULTS,
+            len(TEST_DATASET)//BATCH_SIZE)
+        print("Segmentation accuracy: %f" % \
+            (results['correct_cnt'] / float(results['total_point'])))
+        return
     ps_list = []
     seg_list = []
     segp_list = []
@@ -302,36 +727,72 @@ def test(output_filename, result_dir=None):
     size_res_list = []
     rot_angle_list = []
     score_list = []
+    frustum_idx_list = []
 
     test_idxs = np.arange(0, len(TEST_DATASET))
     batch_size = BATCH_SIZE
     num_batches = len(TEST_DATASET)/batch_size
 
-    sess, ops = get_session_and_ops(batch_size=batch_size, num_point=NUM_POINT)
+    if FLAGS.variable_points:
+        sess, bucket_ops = get_session_and_bucket_ops(batch_size, BUCKET_SIZES)
+    else:
+        sess, ops = get_session_and_ops(batch_size=batch_size, num_point=NUM_POINT)
     correct_cnt = 0
-    for batch_idx in range(num_batches):
-        print('batch idx: %d' % (batch_idx))
+    total_point = 0
+
+    def load_batch(batch_idx):
         start_idx = batch_idx * batch_size
         end_idx = (batch_idx+1) * batch_size
+        if FLAGS.variable_points:
+            return get_packed_batch(TEST_DATASET, test_idxs, start_idx, end_idx,
+                NUM_CHANNEL)
+        return get_batch(TEST_DATASET, test_idxs, start_idx, end_idx,
+            NUM_POINT, NUM_CHANNEL)
+
+    # A shard worker only runs every num_shards-th batch
+    batch_idxs = [b for b in range(num_batches) if shard_util.owns(FLAGS, b)]
+    writer = DetectionWriter(result_dir, TEST_DATASET.id_list,
+        TEST_DATASET.type_list, TEST_DATASET.box2d_list)
+    for k, batch in enumerate(prefetch(lambda k: load_batch(batch_idxs[k]),
+                                       len(batch_idxs))):
+        batch_idx = batch_idxs[k]
+        print('batch idx: %d' % (batch_idx))
+        start_idx = batch_idx * batch_size
 
-        batch_data, batch_label, batch_center, \
-        batch_hclass, batch_hres, batch_sclass, batch_sres, \
-        batch_rot_angle, batch_one_hot_vec = \
-            get_batch(TEST_DATASET, test_idxs, start_idx, end_idx,
-                NUM_POINT, NUM_CHANNEL)
-
-	batch_output, batch_center_pred, \
-        batch_hclass_pred, batch_hres_pred, \
-        batch_sclass_pred, batch_sres_pred, batch_scores = \
-            inference(sess, ops, batch_data,
-                batch_one_hot_vec, batch_size=batch_size)
-
-        correct_cnt += np.sum(batch_output==batch_label)
-	
-        for i in range(batch_output.shape[0]):
-            ps_list.append(batch_data[i,...])
-            seg_list.append(batch_label[i,...])
-            segp_list.append(batch_output[i,...])
+        if FLAGS.variable_points:
+            batch_data, batch_row_splits, batch_label, batch_center, \
+            batch_hclass, batch_hres, batch_sclass, batch_sres, \
+            batch_rot_angle, batch_one_hot_vec = batch
+            batch_output, batch_choice, batch_center_pred, \
+            batch_hclass_pred, batch_hres_pred, \
+            batch_sclass_pred, batch_sres_pred, batch_scores = \
+                inference_packed(sess, bucket_ops, batch_data, batch_row_splits,
+                    batch_one_hot_vec, batch_size=batch_size)
+            # Keep the points (and labels) the predictions refer to
+            batch_data = [ps[c] for ps, c in \
+                zip(unpack_point_sets(batch_data, batch_row_splits), batch_choice)]
+            batch_label = [seg[c] for seg, c in \
+                zip(unpack_point_sets(batch_label, batch_row_splits), batch_choice)]
+        else:
+            batch_data, batch_label, batch_center, \
+            batch_hclass, batch_hres, batch_sclass, batch_sres, \
+            batch_rot_angle, batch_one_hot_vec = batch
+
+            batch_output, batch_center_pred, \
+            batch_hclass_pred, batch_hres_pred, \
+            batch_sclass_pred, batch_sres_pred, batch_scores = \
+                inference(sess, ops, batch_data,
+                    batch_one_hot_vec, batch_size=batch_size)
+
+        writer.put(start_idx, batch_center_pred, batch_hclass_pred,
+            batch_hres_pred, batch_sclass_pred, batch_sres_pred,
+            batch_rot_angle, batch_scores)
+        for i in range(len(batch_output)):
+            correct_cnt += np.sum(batch_output[i]==batch_label[i])
+            total_point += len(batch_label[i])
+            ps_list.append(batch_data[i])
+            seg_list.append(batch_label[i])
+            segp_list.append(batch_output[i])
             center_list.append(batch_center_pred[i,:])
             heading_cls_list.append(batch_hclass_pred[i])
             heading_res_list.append(batch_hres_pred[i])
@@ -339,9 +800,20 @@ def test(output_filename, result_dir=None):
             size_res_list.append(batch_sres_pred[i,:])
             rot_angle_list.append(batch_rot_angle[i])
             score_list.append(batch_scores[i])
+            frustum_idx_list.append(start_idx+i)
 
-    print("Segmentation accuracy: %f" % \
-        (correct_cnt / float(batch_size*num_batches*NUM_POINT)))
+    if total_point > 0:
+        print("Segmentation accuracy: %f" % \
+            (correct_cnt / float(total_point)))
+
+    if shard_util.is_worker(FLAGS):
+        writer.close()
+        shard_util.write_result(FLAGS, shard_result(TEST_RESULTS,
+            [ps_list, seg_list, segp_list, center_list, heading_cls_list,
+             heading_res_list, size_cls_list, size_res_list, rot_angle_list,
+             score_list], frustum_idx_list,
+            correct_cnt=correct_cnt, total_point=total_point))
+        return
 
     if FLAGS.dump_result:
         with open(output_filename, 'wp') as fp:
@@ -356,15 +828,42 @@ def test(output_filename, result_dir=None):
             pickle.dump(rot_angle_list, fp)
             pickle.dump(score_list, fp)
 
-    # Write detection results for KITTI evaluation
-    write_detection_results(result_dir, TEST_DATASET.id_list,
-        TEST_DATASET.type_list, TEST_DATASET.box2d_list, center_list,
-        heading_cls_list, heading_res_list,
-        size_cls_list, size_res_list, rot_angle_list, score_list)
+    # Finish writing detection results for KITTI evaluation
+    writer.close()
 
+    if FLAGS.eval_label_dir is not None:
+        evaluate_detection_results(center_list, heading_cls_list,
+            heading_res_list, size_cls_list, size_res_list,
+            rot_angle_list, score_list)
+
+
+def export_graph(filename):
+    ''' Write the model as a frozen inference graph, with --variable_points
+    the graphs of all buckets with the bucket size appended to their keys.
+    '''
+    inputs, outputs = {}, {}
+    if FLAGS.variable_points:
+        sess, bucket_ops = get_session_and_bucket_ops(BATCH_SIZE, BUCKET_SIZES)
+        for size in bucket_ops:
+            bucket_inputs, bucket_outputs = \
+                frozen_tensors(bucket_ops[size], '_%d' % (size))
+            inputs.update(bucket_inputs)
+            outputs.update(bucket_outputs)
+        is_training_pl = bucket_ops[size]['is_training_pl']
+    else:
+        sess, ops = get_session_and_ops(BATCH_SIZE, NUM_POINT)
+        inputs, outputs = frozen_tensors(ops)
+        is_training_pl = ops['is_training_pl']
+    _, stats = freeze_util.export_frozen_graph(sess, inputs, outputs,
+        is_training_pl, filename)
+    print('Frozen graph written to ' + freeze_util.format_stats(filename, stats))
 
 if __name__=='__main__':
-    if FLAGS.from_rgb_detection:
-        test_from_rgb_detection(FLAGS.output+'.pickle', FLAGS.output)
+    # Shard workers return their results to the coordinator, which writes them
+    result_dir = None if shard_util.is_worker(FLAGS) else FLAGS.output
+    if FLAGS.export_graph is not None:
+        export_graph(FLAGS.export_graph)
+    elif FLAGS.from_rgb_detection:
+        test_from_rgb_detection(FLAGS.output+'.pickle', result_dir)
     else:
-        test(FLAGS.output+'.pickle', FLAGS.output)
+        test(FLAGS.output+'.pickle', result_dir)
@@ -15,6 +15,8 @@ from datetime import datetime
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, 'kitti_eval'))
+import evaluate_object_3d
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--gpu', type=int, default=0, help='GPU to use [default: GPU 0]')
@@ -32,6 +34,9 @@ parser.add_argument('--decay_step', type=int, default=200000, help='Decay step f
 parser.add_argument('--decay_rate', type=float, default=0.7, help='Decay rate for lr decay [default: 0.7]')
 parser.add_argument('--no_intensity', action='store_true', help='Only use XYZ for training')
 parser.add_argument('--restore_model_path', default=None, help='Restore model path e.g. log/model.ckpt [default: None]')
+parser.add_argument('--eval_ap_every', type=int, default=0, help='Compute the KITTI 2D/BEV/3D AP of the validation frustums every N epochs, 0 to disable [default: 0]')
+parser.add_argument('--eval_label_dir', default=os.path.join(ROOT_DIR, 'dataset/KITTI/object/training/label_2'), help='KITTI label_2 directory for --eval_ap_every [default: dataset/KITTI/object/training/label_2]')
+parser.add_argument('--eval_workers', type=int, default=None, help='Processes used by the AP evaluation [default: number of CPUs]')
 FLAGS = parser.parse_args()
 
 MODEL_PATH = None
@@ -297,6 +302,32 @@ def train_one_epoch(sess, ops, train_writer):
             iou3d_correct_cnt = 0
         
         
+def softmax(x):
+    ''' Numpy function for softmax'''
+    probs = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return probs / np.sum(probs, axis=-1, keepdims=True)
+
+def eval_ap(center_list, heading_cls_list, heading_res_list,
+            size_cls_list, size_res_list, rot_angle_list, score_list):
+    ''' KITTI AP of the validation frustums (GT 2D boxes), computed in-process
+    with the predictions in memory. '''
+    num = len(center_list)
+    boxes = [provider.from_prediction_to_label_format(center_list[i],
+        heading_cls_list[i], heading_res_list[i], size_cls_list[i],
+        size_res_list[i], rot_angle_list[i]) for i in range(num)]
+    h,w,l,tx,ty,tz,ry = [np.array(x) for x in zip(*boxes)]
+    detections = evaluate_object_3d.detections_from_arrays(
+        TEST_DATASET.id_list[0:num], TEST_DATASET.type_list[0:num],
+        TEST_DATASET.box2d_list[0:num], h, w, l, tx, ty, tz, ry, score_list)
+    frame_ids = sorted(detections.keys())
+    groundtruth = evaluate_object_3d.load_groundtruth(FLAGS.eval_label_dir,
+        frame_ids, FLAGS.eval_workers)
+    results = evaluate_object_3d.evaluate(groundtruth, detections, frame_ids,
+        FLAGS.eval_workers)
+    for line in evaluate_object_3d.format_results(results).split('\n'):
+        log_string('eval ' + line)
+    return results
+
 def eval_one_epoch(sess, ops, test_writer):
     ''' Simple evaluation for one epoch on the frustum dataset.
     ops is dict mapping from string to tf ops """
@@ -317,6 +348,11 @@ def eval_one_epoch(sess, ops, test_writer):
     iou2ds_sum = 0
     iou3ds_sum = 0
     iou3d_correct_cnt = 0
+    # Box predictions for the AP evaluation
+    compute_ap = FLAGS.eval_ap_every > 0 and \
+        (EPOCH_CNT+1) % FLAGS.eval_ap_every == 0
+    box_lists = [[] for _ in range(7)]
+    ep = ops['end_points']
    
     # Simple evaluation with batches 
     for batch_idx in range(num_batches):
@@ -340,14 +376,32 @@ def eval_one_epoch(sess, ops, test_writer):
                      ops['size_residual_label_pl']: batch_sres,
                      ops['is_training_pl']: is_training}
 
-        summary, step, loss_val, logits_val, iou2ds, iou3ds = \
+        summary, step, loss_val, logits_val, iou2ds, iou3ds, \
+        centers_val, heading_scores_val, heading_residuals_val, \
+        size_scores_val, size_residuals_val = \
             sess.run([ops['merged'], ops['step'],
                 ops['loss'], ops['logits'], 
-                ops['end_points']['iou2ds'], ops['end_points']['iou3ds']],
+                ep['iou2ds'], ep['iou3ds'], ep['center'],
+                ep['heading_scores'], ep['heading_residuals'],
+                ep['size_scores'], ep['size_residuals']],
                 feed_dict=feed_dict)
         test_writer.add_summary(summary, step)
 
         preds_val = np.argmax(logits_val, 2)
+        if compute_ap:
+            # Box scores as in test.py
+            mask_prob = np.sum(softmax(logits_val)[:,:,1] * preds_val, 1) / \
+                np.maximum(np.sum(preds_val, 1), 1)
+            scores = np.log(mask_prob) + \
+                np.log(np.max(softmax(heading_scores_val), 1)) + \
+                np.log(np.max(softmax(size_scores_val), 1))
+            hclass = np.argmax(heading_scores_val, 1)
+            sclass = np.argmax(size_scores_val, 1)
+            rows = np.arange(BATCH_SIZE)
+            for box_list, values in zip(box_lists, [centers_val, hclass,
+                    heading_residuals_val[rows, hclass], sclass,
+                    size_residuals_val[rows, sclass], batch_rot_angle, scores]):
+                box_list.extend(values)
         correct = np.sum(preds_val == batch_label)
         total_correct += correct
         total_seen += (BATCH_SIZE*NUM_POINT)
@@ -381,6 +435,8 @@ def eval_one_epoch(sess, ops, test_writer):
             float(num_batches*BATCH_SIZE)))
     log_string('eval box estimation accuracy (IoU=0.7): %f' % \
         (float(iou3d_correct_cnt)/float(num_batches*BATCH_SIZE)))
+    if compute_ap:
+        eval_ap(*box_lists)
          
     EPOCH_CNT += 1
 
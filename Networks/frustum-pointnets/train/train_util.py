@@ -87,3 +87,68 @@ def get_batch_from_rgb_detection(dataset, idxs, start_idx, end_idx,
         return batch_data, batch_rot_angle, batch_prob
 
 
+
+def get_packed_batch(dataset, idxs, start_idx, end_idx, num_channel,
+                     from_rgb_detection=False):
+    ''' Prepare a batch of variable-length frustums (dataset built with
+    npoints=None). The points of all frustums are concatenated, frustum i
+    owning rows row_splits[i]:row_splits[i+1].
+
+    Input: same as get_batch, without num_point
+    Output:
+        batch_data: (sum of N_i, num_channel) points, then batch_row_splits
+        (B+1,) and the other outputs of get_batch; batch_label is packed
+        like batch_data
+    '''
+    bsize = end_idx-start_idx
+    point_sets = []
+    labels = []
+    others = []
+    for i in range(bsize):
+        element = dataset[idxs[i+start_idx]]
+        point_sets.append(element[0][:,0:num_channel])
+        if from_rgb_detection:
+            others.append(element[1:])
+        else:
+            labels.append(element[1])
+            others.append(element[2:])
+    batch_data, batch_row_splits = pack_point_sets(point_sets)
+    # Stack the fixed-size outputs (center, classes, residuals, angle, ...)
+    batch_others = [np.array([o[k] for o in others]) for k in range(len(others[0]))]
+    if from_rgb_detection:
+        return [batch_data, batch_row_splits] + batch_others
+    batch_label = np.concatenate(labels).astype(np.int32)
+    return [batch_data, batch_row_splits, batch_label] + batch_others
+
+def pack_point_sets(point_sets):
+    ''' Concatenate a list of (N_i,C) arrays.
+    Output: (sum of N_i,C) array and (len+1,) int row splits. '''
+    row_splits = np.zeros((len(point_sets)+1,), dtype=np.int64)
+    row_splits[1:] = np.cumsum([ps.shape[0] for ps in point_sets])
+    return np.concatenate(point_sets, axis=0), row_splits
+
+def unpack_point_sets(packed, row_splits):
+    ''' Inverse of pack_point_sets, returns a list of views. '''
+    return [packed[row_splits[i]:row_splits[i+1]] \
+        for i in range(len(row_splits)-1)]
+
+def bucket_of(num_point, bucket_sizes):
+    ''' Smallest bucket holding num_point points, or the largest bucket. '''
+    for size in sorted(bucket_sizes):
+        if num_point <= size:
+            return size
+    return max(bucket_sizes)
+
+def resample_to_bucket(point_set, size):
+    ''' Fit a (N,C) frustum to exactly size points.
+    All points are kept first, in order, and padded by resampling when
+    N < size; N > size points are subsampled without replacement.
+    Output: (size,C) array and the (size,) indices of the chosen points.
+    '''
+    n = point_set.shape[0]
+    if n > size:
+        choice = np.random.choice(n, size, replace=False)
+    else:
+        choice = np.concatenate([np.arange(n),
+            np.random.choice(n, size-n, replace=True)])
+    return point_set[choice, :], choice
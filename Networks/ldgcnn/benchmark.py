@@ -0,0 +1,115 @@
+"""
+Benchmark LDGCNN classification latency and throughput on synthetic point
+clouds. The feature extractor and the classifier are chained in one graph,
+with the same zero padding of the global feature as evaluate.py.
+No dataset is needed. Weights are randomly initialized unless --model_path
+(a log dir such as log_new) is given.
+LDGCNN has no separate limited delayed-aggregation model, so only baseline
+and full exist.
+
+"""
+import tensorflow as tf
+import numpy as np
+import argparse
+import importlib
+import os
+import sys
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, 'models'))
+sys.path.append(os.path.join(BASE_DIR, 'utils'))
+sys.path.append(os.path.join(BASE_DIR, '../../Benchmark'))
+import bench_util
+import freeze_util
+import graph_cache
+
+# Feature extractor of each aggregation variant, as in launcher.py
+VARIANT_MODELS = {
+    'full' : 'ldgcnn',
+    'baseline' : 'ldgcnn_baseline'
+}
+
+parser = argparse.ArgumentParser()
+bench_util.add_benchmark_args(parser, VARIANT_MODELS.keys(), batch_size=16, num_point=1024)
+parser.add_argument('--model_fc', default='ldgcnn_classifier', help='Classifier model name [default: ldgcnn_classifier]')
+parser.add_argument('--num_feature', type=int, default=3072, help='Input size of the classifier [default: 3072]')
+graph_cache.add_cache_args(parser)
+
+def build_predictor(variant, batch_size, num_point, model_path=None, gpu=0,
+                    model_fc='ldgcnn_classifier', num_feature=3072, cache_dir=None,
+                    precision=None, calibration=(), cpu=False):
+    ''' Build the graph of one variant, or load it from the graph cache in
+        cache_dir, and return predict(points) -> {'logits': Bx40}.
+        precision and calibration as in quant_util.py. The feature
+        extractor and the classifier are frozen and quantized together. '''
+    model_cnn = VARIANT_MODELS[variant]
+    MODEL_CNN = importlib.import_module(model_cnn)
+    MODEL_FC = importlib.import_module(model_fc)
+    cache_file = graph_cache.cache_file(cache_dir, 'ldgcnn', variant, batch_size, num_point,
+        extra={'model_fc': model_fc, 'num_feature': num_feature},
+        sources=[os.path.join(BASE_DIR, 'models'), os.path.join(BASE_DIR, 'utils'),
+                 os.path.abspath(__file__)])
+
+    def build():
+        pointclouds_pl, _ = MODEL_CNN.placeholder_inputs(batch_size, num_point)
+        is_training_pl = tf.placeholder(tf.bool, shape=())
+        _, layers = MODEL_CNN.get_model(pointclouds_pl, is_training_pl)
+        # Pad the global feature with zeros to the classifier input size
+        global_feature = layers['global_feature']
+        features = tf.pad(global_feature,
+            [[0, 0], [0, num_feature - global_feature.get_shape()[-1].value]])
+        pred, _ = MODEL_FC.get_model(features, is_training_pl)
+        return {'pointclouds_pl': pointclouds_pl, 'is_training_pl': is_training_pl, 'pred': pred}
+
+    with tf.Graph().as_default():
+        with tf.device('/gpu:'+str(gpu)):
+            # the two savers are made here, they are not part of the cache
+            ops, _ = graph_cache.cached_graph(cache_file, build, saver=False)
+            # Variables before #43 belong to the feature extractor.
+            variables = tf.global_variables()
+            saver_cnn = tf.train.Saver(variables[0:44])
+            saver_fc = tf.train.Saver(variables[44:])
+
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        config.log_device_placement = False
+        sess = tf.Session(config=config)
+        if model_path is not None:
+            saver_cnn.restore(sess, os.path.join(model_path, model_cnn+'_model.ckpt'))
+            saver_fc.restore(sess, os.path.join(model_path, model_fc+'_model.ckpt'))
+            print("Model restored.")
+        else:
+            sess.run(tf.global_variables_initializer())
+
+    if precision is not None:
+        frozen_sess, inputs, outputs, _ = freeze_util.quantized_session(sess,
+            {'pointclouds_pl': ops['pointclouds_pl']}, {'pred': ops['pred']},
+            ops['is_training_pl'], precision, [{'pointclouds_pl': b} for b in calibration],
+            cpu, gpu)
+        sess.close()
+        # is_training_pl is constant False in the frozen graph
+        sess, ops = frozen_sess, dict(inputs, **outputs)
+
+    def predict(points, options=None, run_metadata=None):
+        feed_dict = {ops['pointclouds_pl']: points}
+        if 'is_training_pl' in ops:
+            feed_dict[ops['is_training_pl']] = False
+        return {'logits': sess.run(ops['pred'], feed_dict=feed_dict,
+            options=options, run_metadata=run_metadata)}
+    return predict
+
+def predictor_from_flags(FLAGS):
+    ''' build_predictor from flags parsed by parser, as used by Serving/worker.py. '''
+    return build_predictor(FLAGS.variant, FLAGS.batch_size, FLAGS.num_point,
+        FLAGS.model_path, FLAGS.gpu, FLAGS.model_fc, FLAGS.num_feature,
+        graph_cache.cache_dir(FLAGS), FLAGS.precision, bench_util.calibration_batches(FLAGS),
+        FLAGS.cpu)
+
+def main():
+    FLAGS = parser.parse_args()
+    predict = predictor_from_flags(FLAGS)
+    bench_util.run_benchmark('ldgcnn', FLAGS, predict, num_channel=3)
+
+if __name__=='__main__':
+    main()
@@ -15,6 +15,7 @@ import importlib
 import os
 import scipy.misc
 import sys
+import h5py
 from matplotlib import pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,8 +23,12 @@ sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(BASE_DIR, 'models'))
 sys.path.append(os.path.join(BASE_DIR, 'utils'))
 sys.path.append(os.path.join(BASE_DIR, 'VisionProcess'))
+sys.path.append(os.path.join(BASE_DIR, '../../Benchmark'))
 from PlotClass import PlotClass
 import provider
+import freeze_util
+import graph_cache
+import shard_util
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--log_dir', default='log_new', help='Log dir [default: log]')
@@ -34,6 +39,10 @@ parser.add_argument('--batch_size', type=int, default= 16, help='Batch Size duri
 parser.add_argument('--num_point', type=int, default=1024, help='Point Number [256/512/1024/2048] [default: 1024]')
 parser.add_argument('--num_feature', type=int, default=3072, help='Point Number [256/512/1024/2048] [default: 1024]')
 parser.add_argument('--dump_dir', default='dump', help='dump folder path [dump]')
+parser.add_argument('--export_graph', default=None, help='Write the restored feature extractor and classifier as one frozen inference graph with batch norm folded to this file and exit [default: None]')
+parser.add_argument('--frozen_graph', default=None, help='Evaluate the frozen graph written by --export_graph instead of building the models [default: None]')
+graph_cache.add_cache_args(parser)
+shard_util.add_shard_args(parser)
 FLAGS = parser.parse_args()
 
 NAME_MODEL = ''
@@ -63,64 +72,128 @@ TEST_FILES = provider.getDataFiles(\
     os.path.join(BASE_DIR, '../../Datasets/modelnet40_ply_hdf5_2048/test_files.txt'))
 
 is_training = False
+
+def log_string(out_str):
+    LOG_FOUT.write(out_str+'\n')
+    LOG_FOUT.flush()
+    print(out_str)
+
+def num_test_batches():
+    ''' Number of batches evaluated below, from the h5 file headers. '''
+    num_batches = 0
+    for filename in TEST_FILES:
+        with h5py.File(filename, 'r') as f:
+            num_batches += f['data'].shape[0] // BATCH_SIZE
+    return num_batches
+
+def log_metrics(counts):
+    ''' Log the metrics of the counts of the evaluated batches. '''
+    if counts['seen'] == 0:
+        log_string('no batches evaluated')
+        return
+    log_string('eval mean loss: %f' % (counts['loss_sum'] / float(counts['seen'])))
+    log_string('eval accuracy: %f' % (counts['correct'] / float(counts['seen'])))
+    class_accuracies = counts['correct_class'] / counts['seen_class'].astype(np.float)
+    log_string('eval avg class acc: %f' % (np.mean(class_accuracies)))
+    for i, name in enumerate(SHAPE_NAMES):
+        log_string('%10s:\t%0.3f' % (name, class_accuracies[i]))
+
+if shard_util.is_coordinator(FLAGS) and FLAGS.export_graph is None:
+    # Evaluate the shards in worker processes, each with a dump dir of its
+    # own, and merge their counts; the coordinator builds no graph.
+    counts = shard_util.merge(shard_util.run_shards(FLAGS, DUMP_DIR, num_test_batches(),
+        lambda i: ['--dump_dir', os.path.join(DUMP_DIR, 'shard_%d' % i)]))
+    log_string('Merged %d shards.' % FLAGS.num_shards)
+    with open(os.path.join(DUMP_DIR, 'pred_label.txt'), 'w') as fout:
+        for _, lines in sorted(counts['pred_label']):
+            fout.writelines(lines)
+    log_metrics(counts)
+    sys.exit()
 #%%
-with tf.device('/gpu:'+str(GPU_INDEX)):
-    # Input of the MODEL_CNN is the point cloud and label.
-    pointclouds_pl, labels_pl = MODEL_CNN.placeholder_inputs(BATCH_SIZE, NUM_POINT)
-    # Input of the MODEL_FC is the global feature and label.
-    features, labels_features = MODEL_FC.placeholder_inputs(BATCH_SIZE, NUM_FEATURE)
+if FLAGS.frozen_graph is not None:
+    # The frozen graph holds both models, batch norm and dropout are folded
+    # in and is_training is fed but unused.
+    inputs, outputs = freeze_util.load_frozen_graph(FLAGS.frozen_graph)
     is_training_pl = tf.placeholder(tf.bool, shape=())
+    ops = dict(inputs)
+    ops.update(outputs)
+    ops['is_training_pl'] = is_training_pl
+else:
+    def build_graph():
+        # Input of the MODEL_CNN is the point cloud and label.
+        pointclouds_pl, labels_pl = MODEL_CNN.placeholder_inputs(BATCH_SIZE, NUM_POINT)
+        # Input of the MODEL_FC is the global feature and label.
+        features, labels_features = MODEL_FC.placeholder_inputs(BATCH_SIZE, NUM_FEATURE)
+        is_training_pl = tf.placeholder(tf.bool, shape=())
 
-    _, layers = MODEL_CNN.get_model(pointclouds_pl, is_training_pl)
-    pred,_ = MODEL_FC.get_model(features, is_training_pl)
-    loss = MODEL_FC.get_loss(pred, labels_pl)
-    #%%
-with tf.device('/gpu:'+str(GPU_INDEX)):    
-    # Add ops to save and restore all the variables.
-    variable_names = [v.name for v in tf.global_variables()]
-    variables = tf.global_variables()
-    # Variables before #43 belong to the feature extractor.
-    saver_cnn = tf.train.Saver(variables[0:44])
-    # Variables after #43 belong to the classifier.
-    saver_fc = tf.train.Saver(variables[44:])
+        _, layers = MODEL_CNN.get_model(pointclouds_pl, is_training_pl)
+        pred,_ = MODEL_FC.get_model(features, is_training_pl)
+        loss = MODEL_FC.get_loss(pred, labels_pl)
+        return {'pointclouds_pl': pointclouds_pl,
+                'features': features,
+                'labels_pl': labels_pl,
+                'labels_features': labels_features,
+                'is_training_pl': is_training_pl,
+                'global_feature': layers['global_feature'],
+                'pred': pred,
+                'loss': loss}
+
+    # Load the graph from the graph cache, or build it
+    cache_file = graph_cache.cache_file(graph_cache.cache_dir(FLAGS), 'ldgcnn', FLAGS.model_cnn,
+        BATCH_SIZE, NUM_POINT, extra={'model_fc': FLAGS.model_fc, 'num_feature': NUM_FEATURE,
+        'evaluate': True}, sources=[os.path.join(BASE_DIR, 'models'), os.path.join(BASE_DIR, 'utils'),
+        os.path.abspath(__file__)])
+    with tf.device('/gpu:'+str(GPU_INDEX)):
+        ops, _ = graph_cache.cached_graph(cache_file, build_graph, saver=False)
+        #%%
+    with tf.device('/gpu:'+str(GPU_INDEX)):    
+        # Add ops to save and restore all the variables.
+        variable_names = [v.name for v in tf.global_variables()]
+        variables = tf.global_variables()
+        # Variables before #43 belong to the feature extractor.
+        saver_cnn = tf.train.Saver(variables[0:44])
+        # Variables after #43 belong to the classifier.
+        saver_fc = tf.train.Saver(variables[44:])
 #%%
 # Create a session
 config = tf.ConfigProto()
 config.gpu_options.allow_growth = True
 config.allow_soft_placement = True
 config.log_device_placement = True
-
-ops = {'pointclouds_pl': pointclouds_pl,
-       'features': features,
-       'labels_pl': labels_pl,
-       'labels_features': labels_features,
-       'is_training_pl': is_training_pl,
-       'pred': pred,
-       'loss': loss}
-
-def log_string(out_str):
-    LOG_FOUT.write(out_str+'\n')
-    LOG_FOUT.flush()
-    print(out_str)
+shard_util.configure_session(config, FLAGS)
 #%%
 i = 0
 Files = TEST_FILES
 with tf.Session(config=config) as sess:
     with tf.device('/gpu:'+str(GPU_INDEX)):
-        #Restore variables of feature extractor from disk.
-        saver_cnn.restore(sess, os.path.join(LOG_DIR, FLAGS.model_cnn+'_'+ 
-                                             str(NAME_MODEL)+"model.ckpt"))
-        #Restore variables of classifier from disk.
-        saver_fc.restore(sess, os.path.join(LOG_DIR, FLAGS.model_fc+'_'+ 
-                                             str(NAME_MODEL)+"model.ckpt"))
-        log_string("Model restored.")
+        if FLAGS.frozen_graph is not None:
+            log_string("Frozen graph loaded.")
+        else:
+            #Restore variables of feature extractor from disk.
+            saver_cnn.restore(sess, os.path.join(LOG_DIR, FLAGS.model_cnn+'_'+ 
+                                                 str(NAME_MODEL)+"model.ckpt"))
+            #Restore variables of classifier from disk.
+            saver_fc.restore(sess, os.path.join(LOG_DIR, FLAGS.model_fc+'_'+ 
+                                                 str(NAME_MODEL)+"model.ckpt"))
+            log_string("Model restored.")
+        if FLAGS.export_graph is not None:
+            # Both models in one graph: global_feature from the point clouds,
+            # pred and loss from the padded features
+            _, stats = freeze_util.export_frozen_graph(sess,
+                {'pointclouds_pl': ops['pointclouds_pl'], 'features': ops['features'],
+                 'labels_pl': ops['labels_pl']},
+                {'global_feature': ops['global_feature'], 'pred': ops['pred'], 'loss': ops['loss']},
+                ops['is_training_pl'], FLAGS.export_graph)
+            log_string('Frozen graph written to ' + freeze_util.format_stats(FLAGS.export_graph, stats))
+            sys.exit()
         error_cnt = 0
         is_training = False
-        total_correct = 0
-        total_seen = 0
-        loss_sum = 0
-        total_seen_class = [0 for _ in range(NUM_CLASSES)]
-        total_correct_class = [0 for _ in range(NUM_CLASSES)]
+        # Raw counts, merged across shards by summing them
+        counts = {'correct': 0, 'seen': 0, 'loss_sum': 0.0,
+                  'seen_class': np.zeros(NUM_CLASSES, dtype=np.int64),
+                  'correct_class': np.zeros(NUM_CLASSES, dtype=np.int64),
+                  'pred_label': []}
+        unit = -1 # index of the batch over all files
         fout = open(os.path.join(DUMP_DIR, 'pred_label.txt'), 'w')
         global_feature_vec = np.array([])
         label_vec = np.array([])
@@ -136,6 +209,9 @@ with tf.Session(config=config) as sess:
             print(file_size)
             
             for batch_idx in range(num_batches):
+                unit += 1
+                if not shard_util.owns(FLAGS, unit):
+                    continue
                 start_idx = batch_idx * BATCH_SIZE
                 end_idx = (batch_idx+1) * BATCH_SIZE
                 cur_batch_size = end_idx - start_idx
@@ -148,7 +224,7 @@ with tf.Session(config=config) as sess:
                              ops['labels_pl']: current_label[start_idx:end_idx],
                              ops['is_training_pl']: is_training}
                 # Extract the global_feature from the feature extractor.
-                global_feature = np.squeeze(layers['global_feature'].eval(
+                global_feature = np.squeeze(sess.run(ops['global_feature'],
                     feed_dict=feed_dict_cnn))
                 
                 # I find that we can increase the accuracy by about 0.2% after 
@@ -174,20 +250,21 @@ with tf.Session(config=config) as sess:
                 
                 correct = np.sum(pred_val == current_label[start_idx:end_idx])
                 # correct = np.sum(pred_val_topk[:,0:topk] == label_val)
-                total_correct += correct
-                total_seen += cur_batch_size
-                loss_sum += batch_loss_sum
+                counts['correct'] += correct
+                counts['seen'] += cur_batch_size
+                counts['loss_sum'] += batch_loss_sum
     
+                lines = []
                 for i in range(start_idx, end_idx):
                     l = current_label[i]
-                    total_seen_class[l] += 1
-                    total_correct_class[l] += (pred_val[i-start_idx] == l)
-                    fout.write('%d, %d\n' % (pred_val[i-start_idx], l))
+                    counts['seen_class'][l] += 1
+                    counts['correct_class'][l] += (pred_val[i-start_idx] == l)
+                    lines.append('%d, %d\n' % (pred_val[i-start_idx], l))
+                fout.writelines(lines)
+                counts['pred_label'].append((unit, lines))
   
-        log_string('eval mean loss: %f' % (loss_sum / float(total_seen)))
-        log_string('eval accuracy: %f' % (total_correct / float(total_seen)))
-        log_string('eval avg class acc: %f' % (np.mean(np.array(total_correct_class)/np.array(total_seen_class,dtype=np.float))))
-        
-        class_accuracies = np.array(total_correct_class)/np.array(total_seen_class,dtype=np.float)
-        for i, name in enumerate(SHAPE_NAMES):
-            log_string('%10s:\t%0.3f' % (name, class_accuracies[i]))
+        fout.close()
+        # the coordinator logs the metrics of the merged counts of the shards
+        if not shard_util.is_worker(FLAGS):
+            log_metrics(counts)
+        shard_util.write_result(FLAGS, counts)
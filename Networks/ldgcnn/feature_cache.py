@@ -0,0 +1,146 @@
+"""
+Streaming storage of the global features that train.py extracts with the
+trained network and retrains the classifier on.
+
+FeatureWriter preallocates chunked h5 datasets for every sample and writes
+the features batch by batch, so extraction never holds or copies the whole
+set. The number of samples written is stored with the datasets, and an
+interrupted extraction of the same checkpoint (checkpoint_hash) resumes
+from there.
+
+FeatureLoader reads the features once into an array already zero padded to
+the classifier input size. Batches are views of it, or are gathered into
+one reused buffer when shuffled, so no epoch concatenates or reloads the
+files. It refuses files whose extraction is not finished.
+"""
+import os
+import glob
+import hashlib
+import h5py
+import numpy as np
+
+# Rows per h5 chunk, about 3MB of 3072-d float32 features
+CHUNK_ROWS = 256
+
+def checkpoint_hash(model_path):
+    ''' md5 of the contents of a TensorFlow checkpoint, its index and data
+        files (or the file itself for a V1 checkpoint). '''
+    md5 = hashlib.md5()
+    files = sorted(glob.glob(model_path + '.index') + glob.glob(model_path + '.data-*'))
+    for filename in files or [model_path]:
+        md5.update(os.path.basename(filename).encode('utf-8'))
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                md5.update(chunk)
+    return md5.hexdigest()
+
+def num_samples(filename):
+    ''' Number of samples of an h5 data file, without reading the data. '''
+    with h5py.File(filename, 'r') as f:
+        return f['data'].shape[0]
+
+class FeatureWriter(object):
+    ''' Writes num_samples features and labels to the datasets 'data' and
+        'label' of an h5 file, batch by batch.
+        key: identifies what the features are extracted with, e.g. the
+        checkpoint; a partial file is only resumed if its key matches.
+    '''
+    def __init__(self, filename, num_samples, num_feature, key=''):
+        dir_path = os.path.dirname(filename)
+        if dir_path and not os.path.exists(dir_path): os.makedirs(dir_path)
+        self.f = h5py.File(filename, 'a')
+        self.num_samples = num_samples
+        if not self._resumable(num_feature, key):
+            for name in list(self.f.keys()):
+                del self.f[name]
+            chunk_rows = max(1, min(CHUNK_ROWS, num_samples))
+            self.f.create_dataset('data', (num_samples, num_feature), dtype=np.float32,
+                                  chunks=(chunk_rows, num_feature))
+            self.f.create_dataset('label', (num_samples,), dtype=np.int32,
+                                  chunks=(chunk_rows,))
+            self.f.attrs['key'] = key
+            self.f.attrs['num_written'] = 0
+        self.num_written = int(self.f.attrs['num_written'])
+
+    def _resumable(self, num_feature, key):
+        return 'data' in self.f and 'label' in self.f and \
+            'num_written' in self.f.attrs and self.f.attrs.get('key') == key and \
+            self.f['data'].shape == (self.num_samples, num_feature)
+
+    @property
+    def complete(self):
+        return self.num_written >= self.num_samples
+
+    def write(self, features, labels):
+        ''' Append the features (BxF) and labels (B) of the next samples. '''
+        end = self.num_written + features.shape[0]
+        assert end <= self.num_samples, 'more samples than preallocated'
+        self.f['data'][self.num_written:end] = features
+        self.f['label'][self.num_written:end] = labels
+        # the count is updated after the data, so a crash never resumes past it
+        self.f.attrs['num_written'] = end
+        self.f.flush()
+        self.num_written = end
+
+    def close(self):
+        self.f.close()
+
+class FeatureLoader(object):
+    ''' The features and labels of h5 files, zero padded to num_feature
+        columns (the feature size of the files if None). A file whose
+        extraction was interrupted raises a ValueError.
+    '''
+    def __init__(self, filenames, num_feature=None):
+        sizes, widths = [], []
+        for filename in filenames:
+            with h5py.File(filename, 'r') as f:
+                size = f['data'].shape[0]
+                num_written = int(f.attrs.get('num_written', size))
+                if num_written < size:
+                    raise ValueError('%s is incomplete (%d of %d samples), run train.py '
+                                     '--stage extract to finish it' % (filename, num_written, size))
+                sizes.append(size)
+                widths.append(f['data'].shape[1])
+        width = max(widths)
+        num_feature = num_feature or width
+        assert num_feature >= width, 'features wider than the classifier input'
+        self.data = np.zeros((sum(sizes), num_feature), dtype=np.float32)
+        self.label = np.empty(sum(sizes), dtype=np.int32)
+        offset = 0
+        for filename, size, w in zip(filenames, sizes, widths):
+            if size == 0:
+                continue
+            # read straight into the padded array, no intermediate copies
+            with h5py.File(filename, 'r') as f:
+                f['data'].read_direct(self.data, np.s_[0:size, :],
+                                      np.s_[offset:offset+size, 0:w])
+                self.label[offset:offset+size] = f['label'][0:size]
+            offset += size
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def batches(self, batch_size, shuffle=False, pad=False):
+        ''' Yield (data, label, valid) batches of batch_size rows, valid being
+            the number of real samples. The last partial batch is dropped, or
+            with pad filled up with the first samples. The yielded arrays are
+            only valid until the next batch.
+        '''
+        size = len(self)
+        order = np.random.permutation(size) if shuffle else None
+        num_batches = (size + batch_size - 1) // batch_size if pad else size // batch_size
+        data_buf = np.empty((batch_size, self.data.shape[1]), dtype=self.data.dtype)
+        label_buf = np.empty(batch_size, dtype=self.label.dtype)
+        for batch_idx in range(num_batches):
+            start_idx = batch_idx * batch_size
+            end_idx = min(start_idx + batch_size, size)
+            valid = end_idx - start_idx
+            if order is None and valid == batch_size:
+                yield self.data[start_idx:end_idx], self.label[start_idx:end_idx], valid
+                continue
+            idx = order[start_idx:end_idx] if order is not None else np.arange(start_idx, end_idx)
+            if valid < batch_size:
+                idx = np.concatenate([idx, np.arange(batch_size - valid) % size])
+            np.take(self.data, idx, axis=0, out=data_buf)
+            np.take(self.label, idx, out=label_buf)
+            yield data_buf, label_buf, valid
@@ -13,7 +13,6 @@ import socket
 import importlib
 import os
 import sys
-import h5py
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
@@ -21,6 +20,7 @@ sys.path.append(os.path.join(BASE_DIR, 'models'))
 sys.path.append(os.path.join(BASE_DIR, 'utils'))
 sys.path.append(os.path.join(BASE_DIR, 'VisionProcess'))
 import provider
+import feature_cache
 from FileIO import FileIO
 
 parser = argparse.ArgumentParser()
@@ -41,6 +41,8 @@ parser.add_argument('--model_classifier', default='ldgcnn_classifier', help='Mod
 parser.add_argument('--num_feature_classifier', type=int, default= 3072, help='Point Number [1024/1984] [default: 1024]')
 parser.add_argument('--max_epoch_classifier', type=int, default=100, help='Epoch to run [default: 250]')
 parser.add_argument('--optimizer_classifier', default='momentum', help='adam or momentum [default: adam]')
+parser.add_argument('--stage', default='all', choices=['all', 'extract', 'classifier'],
+                    help='all: train, extract the features and retrain the classifier; extract: extract (or resume extracting) the features with the saved model and retrain the classifier; classifier: only retrain the classifier on the extracted features [default: all]')
 
 FLAGS = parser.parse_args()
 
@@ -91,10 +93,10 @@ TEST_FILES = provider.getDataFiles(\
 # Feature files, which are generated after training the whole network.
 # The extracted feature files are utilized to train the classifier.
 path = 'extracted_feature'
-TRAIN_FILES_CLS = provider.getDataFiles( \
-    os.path.join(BASE_DIR, path + '/train_files.txt'))
-TEST_FILES_CLS = provider.getDataFiles(\
-    os.path.join(BASE_DIR, path + '/test_files.txt'))
+TRAIN_FILES_CLS = [os.path.join(BASE_DIR, f) for f in provider.getDataFiles( \
+    os.path.join(BASE_DIR, path + '/train_files.txt'))]
+TEST_FILES_CLS = [os.path.join(BASE_DIR, f) for f in provider.getDataFiles(\
+    os.path.join(BASE_DIR, path + '/test_files.txt'))]
 
 # Print the log contents to a txt file.
 def log_string(out_str):
@@ -315,54 +317,103 @@ def eval_one_epoch(sess, ops, test_writer):
     return total_correct / float(total_seen)  
 
 def save_global_feature(sess, ops, saver, layers):
+    """ Extract the global features of the training and validation sets into
+        the feature files of TRAIN_FILES_CLS and TEST_FILES_CLS, the samples
+        split in order over the files of each list. The features are streamed
+        batch by batch into preallocated h5 datasets, and an interrupted
+        extraction of the same checkpoint resumes where it stopped.
+    """
     feature_name = 'global_feature'
-    file_name_vec = ['train_' + feature_name, 'test_' + feature_name]
+    feature_files_vec = [TRAIN_FILES_CLS, TEST_FILES_CLS]
     Files_vec = [TRAIN_FILES, TEST_FILES]
     #Restore variables that achieves the best validation accuracy from the disk.
-    saver.restore(sess, os.path.join(LOG_DIR, FLAGS.model+
-                                         str(NAME_MODEL)+ "_model.ckpt")) 
+    model_path = os.path.join(LOG_DIR, FLAGS.model+ str(NAME_MODEL)+ "_model.ckpt")
+    saver.restore(sess, model_path) 
     log_string("Model restored.") 
     is_training = False
+    num_feature = layers[feature_name].get_shape()[-1].value
+    # Features of another checkpoint are never resumed.
+    key = '%s %s' % (FLAGS.model, feature_cache.checkpoint_hash(model_path))
     # Extract the features from training set and validation set.
     for r in range(2):
-        file_name = file_name_vec[r]
         Files = Files_vec[r]
-        global_feature_vec = np.array([])
-        label_vec = np.array([])
+        feature_files = feature_files_vec[r]
+        file_sizes = [feature_cache.num_samples(f) for f in Files]
+        # Samples [bounds[j], bounds[j+1]) go to feature file j.
+        total = sum(file_sizes)
+        bounds = [total * j // len(feature_files) for j in range(len(feature_files) + 1)]
+        writers = [feature_cache.FeatureWriter(feature_files[j], bounds[j+1] - bounds[j],
+                                               num_feature, key) for j in range(len(feature_files))]
+        # The files are written in order, resume after the last sample written.
+        num_written = 0
+        for j, writer in enumerate(writers):
+            num_written = bounds[j] + writer.num_written
+            if not writer.complete:
+                break
+        if num_written >= total:
+            log_string('Features already extracted: %s' % ', '.join(feature_files))
+        elif num_written > 0:
+            log_string('Resuming %s at sample %d' % (', '.join(feature_files), num_written))
+        file_start = 0
         for fn in range(len(Files)):
+            file_size = file_sizes[fn]
+            # Skip the files that are already written.
+            if file_start + file_size <= num_written:
+                file_start += file_size
+                continue
             log_string('----'+str(fn)+'----')
             current_data, current_label = provider.loadDataFile(Files[fn])
             current_data = current_data[:,0:NUM_POINT,:]
             current_label = np.squeeze(current_label)
             print(current_data.shape)
             
-            file_size = current_data.shape[0]
-            num_batches = file_size // BATCH_SIZE
-            print(file_size)
-            
-            for batch_idx in range(num_batches):
-                start_idx = batch_idx * BATCH_SIZE
-                end_idx = (batch_idx+1) * BATCH_SIZE
-                # Input the point cloud and labels to the graph.
-                feed_dict = {ops['pointclouds_pl']: current_data[start_idx:end_idx, :, :],
-                             ops['labels_pl']: current_label[start_idx:end_idx],
+            for start_idx in range(num_written - file_start, file_size, BATCH_SIZE):
+                end_idx = min(start_idx + BATCH_SIZE, file_size)
+                batch_data = current_data[start_idx:end_idx, :, :]
+                # The placeholder has a fixed batch size, so the remainder
+                # batch is filled up with copies of its first cloud.
+                if end_idx - start_idx < BATCH_SIZE:
+                    batch_data = np.concatenate([batch_data, np.repeat(
+                        batch_data[0:1], BATCH_SIZE - (end_idx - start_idx), axis=0)])
+                # Input the point cloud to the graph.
+                feed_dict = {ops['pointclouds_pl']: batch_data,
                              ops['is_training_pl']: is_training}
                 # Extract the global features from the input batch data.
-                global_feature = np.squeeze(layers[feature_name].eval(
-                    feed_dict=feed_dict,session=sess))
-                
-                if label_vec.shape[0] == 0:
-                    global_feature_vec = global_feature
-                    label_vec = current_label[start_idx:end_idx]
-                else:
-                    global_feature_vec = np.concatenate([global_feature_vec, global_feature])
-                    label_vec = np.concatenate([label_vec, current_label[start_idx:end_idx]])      
-        # Save all global features to the disk.
-        with h5py.File('extracted_feature/' + file_name + '.h5', 'w') as f:
-            f.create_dataset('data', data=global_feature_vec)
-            f.create_dataset('label', data=label_vec)
-        # file_obj  = FileIO('data/extracted_feature/' + file_name + '.h5')
-        # FileIO.write_h5(file_obj, global_feature_vec, label_vec)
+                global_feature = sess.run(layers[feature_name], feed_dict=feed_dict)
+                global_feature = global_feature.reshape(BATCH_SIZE, -1)
+                # A batch may span two feature files.
+                start, end = file_start + start_idx, file_start + end_idx
+                for j, writer in enumerate(writers):
+                    lo, hi = max(start, bounds[j]), min(end, bounds[j+1])
+                    if lo < hi:
+                        writer.write(global_feature[lo-start:hi-start],
+                                     current_label[lo-file_start:hi-file_start])
+                num_written = end
+            file_start += file_size
+        for writer in writers:
+            writer.close()
+        log_string('Features saved in files: %s' % ', '.join(feature_files))
+
+def extract_global_feature():
+    """ Build the network in inference mode and extract the global features
+        with the checkpoint saved by train(), without training. """
+    with tf.Graph().as_default():
+        with tf.device('/gpu:'+str(GPU_INDEX)):
+            pointclouds_pl, labels_pl = MODEL.placeholder_inputs(BATCH_SIZE, NUM_POINT)
+            is_training_pl = tf.placeholder(tf.bool, shape=())
+            pred, layers = MODEL.get_model(pointclouds_pl, is_training_pl)
+            saver = tf.train.Saver()
+
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        config.log_device_placement = False
+        sess = tf.Session(config=config)
+
+        ops = {'pointclouds_pl': pointclouds_pl,
+               'labels_pl': labels_pl,
+               'is_training_pl': is_training_pl}
+        save_global_feature(sess, ops, saver, layers)
 
 def train_classifier():
     with tf.Graph().as_default():
@@ -434,6 +485,14 @@ def train_classifier():
                'merged': merged,
                'step': batch}
         
+        # Read the extracted features once for all the retrainings. I find
+        # that we can increase the accuracy by about 0.2% after padding zero
+        # vectors, but I do not know the reason.
+        train_features = feature_cache.FeatureLoader(TRAIN_FILES_CLS, NUM_FEATURE_CLS)
+        test_features = feature_cache.FeatureLoader(TEST_FILES_CLS, NUM_FEATURE_CLS)
+        log_string('Features loaded: %d training, %d validation' % (
+            len(train_features), len(test_features)))
+
         # We retrain the classifier three times to see the stable accuracy.
         # It takes much less time to retrain the classifier than to 
         # train the whole network. 
@@ -463,8 +522,8 @@ def train_classifier():
                 log_string('**** EPOCH %03d ****' % (epoch))
                 sys.stdout.flush()
                 
-                train_classifier_one_epoch(sess, ops, train_writer)
-                accuracy, class_accuracy = eval_classifier_one_epoch(sess, ops, test_writer)
+                train_classifier_one_epoch(sess, ops, train_writer, train_features)
+                accuracy, class_accuracy = eval_classifier_one_epoch(sess, ops, test_writer, test_features)
     
                 # Save the variables that achieves the best accuracy to disk.
                 if accuracy > best_accuracy:
@@ -483,86 +542,61 @@ def train_classifier():
         print(class_accuracy_vec) 
                 
 
-def train_classifier_one_epoch(sess, ops, train_writer):
-    """ ops: dict mapping from string to tf ops """
+def train_classifier_one_epoch(sess, ops, train_writer, features):
+    """ ops: dict mapping from string to tf ops
+        features: feature_cache.FeatureLoader of the training set """
     is_training = True
     
-    for fn in range(len(TRAIN_FILES_CLS)):    
-        # Shuffle train files
-        current_data, current_label = provider.loadDataFile(TRAIN_FILES_CLS[fn]) 
-        current_data, current_label, _ = provider.shuffle_data(current_data, np.squeeze(current_label))
-        current_label = np.squeeze(current_label)
-        # I find that we can increase the accuracy by about 0.2% after 
-        # padding zero vectors, but I do not know the reason.
-        current_data = np.concatenate([current_data, np.zeros((
-                current_data.shape[0], NUM_FEATURE_CLS - current_data.shape[1]))], axis  = -1)
-        file_size = current_data.shape[0]
-        num_batches = file_size // BATCH_SIZE
-        
-        total_correct = 0
-        total_seen = 0
-        loss_sum = 0
-        
-        for batch_idx in range(num_batches):
-            start_idx = batch_idx * BATCH_SIZE
-            end_idx = (batch_idx+1) * BATCH_SIZE
-            
-            # Input the features and labels to the graph.
-            feed_dict = {ops['pointclouds_pl']: current_data[start_idx:end_idx,...],
-                         ops['labels_pl']: current_label[start_idx:end_idx],
-                         ops['is_training_pl']: is_training,}
-            # Calculate the loss and classification scores.
-            summary, step, _, loss_val, pred_val = sess.run([ops['merged'], ops['step'],
-                ops['train_op'], ops['loss'], ops['pred']], feed_dict=feed_dict)
-                    
-            train_writer.add_summary(summary, step)
-            pred_val = np.argmax(pred_val, 1)
-            correct = np.sum(pred_val == current_label[start_idx:end_idx])
-            total_correct += correct
-            total_seen += BATCH_SIZE
-            loss_sum += loss_val
-
-def eval_classifier_one_epoch(sess, ops, test_writer):
-    """ ops: dict mapping from string to tf ops """
+    total_correct = 0
+    total_seen = 0
+    loss_sum = 0
+    
+    # Shuffle the features, the batches are gathered from the cached array.
+    for batch_data, batch_label, _ in features.batches(BATCH_SIZE, shuffle=True):
+        # Input the features and labels to the graph.
+        feed_dict = {ops['pointclouds_pl']: batch_data,
+                     ops['labels_pl']: batch_label,
+                     ops['is_training_pl']: is_training,}
+        # Calculate the loss and classification scores.
+        summary, step, _, loss_val, pred_val = sess.run([ops['merged'], ops['step'],
+            ops['train_op'], ops['loss'], ops['pred']], feed_dict=feed_dict)
+                
+        train_writer.add_summary(summary, step)
+        pred_val = np.argmax(pred_val, 1)
+        correct = np.sum(pred_val == batch_label)
+        total_correct += correct
+        total_seen += BATCH_SIZE
+        loss_sum += loss_val
+
+def eval_classifier_one_epoch(sess, ops, test_writer, features):
+    """ ops: dict mapping from string to tf ops
+        features: feature_cache.FeatureLoader of the validation set """
     is_training = False
     total_correct = 0
     total_seen = 0
     loss_sum = 0
     total_seen_class = [0 for _ in range(NUM_CLASSES)]
     total_correct_class = [0 for  _ in range(NUM_CLASSES)]
-    file_size_sum = 0
-    for fn in range(len(TEST_FILES_CLS)):
-        current_data, current_label = provider.loadDataFile(TEST_FILES_CLS[fn])
-        current_label = np.squeeze(current_label)
-        # I find that we can increase the accuracy by about 0.2% after 
-        # padding zero vectors, but I do not know the reason.
-        current_data = np.concatenate([current_data, np.zeros((
-                current_data.shape[0], NUM_FEATURE_CLS - current_data.shape[1]))], axis  = -1)
+    # The remainder batch is padded, only its valid samples are counted.
+    for batch_data, batch_label, valid in features.batches(BATCH_SIZE, pad=True):
+        # Input the features and labels to the graph.
+        feed_dict = {ops['pointclouds_pl']: batch_data,
+                     ops['labels_pl']: batch_label,
+                     ops['is_training_pl']: is_training}
+        # Calculate the loss and classification scores.
+        summary, step, loss_val, pred_val = sess.run([ops['merged'], ops['step'],
+            ops['loss'], ops['pred']], feed_dict=feed_dict)
         
-        file_size = current_data.shape[0]
-        file_size_sum += file_size
-        num_batches = file_size // BATCH_SIZE
-        for batch_idx in range(num_batches):
-            start_idx = batch_idx * BATCH_SIZE
-            end_idx = (batch_idx+1) * BATCH_SIZE
-            # Input the features and labels to the graph.
-            feed_dict = {ops['pointclouds_pl']: current_data[start_idx:end_idx,:],
-                         ops['labels_pl']: current_label[start_idx:end_idx],
-                         ops['is_training_pl']: is_training}
-            # Calculate the loss and classification scores.
-            summary, step, loss_val, pred_val = sess.run([ops['merged'], ops['step'],
-                ops['loss'], ops['pred']], feed_dict=feed_dict)
-            
-            test_writer.add_summary(summary, step)
-            pred_val = np.argmax(pred_val, 1)
-            correct = np.sum(pred_val == current_label[start_idx:end_idx])
-            total_correct += correct
-            total_seen += BATCH_SIZE
-            loss_sum += (loss_val*BATCH_SIZE)
-            for i in range(start_idx, end_idx):
-                l = current_label[i]
-                total_seen_class[l] += 1
-                total_correct_class[l] += (pred_val[i-start_idx] == l)
+        test_writer.add_summary(summary, step)
+        pred_val = np.argmax(pred_val[0:valid], 1)
+        correct = np.sum(pred_val == batch_label[0:valid])
+        total_correct += correct
+        total_seen += valid
+        loss_sum += (loss_val*valid)
+        for i in range(valid):
+            l = batch_label[i]
+            total_seen_class[l] += 1
+            total_correct_class[l] += (pred_val[i] == l)
     accuracy = total_correct / float(total_seen)
     class_accuracy = np.mean(np.array(total_correct_class)/np.array(
             total_seen_class,dtype=np.float))
@@ -570,6 +604,9 @@ def eval_classifier_one_epoch(sess, ops, test_writer):
     
 
 if __name__ == "__main__":
-    train()
+    if FLAGS.stage == 'all':
+        train()
+    elif FLAGS.stage == 'extract':
+        extract_global_feature()
     train_classifier()
     LOG_FOUT.close()
@@ -127,20 +127,26 @@ def batch_distance_matrix_general(A, B):
 
 
 # A shape is (N, P, C)
+# return shape is (N, 1, P), 1 for the points equal to a point before them,
+# the points np.unique(axis=0) would drop
 def find_duplicate_columns(A):
-    N = A.shape[0]
-    P = A.shape[1]
-    indices_duplicated = np.fill((N, 1, P), 1, dtype=np.int32)
-    for idx in range(N):
-        _, indices = np.unique(A[idx], return_index=True, axis=0)
-        indices_duplicated[idx, :, indices] = 0
-    return indices_duplicated
+    point_num = tf.shape(A)[1]
+    # compare one coordinate at a time, (N, P, P) instead of (N, P, P, C)
+    same = None
+    for coord in tf.unstack(A, axis=-1):
+        same_coord = tf.equal(tf.expand_dims(coord, axis=2), tf.expand_dims(coord, axis=1))
+        same = same_coord if same is None else tf.logical_and(same, same_coord)
+    # earlier[i, j] is i < j
+    ones = tf.ones((point_num, point_num))
+    earlier = tf.cast(tf.matrix_band_part(ones, 0, -1) - tf.matrix_band_part(ones, 0, 0), tf.bool)
+    indices_duplicated = tf.reduce_any(tf.logical_and(same, earlier), axis=1, keep_dims=True)
+    return tf.cast(indices_duplicated, tf.int32)
 
 
 # add a big value to duplicate columns
 def prepare_for_unique_top_k(D, A):
-    indices_duplicated = tf.py_func(find_duplicate_columns, [A], tf.int32)
-    D += tf.reduce_max(D)*tf.cast(indices_duplicated, tf.float32)
+    indices_duplicated = find_duplicate_columns(A)
+    return D + tf.reduce_max(D)*tf.cast(indices_duplicated, tf.float32)
 
 
 # return shape is (N, P, K, 2)
@@ -151,7 +157,7 @@ def knn_indices(points, k, sort=True, unique=True):
 
     D = batch_distance_matrix(points)
     if unique:
-        prepare_for_unique_top_k(D, points)
+        D = prepare_for_unique_top_k(D, points)
     distances, point_indices = tf.nn.top_k(-D, k=k, sorted=sort)
     batch_indices = tf.tile(tf.reshape(tf.range(batch_size), (-1, 1, 1, 1)), (1, point_num, k, 1))
     indices = tf.concat([batch_indices, tf.expand_dims(point_indices, axis=3)], axis=3)
@@ -166,7 +172,7 @@ def knn_indices_general(queries, points, k, sort=True, unique=True):
 
     D = batch_distance_matrix_general(queries, points)
     if unique:
-        prepare_for_unique_top_k(D, points)
+        D = prepare_for_unique_top_k(D, points)
     distances, point_indices = tf.nn.top_k(-D, k=k, sorted=sort)  # (N, P, K)
     batch_indices = tf.tile(tf.reshape(tf.range(batch_size), (-1, 1, 1, 1)), (1, point_num, k, 1))
     indices = tf.concat([batch_indices, tf.expand_dims(point_indices, axis=3)], axis=3)
@@ -270,12 +276,15 @@ def curvature_based_sample(nn_pts, k):
     return indices
 
 
+# prob_matrix shape is (N, P), every row sums to 1
+# return shape is (N, size), size indices of every row drawn without
+# replacement, as np.random.choice(P, size, replace=False, p=row)
 def random_choice_2d(size, prob_matrix):
-    n_row = prob_matrix.shape[0]
-    n_col = prob_matrix.shape[1]
-    choices = np.ones((n_row, size), dtype=np.int32)
-    for idx_row in range(n_row):
-        choices[idx_row] = np.random.choice(n_col, size=size, replace=False, p=prob_matrix[idx_row])
+    # Gumbel top-k: the top size of log(p) + Gumbel noise are distributed as
+    # size draws without replacement
+    uniform = tf.random_uniform(tf.shape(prob_matrix), minval=1e-20, maxval=1.0)
+    gumbel = -tf.log(-tf.log(uniform))
+    _, choices = tf.nn.top_k(tf.log(prob_matrix) + gumbel, k=size, sorted=False)
     return choices
 
 def feature_probability_sampling(points, sample_num):
@@ -284,33 +293,37 @@ def feature_probability_sampling(points, sample_num):
 #    feature_average = tf.abs(tf.reduce_mean(tf.square(points), axis=-1)) + 1e-8
     prob_matrix = feature_average / tf.reduce_sum(feature_average, axis=-1, 
                                                   keep_dims=True)
-    point_indices = tf.py_func(random_choice_2d, [sample_num, prob_matrix], tf.int32)
-    point_indices.set_shape([points.get_shape()[0], sample_num])
+    point_indices = random_choice_2d(sample_num, prob_matrix)
     batch_size = tf.shape(points)[0]
     batch_indices = tf.tile(tf.reshape(tf.range(batch_size), (-1, 1, 1)), (1, sample_num, 1))
     indices = tf.concat([batch_indices, tf.expand_dims(point_indices, axis=2)], axis=2)
     return indices
 
-def calc_dist(qrs, pts):
-    return np.sum(np.square(pts - qrs), axis = -1)
-
 def find_farthest_points(pts_batch, K):
-    with tf.device('/cpu:0'):
-        #pts: N*P*C
-        #indices: N*K
-        N = pts_batch.shape[0]
-        farthest_indices = np.zeros((N, K), dtype=np.int32)
-        for n in range(N):
-            pts = pts_batch[n,:,:]
-            farthest_indices[n,0] = np.random.randint(len(pts))
-            distances = calc_dist(pts[farthest_indices[n,0]], pts)
-            for k in range(1, K): 
-                farthest_indices[n, k] = np.argmax(distances)
-                distances = np.minimum(distances, calc_dist(pts[farthest_indices[n,k]], pts))    
-        return farthest_indices
+    #pts: N*P*C
+    #indices: N*K
+    # Farthest point sampling of all clouds at once, in a while loop on the
+    # device of the points: every step picks the point farthest from the
+    # ones picked so far.
+    batch_size = tf.shape(pts_batch)[0]
+    batch_range = tf.range(batch_size)
+
+    def calc_dist(indices):
+        qrs = tf.gather_nd(pts_batch, tf.stack([batch_range, indices], axis=1))  # N*C
+        return tf.reduce_sum(tf.square(pts_batch - tf.expand_dims(qrs, axis=1)), axis=-1)  # N*P
+
+    def body(k, distances, farthest_indices):
+        indices = tf.argmax(distances, axis=1, output_type=tf.int32)
+        return k + 1, tf.minimum(distances, calc_dist(indices)), farthest_indices.write(k, indices)
+
+    first = tf.random_uniform((batch_size,), maxval=tf.shape(pts_batch)[1], dtype=tf.int32)
+    farthest_indices = tf.TensorArray(tf.int32, size=K).write(0, first)
+    _, _, farthest_indices = tf.while_loop(lambda k, distances, farthest_indices: k < K,
+        body, [tf.constant(1), calc_dist(first), farthest_indices], back_prop=False)
+    return tf.transpose(farthest_indices.stack())
 
 def find_farthest_points_batch(points, sample_num):
-    farthest_indices = tf.py_func(find_farthest_points, [points, sample_num], tf.int32)
+    farthest_indices = find_farthest_points(points, sample_num)
     farthest_indices.set_shape([points.get_shape()[0], sample_num])
     batch_size = tf.shape(points)[0]
     batch_indices = tf.tile(tf.reshape(tf.range(batch_size), (-1, 1, 1)), (1, sample_num, 1))
@@ -322,8 +335,7 @@ def inverse_density_sampling(points, k, sample_num):
     distances, _ = tf.nn.top_k(-D, k=k, sorted=False)
     distances_avg = tf.abs(tf.reduce_mean(distances, axis=-1)) + 1e-8
     prob_matrix = distances_avg / tf.reduce_sum(distances_avg, axis=-1, keep_dims=True)
-    point_indices = tf.py_func(random_choice_2d, [sample_num, prob_matrix], tf.int32)
-    point_indices.set_shape([points.get_shape()[0], sample_num])
+    point_indices = random_choice_2d(sample_num, prob_matrix)
 
     batch_size = tf.shape(points)[0]
     batch_indices = tf.tile(tf.reshape(tf.range(batch_size), (-1, 1, 1)), (1, sample_num, 1))
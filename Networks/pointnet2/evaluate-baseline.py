@@ -16,7 +16,12 @@ ROOT_DIR = BASE_DIR
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'models-baseline'))
 sys.path.append(os.path.join(ROOT_DIR, 'utils-baseline'))
+sys.path.append(os.path.join(ROOT_DIR, '../../PowerMeasurement'))
+sys.path.append(os.path.join(ROOT_DIR, '../../Benchmark'))
 import provider
+import energy
+import freeze_util
+import graph_cache
 import modelnet_dataset
 import modelnet_h5_dataset
 
@@ -32,7 +37,14 @@ parser.add_argument('--model_path', default='log-baseline/model_best_acc.ckpt',
 parser.add_argument('--dump_dir', default='dump', help='dump folder path [dump]')
 parser.add_argument('--normal', action='store_true', help='Whether to use normal information')
 parser.add_argument('--num_votes', type=int, default=1, help='Aggregate classification scores from multiple rotations [default: 1]')
+parser.add_argument('--vote_batch', action='store_true', help='Rotate the votes in-graph, stack them along the batch dimension and sum their scores in one forward pass')
+parser.add_argument('--votes_per_run', type=int, default=0, help='Votes stacked per forward pass with --vote_batch, 0 to start with all votes and halve on out-of-memory [default: 0]')
+parser.add_argument('--export_graph', default=None, help='Write the restored model as a frozen inference graph with batch norm folded to this file and exit [default: None]')
+parser.add_argument('--frozen_graph', default=None, help='Evaluate the frozen graph written by --export_graph instead of building the model [default: None]')
 parser.add_argument('--evaluate_epoch', type=int, default=200, help='Num of epoches to evaluate [default: 200]')
+parser.add_argument('--energy_backend', default=None, help='Measure energy per batch with this power backend: auto, jetson or rapl [default: None]')
+parser.add_argument('--energy_warmup', type=int, default=10, help='Num of first batches reported as warm-up energy [default: 10]')
+graph_cache.add_cache_args(parser)
 FLAGS = parser.parse_args()
 
 DATASET_DIR = "../../Datasets/"
@@ -68,45 +80,154 @@ def log_string(out_str):
     LOG_FOUT.flush()
     print(out_str)
 
-def evaluate(num_votes):
-    is_training = False
-     
-    with tf.device('/gpu:'+str(GPU_INDEX)):
-        pointclouds_pl, labels_pl = MODEL.placeholder_inputs(BATCH_SIZE, NUM_POINT)
-        is_training_pl = tf.placeholder(tf.bool, shape=())
+def rotate_votes(point_cloud, angles):
+    ''' Copies of the BxNx3 point_cloud rotated along the up direction by each
+        of the V angles, as provider.rotate_point_cloud_by_angle does, stacked
+        vote by vote along the batch dimension: (V*B)xNx3. '''
+    batch_size, num_point, _ = point_cloud.get_shape().as_list()
+    num_votes = angles.get_shape()[0].value
+    cosval = tf.cos(angles)
+    sinval = tf.sin(angles)
+    zeros = tf.zeros_like(angles)
+    ones = tf.ones_like(angles)
+    rotation_matrix = tf.stack([tf.stack([cosval, zeros, sinval], 1),
+                                tf.stack([zeros, ones, zeros], 1),
+                                tf.stack([-sinval, zeros, cosval], 1)], 1) # Vx3x3
+    # the V matrices side by side, one matmul rotates all votes
+    rotation_matrix = tf.reshape(tf.transpose(rotation_matrix, [1, 0, 2]), [3, 3*num_votes])
+    rotated = tf.matmul(tf.reshape(point_cloud, [-1, 3]), rotation_matrix)
+    rotated = tf.transpose(tf.reshape(rotated, [batch_size, num_point, num_votes, 3]), [2, 0, 1, 3])
+    return tf.reshape(rotated, [num_votes*batch_size, num_point, 3])
 
+def build_graph(votes_per_run=None):
+    ''' Build the graph in the default graph and return its tensors.
+        With votes_per_run, the graph takes the unrotated batch, stacks
+        votes_per_run rotations of it along the batch dimension and returns
+        the weighted sum of their scores. '''
+    pointclouds_pl, labels_pl = MODEL.placeholder_inputs(BATCH_SIZE, NUM_POINT)
+    is_training_pl = tf.placeholder(tf.bool, shape=())
+
+    if votes_per_run is None:
         # simple model
         pred, end_points = MODEL.get_model(pointclouds_pl, is_training_pl)
         MODEL.get_loss(pred, labels_pl, end_points)
-        losses = tf.get_collection('losses')
-        total_loss = tf.add_n(losses, name='total_loss')
-        
-        # Add ops to save and restore all the variables.
-        saver = tf.train.Saver()
-        
-    # Create a session
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True
-    config.allow_soft_placement = True
-    config.log_device_placement = False
-    sess = tf.Session(config=config)
-
-    # Restore variables from disk.
-    saver.restore(sess, MODEL_PATH)
-    log_string("Model restored.")
+    else:
+        angles_pl = tf.placeholder(tf.float32, shape=(votes_per_run))
+        vote_weights_pl = tf.placeholder(tf.float32, shape=(votes_per_run))
+        pred, end_points = MODEL.get_model(rotate_votes(pointclouds_pl, angles_pl), is_training_pl)
+        MODEL.get_loss(pred, tf.tile(labels_pl, [votes_per_run]), end_points)
+        # sum the scores of the votes, padding votes have weight 0
+        pred = tf.reduce_sum(tf.reshape(pred, [votes_per_run, BATCH_SIZE, -1]) * \
+            tf.reshape(vote_weights_pl, [-1, 1, 1]), axis=0)
+    losses = tf.get_collection('losses')
+    total_loss = tf.add_n(losses, name='total_loss')
 
     ops = {'pointclouds_pl': pointclouds_pl,
            'labels_pl': labels_pl,
            'is_training_pl': is_training_pl,
            'pred': pred,
            'loss': total_loss}
+    if votes_per_run is not None:
+        ops.update({'angles_pl': angles_pl,
+                    'vote_weights_pl': vote_weights_pl})
+    return ops
+
+def build_model(votes_per_run=None):
+    ''' Build the graph, or load it from the graph cache, restore the model
+        and return the session and ops. See build_graph for votes_per_run. '''
+    if FLAGS.frozen_graph is not None:
+        return load_frozen_model()
+    is_training = False
+    cache_file = graph_cache.cache_file(graph_cache.cache_dir(FLAGS), 'pointnet2', 'baseline',
+        BATCH_SIZE, NUM_POINT, extra={'model': FLAGS.model, 'votes_per_run': votes_per_run},
+        sources=[os.path.join(ROOT_DIR, 'models-baseline'), os.path.join(ROOT_DIR, 'utils-baseline'),
+                 os.path.join(ROOT_DIR, 'tf_ops'), os.path.abspath(__file__)])
+
+    with tf.Graph().as_default():
+        with tf.device('/gpu:'+str(GPU_INDEX)):
+            ops, saver = graph_cache.cached_graph(cache_file, lambda: build_graph(votes_per_run))
+            
+        # Create a session
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        config.log_device_placement = False
+        sess = tf.Session(config=config)
+
+        # Restore variables from disk.
+        saver.restore(sess, MODEL_PATH)
+        log_string("Model restored.")
+
+    if votes_per_run is not None:
+        ops['votes_per_run'] = votes_per_run
+        # Run once so that running out of memory shows up here
+        try:
+            sess.run(ops['pred'], feed_dict={ops['pointclouds_pl']: np.zeros(ops['pointclouds_pl'].get_shape().as_list()),
+                                             ops['is_training_pl']: is_training,
+                                             ops['angles_pl']: np.zeros(votes_per_run),
+                                             ops['vote_weights_pl']: np.ones(votes_per_run)})
+        except tf.errors.ResourceExhaustedError:
+            sess.close()
+            raise
+    return sess, ops
+
+def load_frozen_model():
+    ''' Load the graph written by --export_graph and return the session and
+        ops. It takes as many votes per run as it was exported with. '''
+    with tf.Graph().as_default():
+        inputs, outputs = freeze_util.load_frozen_graph(FLAGS.frozen_graph)
+        # batch norm and dropout are folded in, is_training is fed but unused
+        is_training_pl = tf.placeholder(tf.bool, shape=())
+
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        config.log_device_placement = False
+        sess = tf.Session(config=config)
+    log_string("Frozen graph loaded.")
+
+    ops = dict(inputs)
+    ops.update(outputs)
+    ops['is_training_pl'] = is_training_pl
+    if 'angles_pl' in ops:
+        ops['votes_per_run'] = ops['angles_pl'].get_shape()[0].value
+    return sess, ops
+
+def export_graph(sess, ops):
+    inputs = dict((key, ops[key]) for key in ops if key.endswith('_pl') and key != 'is_training_pl')
+    outputs = {'pred': ops['pred'], 'loss': ops['loss']}
+    _, stats = freeze_util.export_frozen_graph(sess, inputs, outputs,
+        ops['is_training_pl'], FLAGS.export_graph)
+    log_string('Frozen graph written to ' + freeze_util.format_stats(FLAGS.export_graph, stats))
+
+def evaluate(num_votes):
+    votes_per_run = None
+    if FLAGS.vote_batch:
+        votes_per_run = min(FLAGS.votes_per_run or num_votes, num_votes)
+    while True:
+        try:
+            sess, ops = build_model(votes_per_run)
+            break
+        except tf.errors.ResourceExhaustedError:
+            if votes_per_run is None or votes_per_run == 1:
+                raise
+            votes_per_run = (votes_per_run + 1) // 2
+            log_string('Out of memory, retrying with %d votes per run' % (votes_per_run))
+    if 'votes_per_run' in ops:
+        log_string('%d votes per run' % (ops['votes_per_run']))
+    if FLAGS.export_graph is not None:
+        export_graph(sess, ops)
+        return
 
     best_acc = -1
     best_acc_class = -1
+    backend = energy.get_backend(FLAGS.energy_backend) if FLAGS.energy_backend is not None else None
+    meter = energy.EnergyMeter(backend)
+    meter.start()
     for i in range(FLAGS.evaluate_epoch):
         log_string('\n---- EPOCH %03d EVALUATION ----'%(i))
         s = time.time()
-        cur_acc, cur_acc_class = eval_one_epoch(sess, ops, num_votes)
+        cur_acc, cur_acc_class = eval_one_epoch(sess, ops, num_votes, meter=meter)
         e = time.time()
 
 	if cur_acc > best_acc:
@@ -118,9 +239,14 @@ def evaluate(num_votes):
 	    log_string('BEST ACC CLASS: %f' %(best_acc_class))
 
 	log_string('time (secs) for 1 epoch: %f' %(e - s))
+    meter.stop()
+    if meter.enabled:
+        log_string(energy.format_report(meter.report()))
 
-def eval_one_epoch(sess, ops, num_votes=1, topk=1):
+def eval_one_epoch(sess, ops, num_votes=1, topk=1, meter=None):
     is_training = False
+    if meter is None:
+        meter = energy.EnergyMeter()
 
     TEST_DATASET = modelnet_h5_dataset.ModelNetH5Dataset(os.path.join(BASE_DIR, DATASET_DIR, 'modelnet40_ply_hdf5_2048/test_files.txt'), batch_size=BATCH_SIZE, npoints=NUM_POINT, shuffle=False)
 
@@ -145,21 +271,35 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
         cur_batch_label[0:bsize] = batch_label
 
         batch_pred_sum = np.zeros((BATCH_SIZE, NUM_CLASSES)) # score for classes
-        for vote_idx in range(num_votes):
-            # Shuffle point order to achieve different farthest samplings
-            shuffled_indices = np.arange(NUM_POINT)
-            #np.random.shuffle(shuffled_indices)
-            if FLAGS.normal:
-                rotated_data = provider.rotate_point_cloud_by_angle_with_normal(cur_batch_data[:, shuffled_indices, :],
-                    vote_idx/float(num_votes) * np.pi * 2)
-            else:
-                rotated_data = provider.rotate_point_cloud_by_angle(cur_batch_data[:, shuffled_indices, :],
-                    vote_idx/float(num_votes) * np.pi * 2)
-            feed_dict = {ops['pointclouds_pl']: rotated_data,
-                         ops['labels_pl']: cur_batch_label,
-                         ops['is_training_pl']: is_training}
-            loss_val, pred_val = sess.run([ops['loss'], ops['pred']], feed_dict=feed_dict)
-            batch_pred_sum += pred_val
+        meter.begin_batch()
+        if 'votes_per_run' in ops:
+            # Rotations of up to votes_per_run votes in one forward pass
+            for vote_start in range(0, num_votes, ops['votes_per_run']):
+                vote_idx = np.arange(vote_start, vote_start + ops['votes_per_run'])
+                feed_dict = {ops['pointclouds_pl']: cur_batch_data,
+                             ops['labels_pl']: cur_batch_label,
+                             ops['is_training_pl']: is_training,
+                             ops['angles_pl']: vote_idx/float(num_votes) * np.pi * 2,
+                             ops['vote_weights_pl']: (vote_idx < num_votes).astype(np.float32)}
+                loss_val, pred_val = sess.run([ops['loss'], ops['pred']], feed_dict=feed_dict)
+                batch_pred_sum += pred_val
+        else:
+            for vote_idx in range(num_votes):
+                # Shuffle point order to achieve different farthest samplings
+                shuffled_indices = np.arange(NUM_POINT)
+                #np.random.shuffle(shuffled_indices)
+                if FLAGS.normal:
+                    rotated_data = provider.rotate_point_cloud_by_angle_with_normal(cur_batch_data[:, shuffled_indices, :],
+                        vote_idx/float(num_votes) * np.pi * 2)
+                else:
+                    rotated_data = provider.rotate_point_cloud_by_angle(cur_batch_data[:, shuffled_indices, :],
+                        vote_idx/float(num_votes) * np.pi * 2)
+                feed_dict = {ops['pointclouds_pl']: rotated_data,
+                             ops['labels_pl']: cur_batch_label,
+                             ops['is_training_pl']: is_training}
+                loss_val, pred_val = sess.run([ops['loss'], ops['pred']], feed_dict=feed_dict)
+                batch_pred_sum += pred_val
+        meter.end_batch(bsize, warmup=meter.num_batches < FLAGS.energy_warmup)
         pred_val = np.argmax(batch_pred_sum, 1)
         correct = np.sum(pred_val[0:bsize] == batch_label[0:bsize])
         total_correct += correct
@@ -184,6 +324,5 @@ def eval_one_epoch(sess, ops, num_votes=1, topk=1):
     return total_correct / float(total_seen), np.mean(np.array(total_correct_class)/np.array(total_seen_class,dtype=np.float))
 
 if __name__=='__main__':
-    with tf.Graph().as_default():
-        evaluate(num_votes=FLAGS.num_votes)
+    evaluate(num_votes=FLAGS.num_votes)
     LOG_FOUT.close()
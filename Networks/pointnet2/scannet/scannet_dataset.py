@@ -145,8 +145,7 @@ class ScannetDatasetVirtualScan():
 	point_sets = list()
 	semantic_segs = list()
 	sample_weights = list()
-	for i in xrange(8):
-	    smpidx = scene_util.virtual_scan(point_set_ini,mode=i)
+	for smpidx in scene_util.virtual_scans(point_set_ini, range(8)):
 	    if len(smpidx)<300:
 		continue
             point_set = point_set_ini[smpidx,:]
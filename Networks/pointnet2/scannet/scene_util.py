@@ -16,9 +16,10 @@ def cart2sph(xyz):
   aer[:,0] = np.arctan2(xyz[:,1],xyz[:,0])
   return aer
 
-# generate virtual scan of a scene by subsampling the point cloud
-def virtual_scan(xyz, mode=-1):
-  camloc = np.mean(xyz,axis=0)
+# camera location and view direction (azimuth, elevation) of a virtual scan,
+# mode -1 for a random view, 0..7 for the 8 views around the scene center
+def camera_pose(center, mode=-1):
+  camloc = center.copy()
   camloc[2] = 1.5 # human height
   if mode==-1:
     view_dr = np.array([2*np.pi*np.random.random(), np.pi/10*(np.random.random()-0.75)])
@@ -26,6 +27,10 @@ def virtual_scan(xyz, mode=-1):
   else:
     view_dr = np.array([np.pi/4*mode, 0])
     camloc[:2] -= np.array([np.cos(view_dr[0]),np.sin(view_dr[0])])
+  return camloc, view_dr
+
+# directions of the 200x150 rays of a camera looking along view_dr
+def camera_rays(view_dr):
   ct_ray_dr = np.array([np.cos(view_dr[1])*np.cos(view_dr[0]), np.cos(view_dr[1])*np.sin(view_dr[0]), np.sin(view_dr[1])])
   hr_dr = np.cross(ct_ray_dr, np.array([0,0,1]))
   hr_dr /= la.norm(hr_dr)
@@ -37,30 +42,59 @@ def virtual_scan(xyz, mode=-1):
   xx = xx.reshape(-1,1)
   yy = yy.reshape(-1,1)
   rays = xx*hr_dr.reshape(1,-1)+yy*vt_dr.reshape(1,-1)+ct_ray_dr.reshape(1,-1)
-  rays_aer = cart2sph(rays)
-  local_xyz = xyz-camloc.reshape(1,-1)
-  local_aer = cart2sph(local_xyz)
-  nbrs = NearestNeighbors(n_neighbors=1, algorithm='kd_tree').fit(rays_aer[:,:2])
-  mindd, minidx = nbrs.kneighbors(local_aer[:,:2])
-  mindd = mindd.reshape(-1)
-  minidx = minidx.reshape(-1)
+  return rays
+
+# generate virtual scans of a scene from several views at once: every point
+# is assigned to its nearest ray, and per ray only the closest points survive
+# (a z-buffer over the ray bins of all views, computed with one sort)
+def virtual_scans(xyz, modes):
+  center = np.mean(xyz,axis=0)
+  poses = [camera_pose(center, mode) for mode in modes]
+  num_view = len(poses)
+  if num_view==0:
+    return []
+  # spherical coordinates of the points seen from all cameras in one pass
+  camlocs = np.array([camloc for camloc, _ in poses])
+  local_aer = cart2sph((xyz.reshape(1,-1,3)-camlocs.reshape(-1,1,3)).reshape(-1,3))
+  local_aer = local_aer.reshape(num_view,-1,3)
+
+  hit_idx = [] # points within reach of a ray, per view
+  hit_bin = [] # their ray, offset by view
+  num_ray = 0
+  for v in range(num_view):
+    rays_aer = cart2sph(camera_rays(poses[v][1]))
+    num_ray = rays_aer.shape[0]
+    nbrs = NearestNeighbors(n_neighbors=1, algorithm='kd_tree').fit(rays_aer[:,:2])
+    mindd, minidx = nbrs.kneighbors(local_aer[v,:,:2])
+    idx = np.where(mindd.reshape(-1)<0.01)[0]
+    hit_idx.append(idx)
+    hit_bin.append(minidx.reshape(-1)[idx]+v*num_ray)
+  hit_view = np.repeat(np.arange(num_view), [len(idx) for idx in hit_idx])
+  hit_idx = np.concatenate(hit_idx)
+  hit_bin = np.concatenate(hit_bin)
+  hit_r = local_aer[hit_view,hit_idx,2]
 
-  sub_idx = mindd<0.01
-  if sum(sub_idx)<100:
-    return np.ones(0)
-  sub_r = local_aer[sub_idx,2]
-  sub_minidx = minidx[sub_idx]
-  min_r = float('inf')*np.ones(np.max(sub_minidx)+1)
-  for i in xrange(len(sub_r)):
-    if sub_r[i]<min_r[sub_minidx[i]]:
-      min_r[sub_minidx[i]] = sub_r[i]
-  sub_smpidx = np.ones(len(sub_r))
-  for i in xrange(len(sub_r)):
-    if sub_r[i]>min_r[sub_minidx[i]]:
-      sub_smpidx[i] = 0
-  smpidx = np.where(sub_idx)[0]
-  smpidx = smpidx[sub_smpidx==1]
-  return smpidx
+  # minimum range per ray bin, keep the points at that range
+  min_r = float('inf')*np.ones(num_view*num_ray)
+  if len(hit_bin)>0:
+    order = np.argsort(hit_bin, kind='mergesort')
+    sorted_bin = hit_bin[order]
+    starts = np.where(np.concatenate([[True], sorted_bin[1:]!=sorted_bin[:-1]]))[0]
+    min_r[sorted_bin[starts]] = np.minimum.reduceat(hit_r[order], starts)
+  keep = hit_r<=min_r[hit_bin]
+
+  smpidxs = []
+  for v in range(num_view):
+    in_view = hit_view==v
+    if np.sum(in_view)<100:
+      smpidxs.append(np.ones(0))
+    else:
+      smpidxs.append(hit_idx[in_view & keep])
+  return smpidxs
+
+# generate virtual scan of a scene by subsampling the point cloud
+def virtual_scan(xyz, mode=-1):
+  return virtual_scans(xyz, [mode])[0]
 
 if __name__=='__main__':
   pc = np.load('scannet_dataset/scannet_scenes/scene0015_00.npy')
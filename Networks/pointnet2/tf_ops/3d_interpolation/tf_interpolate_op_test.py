@@ -1,6 +1,6 @@
 import tensorflow as tf
 import numpy as np
-from tf_interpolate import three_nn, three_interpolate
+from tf_interpolate import three_nn, three_interpolate, three_nn_interpolate
 
 class GroupPointTest(tf.test.TestCase):
   def test(self):
@@ -20,5 +20,34 @@ class GroupPointTest(tf.test.TestCase):
       print err
       self.assertLess(err, 1e-4) 
 
+  def test_grid_three_nn(self):
+    # enough known points for the grid search, and ties on an integer lattice
+    with self.test_session():
+      for xyz2_np in [np.random.random((2,1024,3)), np.random.randint(0,8,(2,1024,3))]:
+        xyz1_np = np.random.random((2,512,3))*8
+        xyz2_np = xyz2_np.astype('float32')
+        xyz1_np = xyz1_np.astype('float32')
+        dist, idx = three_nn(tf.constant(xyz1_np), tf.constant(xyz2_np))
+        dist, idx = dist.eval(), idx.eval()
+        d = np.sum((xyz1_np[:,:,None,:]-xyz2_np[:,None,:,:])**2, axis=-1)
+        # nearest first, the lowest index first among equal distances
+        expected_idx = np.argsort(d, axis=-1, kind='mergesort')[:,:,0:3]
+        self.assertAllEqual(idx, expected_idx)
+        self.assertAllClose(dist, np.sort(d, axis=-1)[:,:,0:3])
+
+  def test_three_nn_interpolate(self):
+    with self.test_session():
+      points = tf.constant(np.random.random((1,256,4)).astype('float32'))
+      xyz1 = tf.constant(np.random.random((1,64,3)).astype('float32'))
+      xyz2 = tf.constant(np.random.random((1,256,3)).astype('float32'))
+      dist, idx = three_nn(xyz1, xyz2)
+      dist = tf.maximum(dist, 1e-10)
+      weight = (1.0/dist) / tf.reduce_sum(1.0/dist, axis=2, keep_dims=True)
+      expected = three_interpolate(points, idx, weight)
+      out, _, _ = three_nn_interpolate(xyz1, xyz2, points)
+      self.assertAllClose(out.eval(), expected.eval(), rtol=1e-5, atol=1e-5)
+      err = tf.test.compute_gradient_error(points, (1,256,4), out, (1,64,4))
+      self.assertLess(err, 1e-4)
+
 if __name__=='__main__':
   tf.test.main() 
@@ -0,0 +1,372 @@
+'''
+    Pluggable power/energy sampling.
+
+    A backend reads one power source:
+      - JetsonBackend: the INA3221 power rails of the Jetson TX2 (same sysfs
+        nodes as power.cpp), instantaneous power in mW.
+      - RaplBackend: Linux powercap/RAPL counters of x86 CPUs, cumulative
+        energy in uJ.
+      - ReplayBackend: a recorded trace (e.g. a file written by power.cpp) or a
+        function of time, for tests and for machines without power sensors.
+
+    EnergySampler polls a backend from a background thread at a fixed rate,
+    sleeping between samples instead of spinning, and keeps a time series of
+    cumulative energy. Phases (warm-up, inference, ...) are recorded as
+    [start, end] intervals on the same clock, so the energy of each phase is
+    read off the time series instead of averaging the whole run.
+    EnergyMeter builds on it to record joules per batch and per sample of
+    the warm-up and steady-state batches of an evaluation loop.
+
+    Kept compatible with python2 since F-PointNet still runs under python2.
+'''
+from __future__ import print_function
+from __future__ import division
+
+import contextlib
+import glob
+import os
+import threading
+import time
+import numpy as np
+
+# Monotonic clock shared by the sampler and the phase markers
+now = getattr(time, 'monotonic', time.time)
+
+JETSON_RAILS = {
+    'gpu' : '/sys/devices/3160000.i2c/i2c-0/0-0040/iio_device/in_power0_input',
+    'soc' : '/sys/devices/3160000.i2c/i2c-0/0-0040/iio_device/in_power1_input',
+    'wifi' : '/sys/devices/3160000.i2c/i2c-0/0-0040/iio_device/in_power2_input',
+    'cpu' : '/sys/devices/3160000.i2c/i2c-0/0-0041/iio_device/in_power1_input',
+    'ddr' : '/sys/devices/3160000.i2c/i2c-0/0-0041/iio_device/in_power2_input'
+}
+
+RAPL_DIR = '/sys/class/powercap'
+
+class JetsonBackend(object):
+    ''' Sum of the selected Jetson TX2 power rails, in watts. '''
+    kind = 'power'
+
+    def __init__(self, rails=('gpu',)):
+        if rails == 'all':
+            rails = sorted(JETSON_RAILS.keys())
+        self.rails = list(rails)
+        self.fds = [os.open(JETSON_RAILS[r], os.O_RDONLY) for r in self.rails]
+
+    @staticmethod
+    def available():
+        return os.path.exists(JETSON_RAILS['gpu'])
+
+    def read(self):
+        total = 0.0
+        for fd in self.fds:
+            os.lseek(fd, 0, os.SEEK_SET)
+            total += float(os.read(fd, 32))
+        # the rails report milliwatts
+        return total / 1000.0
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+class RaplBackend(object):
+    ''' Cumulative energy of the RAPL package domains, in joules.
+        Sub-domains (core, uncore, dram under a package) are skipped unless
+        listed explicitly, since the package counter already includes them.
+    '''
+    kind = 'energy'
+
+    def __init__(self, domains=None):
+        if domains is None:
+            domains = sorted(d for d in glob.glob(os.path.join(RAPL_DIR, 'intel-rapl:*')) \
+                if os.path.basename(d).count(':') == 1)
+        else:
+            domains = [d if os.path.isabs(d) else os.path.join(RAPL_DIR, d) for d in domains]
+        if len(domains) == 0:
+            raise IOError('no RAPL domain found in %s' % RAPL_DIR)
+        self.domains = domains
+        self.max_uj = [self._read_int(os.path.join(d, 'max_energy_range_uj')) for d in domains]
+        self.last_uj = [self._read_int(os.path.join(d, 'energy_uj')) for d in domains]
+        self.total_uj = 0
+
+    @staticmethod
+    def available():
+        return len(glob.glob(os.path.join(RAPL_DIR, 'intel-rapl:*', 'energy_uj'))) > 0
+
+    @staticmethod
+    def _read_int(filename):
+        with open(filename, 'r') as f:
+            return int(f.read())
+
+    def read(self):
+        for i, d in enumerate(self.domains):
+            uj = self._read_int(os.path.join(d, 'energy_uj'))
+            delta = uj - self.last_uj[i]
+            if delta < 0:
+                # the counter wrapped around
+                delta += self.max_uj[i]
+            self.total_uj += delta
+            self.last_uj[i] = uj
+        return self.total_uj * 1e-6
+
+    def close(self):
+        pass
+
+class ReplayBackend(object):
+    ''' Replay a power trace, in watts.
+        trace can be a function of the time since start, a sequence of values
+        sampled every `period` seconds, or the name of a file with one value
+        per line (as written by power.cpp). Values are multiplied by `scale`,
+        e.g. 0.001 for the milliwatt files of power.cpp. The last value is held
+        once the trace runs out.
+    '''
+    kind = 'power'
+
+    def __init__(self, trace, period=0.01, scale=1.0, clock=now):
+        if isinstance(trace, str):
+            with open(trace, 'r') as f:
+                trace = [float(line) for line in f if line.strip()]
+        self.trace = trace
+        self.period = period
+        self.scale = scale
+        self.clock = clock
+        self.start = clock()
+
+    @staticmethod
+    def available():
+        return True
+
+    def read(self):
+        t = self.clock() - self.start
+        if callable(self.trace):
+            return self.trace(t) * self.scale
+        idx = min(int(t / self.period), len(self.trace) - 1)
+        return self.trace[idx] * self.scale
+
+    def close(self):
+        pass
+
+BACKENDS = {
+    'jetson' : JetsonBackend,
+    'rapl' : RaplBackend,
+    'replay' : ReplayBackend
+}
+
+def get_backend(name='auto', **kwargs):
+    ''' Create a backend by name. 'auto' picks Jetson, then RAPL. '''
+    if name == 'auto':
+        if JetsonBackend.available():
+            name = 'jetson'
+        elif RaplBackend.available():
+            name = 'rapl'
+        else:
+            raise IOError('no power sensor found, use the replay backend')
+    return BACKENDS[name](**kwargs)
+
+class EnergySampler(object):
+    ''' Sample a backend at a fixed rate in a background thread.
+        The samples form a time series of cumulative energy (joules), linear
+        between samples, i.e. constant power within one sampling period.
+    '''
+    def __init__(self, backend, rate=100.0, clock=now):
+        self.backend = backend
+        self.period = 1.0 / rate
+        self.clock = clock
+        self.times = []
+        self.energy = []
+        self.phases = []
+        self._last_power = None
+        self._offset = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sample()
+
+    def _run(self):
+        deadline = self.clock()
+        while not self._stop.is_set():
+            deadline += self.period
+            wait = deadline - self.clock()
+            if wait < 0:
+                # fell behind (e.g. a slow sysfs read), skip the missed ticks
+                deadline = self.clock()
+                wait = 0
+            if self._stop.wait(wait):
+                break
+            self.sample()
+
+    def sample(self):
+        ''' Take one sample now. Safe to call from any thread. '''
+        with self._lock:
+            value = self.backend.read()
+            t = self.clock()
+            if self.backend.kind == 'energy':
+                if len(self.energy) == 0:
+                    self._offset = value
+                e = value - self._offset
+            elif len(self.energy) == 0:
+                e = 0.0
+            else:
+                # trapezoid between the previous and the current power reading
+                e = self.energy[-1] + 0.5 * (self._last_power + value) * (t - self.times[-1])
+            if self.backend.kind == 'power':
+                self._last_power = value
+            self.times.append(t)
+            self.energy.append(e)
+
+    def energy_between(self, t0, t1):
+        ''' Joules consumed between two timestamps of the sampler clock. '''
+        if len(self.times) == 0 or t1 > self.times[-1]:
+            self.sample()
+        with self._lock:
+            times = np.array(self.times)
+            energy = np.array(self.energy)
+        return float(np.interp(t1, times, energy) - np.interp(t0, times, energy))
+
+    def add_phase(self, name, t0, t1, **info):
+        ''' Record a phase [t0, t1]; extra info (e.g. num_samples) is kept with it. '''
+        record = {'phase': name, 'start': t0, 'end': t1}
+        record.update(info)
+        self.phases.append(record)
+        return record
+
+    @contextlib.contextmanager
+    def phase(self, name, **info):
+        ''' Record the code inside the with block as a phase. '''
+        t0 = self.clock()
+        yield
+        self.add_phase(name, t0, self.clock(), **info)
+
+    def report(self):
+        ''' Energy, duration and average power of every recorded phase,
+            and of all records of the same name added up. Phases recorded
+            with num_samples also get joules per sample.
+        '''
+        if len(self.phases) > 0 and max(p['end'] for p in self.phases) > self.times[-1]:
+            self.sample()
+        with self._lock:
+            times = np.array(self.times)
+            energy = np.array(self.energy)
+        starts = np.array([p['start'] for p in self.phases])
+        ends = np.array([p['end'] for p in self.phases])
+        joules = np.interp(ends, times, energy) - np.interp(starts, times, energy)
+
+        records = []
+        totals = {}
+        for p, j in zip(self.phases, joules):
+            r = dict(p)
+            r['duration'] = p['end'] - p['start']
+            r['joules'] = float(j)
+            r['avg_watts'] = r['joules'] / r['duration'] if r['duration'] > 0 else 0.0
+            if r.get('num_samples'):
+                r['joules_per_sample'] = r['joules'] / r['num_samples']
+            records.append(r)
+            total = totals.setdefault(p['phase'], {'phase': p['phase'], 'count': 0, 'duration': 0.0,
+                'joules': 0.0, 'num_samples': 0})
+            total['count'] += 1
+            total['duration'] += r['duration']
+            total['joules'] += r['joules']
+            total['num_samples'] += r.get('num_samples', 0)
+        for total in totals.values():
+            total['avg_watts'] = total['joules'] / total['duration'] if total['duration'] > 0 else 0.0
+            total['joules_per_phase'] = total['joules'] / total['count']
+            if total['num_samples'] > 0:
+                total['joules_per_sample'] = total['joules'] / total['num_samples']
+        return {'phases': records, 'totals': totals}
+
+class EnergyMeter(object):
+    ''' Attribute energy to the batches of an in-process inference loop.
+
+        meter = EnergyMeter(get_backend('rapl'))
+        with meter:
+            for i, batch in enumerate(batches):
+                with meter.batch(len(batch), warmup=i < num_warmup):
+                    sess.run(...)
+        print(format_report(meter.report()))
+
+        Every batch is recorded with its timestamps (seconds since the meter
+        started) and number of samples, as a 'warmup' or 'inference' phase.
+        For loops that cannot use a with block, call begin_batch() and
+        end_batch(num_samples) instead; num_batches counts the recorded
+        batches, e.g. to flag the first ones as warm-up. With backend=None
+        every call is a no-op, so the loops can use a meter unconditionally.
+    '''
+    def __init__(self, backend=None, rate=100.0):
+        self.sampler = EnergySampler(backend, rate) if backend is not None else None
+        self.num_batches = 0
+        self._t0 = None
+
+    @property
+    def enabled(self):
+        return self.sampler is not None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        if self.enabled:
+            self.sampler.start()
+            self.origin = self.sampler.clock()
+
+    def stop(self):
+        if self.enabled:
+            self.sampler.stop()
+            self.sampler.backend.close()
+
+    def begin_batch(self):
+        if self.enabled:
+            self._t0 = self.sampler.clock()
+
+    def end_batch(self, num_samples, warmup=False):
+        self.num_batches += 1
+        if self.enabled:
+            self.sampler.add_phase('warmup' if warmup else 'inference', self._t0,
+                self.sampler.clock(), num_samples=num_samples)
+
+    @contextlib.contextmanager
+    def batch(self, num_samples, warmup=False):
+        self.begin_batch()
+        yield
+        self.end_batch(num_samples, warmup)
+
+    def report(self):
+        ''' The sampler report, with batch timestamps relative to the meter start. '''
+        if not self.enabled:
+            return None
+        report = self.sampler.report()
+        for r in report['phases']:
+            r['start'] -= self.origin
+            r['end'] -= self.origin
+        return report
+
+def format_report(report):
+    lines = ['%-16s %6s %12s %12s %12s %12s' % ('phase', 'count', 'time (s)', 'energy (J)', 'power (W)', 'J/sample')]
+    for name in sorted(report['totals'].keys()):
+        t = report['totals'][name]
+        per_sample = '%12.6f' % t['joules_per_sample'] if 'joules_per_sample' in t else '%12s' % '-'
+        lines.append('%-16s %6d %12.4f %12.4f %12.4f %s' % (name, t['count'], t['duration'], t['joules'], t['avg_watts'], per_sample))
+    return '\n'.join(lines)
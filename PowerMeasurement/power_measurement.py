@@ -1,19 +1,31 @@
 '''
-    This script is used to compile and launch different network.
+    This script is used to measure the power and energy of a network run.
+    Power is sampled in-process at a fixed rate by energy.py, so the idle
+    level before the launch and the run itself are reported as separate phases.
 '''
 import numpy as np
 import argparse
 import os
 import sys
-import statistics
+import subprocess
+import json
+import time
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = BASE_DIR
 sys.path.append(BASE_DIR)
+import energy
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--run', type=str, default=None, help='Launch the model with default settings.')
 parser.add_argument('--use_baseline', type=bool, default=False, help='Use baseline instead of efficient version.')
 parser.add_argument('--use_limited', type=bool, default=False, help='Use limited aggr. instead of efficient version.')
+parser.add_argument('--backend', type=str, default='auto', choices=['auto'] + sorted(energy.BACKENDS.keys()), help='Power sensor: jetson, rapl, replay or auto [default: auto]')
+parser.add_argument('--rail', type=str, default='gpu', help='Jetson power rails, comma separated or all [default: gpu]')
+parser.add_argument('--replay_file', type=str, default=None, help='Power trace in mW (one value per line) for the replay backend.')
+parser.add_argument('--replay_period', type=float, default=0.01, help='Seconds between two values of --replay_file [default: 0.01]')
+parser.add_argument('--rate', type=float, default=100.0, help='Sampling rate in Hz [default: 100]')
+parser.add_argument('--idle', type=float, default=1.0, help='Seconds of idle power to record before the launch [default: 1.0]')
+parser.add_argument('--report', type=str, default=None, help='Write the per-phase energy report as JSON to this file.')
 FLAGS = parser.parse_args()
 
 RUN_MODELS = {
@@ -37,35 +49,48 @@ RUN_LIMITED = {
     'dgcnn' : 'python evaluate.py'
 }
 
+def make_backend():
+    if FLAGS.backend == 'jetson':
+        return energy.get_backend('jetson', rails=FLAGS.rail.split(',') if FLAGS.rail != 'all' else 'all')
+    elif FLAGS.backend == 'replay':
+        if FLAGS.replay_file is None:
+            print('[ERROR]: the replay backend needs --replay_file.')
+            exit()
+        return energy.get_backend('replay', trace=FLAGS.replay_file, period=FLAGS.replay_period, scale=0.001)
+    return energy.get_backend(FLAGS.backend)
+
 dir_path = '../Networks/%s' % FLAGS.run
 # Run some models
 if FLAGS.run in RUN_MODELS and os.path.exists(dir_path):
     print('cd %s' % dir_path)
-    ch_pid = os.fork()
-    if ch_pid == 0:
-        os.execlp('power', 'gpu', 'measured')
+    if FLAGS.use_baseline:
+        print('launching %s baseline' % FLAGS.run)
+        cmd = RUN_BASELINES[FLAGS.run]
+    elif FLAGS.use_limited:
+        print('launching %s limited-aggr.' % FLAGS.run)
+        cmd = RUN_LIMITED[FLAGS.run]
     else:
-        if FLAGS.use_baseline:
-            print('launching %s baseline' % FLAGS.run)
-            os.system('cd %s; %s' % (dir_path, RUN_BASELINES[FLAGS.run]))
-        elif FLAGS.use_limited:
-            print('launching %s limited-aggr.' % FLAGS.run)
-            os.system('cd %s; %s' % (dir_path, RUN_LIMITED[FLAGS.run]))
-        else:
-            print('launching %s efficient net' % FLAGS.run)
-            os.system('cd %s; %s' % (dir_path, RUN_MODELS[FLAGS.run]))
-        
-        os.system('kill -9 %d' % ch_pid)
-        number_file = open('measured_power.txt', 'r')
-        nums = []
-        for i in number_file.readlines():
-            # assume power less than 1000 is idle
-            if float(i) >= 1000:
-                nums.append(float(i))
+        print('launching %s efficient net' % FLAGS.run)
+        cmd = RUN_MODELS[FLAGS.run]
+
+    sampler = energy.EnergySampler(make_backend(), rate=FLAGS.rate)
+    with sampler:
+        with sampler.phase('idle'):
+            time.sleep(FLAGS.idle)
+        with sampler.phase('run'):
+            subprocess.call(cmd, shell=True, cwd=dir_path)
+    sampler.backend.close()
 
-        print('Average power %f' % statistics.mean(nums))
-        exit()
+    report = sampler.report()
+    print(energy.format_report(report))
+    idle = report['totals']['idle']
+    run = report['totals']['run']
+    print('Average power %f W' % run['avg_watts'])
+    print('Energy %f J, %f J above idle' % (run['joules'], run['joules'] - idle['avg_watts'] * run['duration']))
+    if FLAGS.report is not None:
+        with open(FLAGS.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    exit()
 elif FLAGS.run is not None:
     print('[ERROR]: can\'t find the model %s to run.' % FLAGS.run)
     exit()
-
@@ -0,0 +1,114 @@
+'''
+    Client of the inference server (server.py).
+
+        import client
+        with client.InferenceClient() as c:
+            c.load('pointnet2', 'full')
+            outputs = c.predict('pointnet2', 'full', points)   # MxNx3 float32
+            print(outputs['logits'].shape)
+
+    Run as a script, it sends synthetic clouds to a running server and prints
+    the round-trip latency, e.g.:
+        python Serving/client.py --network pointnet2 --variant full --num_samples 64
+'''
+from __future__ import print_function
+
+import argparse
+import os
+import socket
+import sys
+import time
+import numpy as np
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'Benchmark'))
+import bench_util
+import protocol
+from server import DEFAULT_SOCKET
+
+class InferenceError(Exception):
+    pass
+
+class InferenceClient(object):
+    ''' Connection to the server; address is a Unix socket path or a
+        (host, port) tuple.
+    '''
+    def __init__(self, address=DEFAULT_SOCKET):
+        if isinstance(address, tuple):
+            self.sock = socket.create_connection(address)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.rfile = self.sock.makefile('rb')
+        self.wfile = self.sock.makefile('wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, header, arrays=None):
+        protocol.send_message(self.wfile, header, arrays)
+        reply, outputs = protocol.recv_message(self.rfile)
+        if reply.get('status') != 'ok':
+            raise InferenceError(reply.get('message'))
+        return reply, outputs
+
+    def load(self, network, variant, batch_size=None, num_point=None, model_path=None):
+        ''' Load a model, if not loaded yet, and return its info. '''
+        return self.request({'op': 'load', 'network': network, 'variant': variant,
+            'batch_size': batch_size, 'num_point': num_point, 'model_path': model_path})[0]
+
+    def predict(self, network, variant, points, autoload=True):
+        ''' Run MxNxC clouds through a model and return a dict of outputs. '''
+        points = np.asarray(points, dtype=np.float32)
+        return self.request({'op': 'predict', 'network': network, 'variant': variant,
+            'autoload': autoload}, {'points': points})[1]
+
+    def models(self):
+        return self.request({'op': 'models'})[0]['models']
+
+    def unload(self, network, variant):
+        self.request({'op': 'unload', 'network': network, 'variant': variant})
+
+    def shutdown(self):
+        self.request({'op': 'shutdown'})
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket of the server [default: %s]' % DEFAULT_SOCKET)
+    parser.add_argument('--port', type=int, default=None, help='Connect to this localhost TCP port instead [default: None]')
+    parser.add_argument('--network', default='pointnet2', choices=sorted(bench_util.BENCHMARK_SCRIPTS.keys()), help='Network [default: pointnet2]')
+    parser.add_argument('--variant', default='full', help='Aggregation variant [default: full]')
+    parser.add_argument('--num_samples', type=int, default=16, help='Clouds per request [default: 16]')
+    parser.add_argument('--requests', type=int, default=10, help='Number of requests [default: 10]')
+    FLAGS = parser.parse_args()
+
+    address = ('127.0.0.1', FLAGS.port) if FLAGS.port is not None else FLAGS.socket
+    with InferenceClient(address) as c:
+        info = c.load(FLAGS.network, FLAGS.variant)
+        if FLAGS.network == 'frustum-pointnets':
+            make_batch = bench_util.synthetic_frustum_batch
+        else:
+            make_batch = bench_util.synthetic_batch
+        points = make_batch(FLAGS.num_samples, info['num_point'], info['num_channel'])
+        latencies = []
+        for i in range(FLAGS.requests):
+            s = time.time()
+            outputs = c.predict(FLAGS.network, FLAGS.variant, points)
+            latencies.append(time.time() - s)
+    print('%s (%s): %s' % (FLAGS.network, FLAGS.variant,
+        ', '.join('%s %s' % (k, str(v.shape)) for k, v in sorted(outputs.items()))))
+    print('round trip of %d clouds (ms): p50 %.3f, max %.3f' % (FLAGS.num_samples,
+        np.percentile(latencies, 50) * 1000.0, np.max(latencies) * 1000.0))
+
+if __name__=='__main__':
+    main()
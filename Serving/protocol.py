@@ -0,0 +1,80 @@
+'''
+    Binary message format shared by the inference server, its workers and
+    the client.
+
+    A message is a JSON header followed by the raw bytes of zero or more
+    numpy arrays:
+
+        8 bytes   '!II' header length, payload length
+        header    utf-8 JSON; 'arrays' lists name, dtype and shape of each array
+        payload   the C-ordered array buffers, back to back
+
+    Point clouds are sent as float32 MxNxC arrays, so a 16x1024x3 batch costs
+    196 KB on the wire instead of several MB of JSON or pickled lists.
+
+    Kept compatible with python2 since the F-PointNet worker runs under python2.
+'''
+import json
+import struct
+import numpy as np
+
+PREFIX = struct.Struct('!II')
+
+class ProtocolError(Exception):
+    pass
+
+def read_exactly(f, n):
+    ''' Read n bytes from a file-like object, or raise EOFError. '''
+    chunks = []
+    while n > 0:
+        chunk = f.read(n)
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+def send_message(f, header, arrays=None):
+    ''' Write one message to a binary file-like object.
+        Input:
+          header: JSON serializable dict
+          arrays: dict of name -> numpy array
+    '''
+    header = dict(header)
+    buffers = []
+    specs = []
+    for name in sorted(arrays or {}):
+        arr = np.ascontiguousarray(arrays[name])
+        specs.append({'name': name, 'dtype': arr.dtype.str, 'shape': list(arr.shape)})
+        buffers.append(arr.tobytes())
+    header['arrays'] = specs
+    data = json.dumps(header).encode('utf-8')
+    f.write(PREFIX.pack(len(data), sum(len(b) for b in buffers)))
+    f.write(data)
+    for b in buffers:
+        f.write(b)
+    f.flush()
+
+def recv_message(f):
+    ''' Read one message from a binary file-like object.
+        Return (header dict, dict of name -> numpy array).
+    '''
+    header_len, payload_len = PREFIX.unpack(read_exactly(f, PREFIX.size))
+    header = json.loads(read_exactly(f, header_len).decode('utf-8'))
+    payload = read_exactly(f, payload_len)
+    arrays = {}
+    offset = 0
+    for spec in header.pop('arrays', []):
+        dtype = np.dtype(str(spec['dtype']))
+        count = int(np.prod(spec['shape'])) if spec['shape'] else 1
+        nbytes = count * dtype.itemsize
+        if offset + nbytes > len(payload):
+            raise ProtocolError('payload too short for array %s' % spec['name'])
+        arrays[spec['name']] = np.frombuffer(payload, dtype, count, offset).reshape(spec['shape'])
+        offset += nbytes
+    if offset != len(payload):
+        raise ProtocolError('%d unused payload bytes' % (len(payload) - offset))
+    return header, arrays
+
+def error_header(message):
+    return {'status': 'error', 'message': message}
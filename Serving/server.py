@@ -0,0 +1,259 @@
+'''
+    Long-lived inference server for the five networks.
+
+    Every network variant is loaded once, in its own worker process
+    (worker.py), and stays warm: later requests only pay for the forward
+    pass, not for importing TensorFlow/PyTorch, building the graph and
+    restoring the checkpoint. Clients talk to the server over a Unix socket
+    (or a localhost TCP port) with the binary messages of protocol.py; see
+    client.py.
+
+    Requests ('op' in the header):
+        load     network, variant [, batch_size, num_point, model_path]
+        predict  network, variant + 'points' array (MxNxC float32)
+        models   list the loaded models
+        unload   network, variant
+        shutdown stop the workers and the server
+
+    Usage (from the root directory):
+        python Serving/server.py --preload pointnet2:full,dgcnn:baseline
+'''
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'Benchmark'))
+import bench_util
+import protocol
+
+DEFAULT_SOCKET = '/tmp/pointcloud_inference.sock'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket to listen on [default: %s]' % DEFAULT_SOCKET)
+parser.add_argument('--port', type=int, default=None, help='Listen on this localhost TCP port instead of the Unix socket [default: None]')
+parser.add_argument('--preload', default=None, help='Comma separated NETWORK:VARIANT models to load at start-up [default: None]')
+parser.add_argument('--gpu', type=int, default=0, help='GPU used by the workers [default: GPU 0]')
+parser.add_argument('--batch_size', type=int, default=None, help='Default batch size of the loaded graphs [default: network default]')
+parser.add_argument('--num_point', type=int, default=None, help='Default points per cloud of the loaded graphs [default: network default]')
+parser.add_argument('--random_weights', action='store_true', help='Do not restore the pre-trained checkpoints by default')
+
+class ModelWorker(object):
+    ''' One warm network variant running in a worker.py subprocess.
+        Requests to a worker are serialized; different workers run in parallel.
+    '''
+    def __init__(self, network, variant, batch_size=None, num_point=None, model_path=None, gpu=0):
+        self.network = network
+        self.variant = variant
+        self.lock = threading.Lock()
+        interpreter = bench_util.BENCHMARK_SCRIPTS[network].split()[0]
+        cmd = [interpreter, os.path.join(BASE_DIR, 'worker.py'), '--network', network, '--',
+               '--variant', variant, '--gpu', str(gpu)]
+        if batch_size is not None:
+            cmd += ['--batch_size', str(batch_size)]
+        if num_point is not None:
+            cmd += ['--num_point', str(num_point)]
+        if model_path is not None:
+            cmd += ['--model_path', model_path]
+        self.proc = subprocess.Popen(cmd, cwd=os.path.join(ROOT_DIR, 'Networks', network),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            self.info, _ = protocol.recv_message(self.proc.stdout)
+        except EOFError:
+            self.info = protocol.error_header('worker of %s (%s) exited during start-up' % (network, variant))
+        if self.info['status'] != 'ok':
+            self.close()
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def request(self, header, arrays):
+        with self.lock:
+            if not self.alive:
+                return protocol.error_header('worker of %s (%s) is not running' % (self.network, self.variant)), {}
+            try:
+                protocol.send_message(self.proc.stdin, header, arrays)
+                return protocol.recv_message(self.proc.stdout)
+            except (EOFError, IOError, OSError):
+                self.close()
+                return protocol.error_header('worker of %s (%s) died' % (self.network, self.variant)), {}
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.proc.wait()
+
+class ModelRegistry(object):
+    ''' The loaded workers, keyed by (network, variant). '''
+    def __init__(self, FLAGS):
+        self.FLAGS = FLAGS
+        self.workers = {}
+        self.loading = {} # (network, variant) -> Event set when its load ends
+        self.lock = threading.Lock()
+
+    def load(self, network, variant, batch_size=None, num_point=None, model_path=None):
+        if network not in bench_util.BENCHMARK_VARIANTS:
+            return protocol.error_header('unknown network %s' % network)
+        if variant not in bench_util.BENCHMARK_VARIANTS[network]:
+            return protocol.error_header('%s has no %s version' % (network, variant))
+        if model_path is None and not self.FLAGS.random_weights:
+            model_path = bench_util.CHECKPOINTS[network][variant]
+        key = (network, variant)
+        while True:
+            worker = self.get(network, variant)
+            if worker is not None:
+                return worker.info
+            with self.lock:
+                loading = self.loading.get(key)
+                if loading is None and key not in self.workers:
+                    loading = self.loading[key] = threading.Event()
+                    break
+            # Another request is loading this model, wait for it and look again
+            if loading is not None:
+                loading.wait()
+
+        # Start the worker without the lock, so requests to the other models
+        # go on while this one builds its graph and restores the checkpoint
+        try:
+            print('loading %s version of %s ...' % (bench_util.VARIANT_NAMES[variant], network))
+            sys.stdout.flush()
+            worker = ModelWorker(network, variant,
+                batch_size if batch_size is not None else self.FLAGS.batch_size,
+                num_point if num_point is not None else self.FLAGS.num_point,
+                model_path, self.FLAGS.gpu)
+            if worker.info['status'] == 'ok':
+                with self.lock:
+                    self.workers[key] = worker
+                print('loaded %s (%s) in %.1f sec' % (network, variant, worker.info['load_sec']))
+            else:
+                print('[ERROR]: %s' % worker.info['message'])
+            sys.stdout.flush()
+            return worker.info
+        finally:
+            with self.lock:
+                del self.loading[key]
+            loading.set()
+
+    def get(self, network, variant):
+        ''' The worker of a loaded model, None if the model is not loaded or
+            its worker process died; a dead worker is dropped so that the
+            next load starts a new one. '''
+        with self.lock:
+            worker = self.workers.get((network, variant))
+            if worker is None or worker.alive:
+                return worker
+            del self.workers[(network, variant)]
+        print('[ERROR]: worker of %s (%s) died, dropped it' % (network, variant))
+        sys.stdout.flush()
+        worker.close()
+        return None
+
+    def unload(self, network, variant):
+        with self.lock:
+            worker = self.workers.pop((network, variant), None)
+        if worker is None:
+            return protocol.error_header('%s (%s) is not loaded' % (network, variant))
+        worker.close()
+        return {'status': 'ok'}
+
+    def models(self):
+        with self.lock:
+            return [w.info for w in self.workers.values() if w.alive]
+
+    def close(self):
+        with self.lock:
+            for worker in self.workers.values():
+                worker.close()
+            self.workers = {}
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    ''' Answer the requests of one client connection until it closes. '''
+    def handle(self):
+        registry = self.server.registry
+        while True:
+            try:
+                header, arrays = protocol.recv_message(self.rfile)
+            except EOFError:
+                return
+            except protocol.ProtocolError as e:
+                protocol.send_message(self.wfile, protocol.error_header(str(e)))
+                return
+            op = header.get('op')
+            outputs = {}
+            if op == 'predict':
+                network, variant = header.get('network'), header.get('variant')
+                worker = registry.get(network, variant)
+                if worker is None:
+                    if header.get('autoload', True):
+                        reply = registry.load(network, variant)
+                        worker = registry.get(network, variant)
+                    else:
+                        reply = protocol.error_header('%s (%s) is not loaded' % (network, variant))
+                if worker is not None:
+                    s = time.time()
+                    reply, outputs = worker.request({'op': 'predict'}, arrays)
+                    reply['server_ms'] = (time.time() - s) * 1000.0
+            elif op == 'load':
+                reply = registry.load(header.get('network'), header.get('variant'), header.get('batch_size'),
+                    header.get('num_point'), header.get('model_path'))
+            elif op == 'unload':
+                reply = registry.unload(header.get('network'), header.get('variant'))
+            elif op == 'models':
+                reply = {'status': 'ok', 'models': registry.models()}
+            elif op == 'shutdown':
+                protocol.send_message(self.wfile, {'status': 'ok'})
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            else:
+                reply = protocol.error_header('unknown op %s' % op)
+            protocol.send_message(self.wfile, reply, outputs)
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def main():
+    FLAGS = parser.parse_args()
+    if FLAGS.port is not None:
+        server = TCPServer(('127.0.0.1', FLAGS.port), RequestHandler)
+        address = '127.0.0.1:%d' % FLAGS.port
+    else:
+        if os.path.exists(FLAGS.socket):
+            os.remove(FLAGS.socket)
+        server = UnixServer(FLAGS.socket, RequestHandler)
+        address = FLAGS.socket
+    server.registry = ModelRegistry(FLAGS)
+    if FLAGS.preload is not None:
+        for model in FLAGS.preload.split(','):
+            network, variant = model.split(':')
+            server.registry.load(network, variant)
+    print('serving on %s' % address)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.registry.close()
+        if FLAGS.port is None and os.path.exists(FLAGS.socket):
+            os.remove(FLAGS.socket)
+
+if __name__=='__main__':
+    main()
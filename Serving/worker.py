@@ -0,0 +1,96 @@
+'''
+    Model worker of the inference server.
+
+    Loads one variant of one network through its benchmark.py (so the graph
+    and checkpoint handling are exactly those of the benchmarks) and answers
+    protocol messages on stdin/stdout until stdin is closed. The server starts
+    one worker per (network, variant), from the network directory, since the
+    variants share module names and F-PointNet needs python2.
+
+    Usage (started by server.py, from Networks/[NETWORK]):
+        python ../../Serving/worker.py --network pointnet2 -- --variant full --batch_size 16
+    Everything after -- is parsed by the network's benchmark.py parser.
+'''
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import traceback
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'Benchmark'))
+import bench_util
+import protocol
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--network', required=True, choices=sorted(bench_util.BENCHMARK_SCRIPTS.keys()), help='Network to serve')
+parser.add_argument('benchmark_args', nargs=argparse.REMAINDER, help='Flags of the network\'s benchmark.py')
+
+def import_benchmark(network):
+    ''' Import benchmark.py of the network from the current directory. '''
+    script = bench_util.BENCHMARK_SCRIPTS[network].split()[-1]
+    sys.path.insert(0, os.path.abspath(os.path.dirname(script)))
+    import benchmark
+    return benchmark
+
+def predict_all(predict, data, batch_size):
+    ''' Run any number of clouds through the fixed-size graph. '''
+    batches, sizes = bench_util.split_batches(data, batch_size)
+    return bench_util.concat_outputs([predict(b) for b in batches], sizes)
+
+def serve(predict, FLAGS, num_channel, fin, fout):
+    while True:
+        try:
+            header, arrays = protocol.recv_message(fin)
+        except EOFError:
+            return
+        if header.get('op') != 'predict':
+            protocol.send_message(fout, protocol.error_header('unknown op %s' % header.get('op')))
+            continue
+        points = arrays.get('points')
+        if points is None or points.ndim != 3 or points.shape[1:] != (FLAGS.num_point, num_channel):
+            protocol.send_message(fout, protocol.error_header('expected points of shape Mx%dx%d, got %s' % \
+                (FLAGS.num_point, num_channel, None if points is None else str(points.shape))))
+            continue
+        try:
+            s = time.time()
+            outputs = predict_all(predict, points, FLAGS.batch_size)
+            e = time.time()
+        except Exception:
+            protocol.send_message(fout, protocol.error_header(traceback.format_exc()))
+            continue
+        protocol.send_message(fout, {'status': 'ok', 'compute_ms': (e - s) * 1000.0}, outputs)
+
+def main():
+    FLAGS = parser.parse_args()
+    args = FLAGS.benchmark_args
+    if args and args[0] == '--':
+        args = args[1:]
+    # Keep stdout for the protocol; anything the models print goes to stderr
+    fout = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    fin = os.fdopen(os.dup(sys.stdin.fileno()), 'rb')
+
+    benchmark = import_benchmark(FLAGS.network)
+    bench_flags = benchmark.parser.parse_args(args)
+    num_channel = getattr(benchmark, 'NUM_CHANNEL', 3)
+    try:
+        s = time.time()
+        predict = benchmark.predictor_from_flags(bench_flags)
+        # The first run pays for the graph optimization and memory allocation
+        predict(bench_util.synthetic_batch(bench_flags.batch_size, bench_flags.num_point, num_channel))
+        load_time = time.time() - s
+    except Exception:
+        protocol.send_message(fout, protocol.error_header(traceback.format_exc()))
+        return
+    protocol.send_message(fout, {'status': 'ok', 'network': FLAGS.network,
+        'variant': bench_flags.variant, 'batch_size': bench_flags.batch_size,
+        'num_point': bench_flags.num_point, 'num_channel': num_channel,
+        'model_path': bench_flags.model_path, 'load_sec': load_time})
+    serve(predict, bench_flags, num_channel, fin, fout)
+
+if __name__=='__main__':
+    main()
@@ -8,6 +8,8 @@ import sys
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = BASE_DIR
 sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, 'Benchmark'))
+import bench_util
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--compile', type=str, default=None, help='Compile libraries in the models, to compile a specific network, use: --compile [NETWORK_NAME] or to compile all models using, --compile all')
@@ -18,6 +20,16 @@ parser.add_argument('--train', type=str, default=None, help='Train the model wit
 parser.add_argument('--use_baseline', type=bool, default=False, help='Use the baseline without any kind of Delayed-Aggregation.')
 parser.add_argument('--use_limited', type=bool, default=False, help='Use Limited Delayed-Aggregation.')
 parser.add_argument('--segmentation', type=bool, default=False, help='Execute the segmentation version.')
+parser.add_argument('--benchmark', type=str, default=None, help='Benchmark latency/throughput on synthetic inputs, use: --benchmark [NETWORK_NAME] or --benchmark all')
+parser.add_argument('--compare', type=str, default=None, help='Compare all versions of a network on identical inputs, use: --compare [NETWORK_NAME]')
+parser.add_argument('--batch_size', type=int, default=None, help='Batch size used by --benchmark [default: network default]')
+parser.add_argument('--num_point', type=int, default=None, help='Points per cloud used by --benchmark [default: network default]')
+parser.add_argument('--warmup', type=int, default=10, help='Untimed warm-up iterations used by --benchmark [default: 10]')
+parser.add_argument('--iterations', type=int, default=100, help='Timed iterations used by --benchmark [default: 100]')
+parser.add_argument('--energy_backend', type=str, default=None, help='Also measure energy per sample in --benchmark/--compare with this power backend: auto, jetson or rapl [default: None]')
+parser.add_argument('--trace', action='store_true', help='Also save an op-level trace of every variant in --benchmark and print the per-stage cost report')
+parser.add_argument('--serve', type=str, default=None, help='Start the inference server with the models preloaded, use: --serve [NETWORK_NAME] or --serve all')
+parser.add_argument('--port', type=int, default=None, help='Localhost TCP port used by --serve instead of a Unix socket [default: None]')
 FLAGS = parser.parse_args()
 
 COMPILE_MODELS = ['pointnet2', 'frustum-pointnets', 'DensePoint']
@@ -87,6 +99,120 @@ elif FLAGS.download is not None:
     exit()
 
 
+'''
+    Benchmark models on synthetic inputs
+'''
+BENCHMARK_RESULT_DIR = os.path.join(ROOT_DIR, 'Benchmark', 'results')
+TRACE_DIR = os.path.join(BENCHMARK_RESULT_DIR, 'traces')
+
+def benchmark_variants():
+    if FLAGS.use_baseline:
+        return ['baseline']
+    elif FLAGS.use_limited:
+        return ['limited']
+    return bench_util.VARIANTS
+
+def trace_file(model, variant):
+    return os.path.join(TRACE_DIR, '%s_%s_b%s_n%s.json' % (model, variant,
+        FLAGS.batch_size or 'default', FLAGS.num_point or 'default'))
+
+def benchmark_model(model, variant):
+    result_file = os.path.join(BENCHMARK_RESULT_DIR, '%s_%s.json' % (model, variant))
+    for f in [result_file, trace_file(model, variant)]:
+        if os.path.exists(f): os.remove(f)
+    cmd = '%s --variant %s --warmup %d --iterations %d --result_file %s' % \
+        (bench_util.BENCHMARK_SCRIPTS[model], variant, FLAGS.warmup, FLAGS.iterations, result_file)
+    if FLAGS.batch_size is not None:
+        cmd += ' --batch_size %d' % FLAGS.batch_size
+    if FLAGS.num_point is not None:
+        cmd += ' --num_point %d' % FLAGS.num_point
+    if FLAGS.energy_backend is not None:
+        cmd += ' --energy_backend %s' % FLAGS.energy_backend
+    if FLAGS.trace:
+        cmd += ' --trace_file %s' % trace_file(model, variant)
+    dir_path = './Networks/%s' % model
+    print('benchmarking %s version for %s ...\n' % (bench_util.VARIANT_NAMES[variant], model))
+    os.system('cd %s; %s' % (dir_path, cmd))
+    return bench_util.read_result(result_file)
+
+if FLAGS.benchmark == 'all' or FLAGS.benchmark in bench_util.BENCHMARK_SCRIPTS:
+    if FLAGS.benchmark == 'all':
+        models = sorted(bench_util.BENCHMARK_SCRIPTS.keys())
+    else:
+        models = [FLAGS.benchmark]
+    header = ['network', 'variant', 'batch', 'points', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'samples/sec', 'peak RSS (MB)']
+    if FLAGS.energy_backend is not None:
+        header.append('J/sample')
+    rows = []
+    for m in models:
+        if not os.path.exists('./Networks/%s' % m):
+            print('[ERROR]: can\'t find the path ./Networks/%s' % m)
+            continue
+        for v in benchmark_variants():
+            if v not in bench_util.BENCHMARK_VARIANTS[m]:
+                rows.append([m, v, '-', '-'] + ['n/a'] * (len(header) - 4))
+                continue
+            r = benchmark_model(m, v)
+            if r is None:
+                print('[ERROR]: benchmark of %s (%s) failed.' % (m, v))
+                rows.append([m, v, '-', '-', 'failed'] + ['-'] * (len(header) - 5))
+                continue
+            row = [m, v, str(r['batch_size']), str(r['num_point']),
+                '%.3f' % r['latency_p50_ms'], '%.3f' % r['latency_p95_ms'],
+                '%.3f' % r['latency_p99_ms'], '%.2f' % r['samples_per_sec'],
+                '%.1f' % r['peak_rss_mb']]
+            if FLAGS.energy_backend is not None:
+                row.append('%.6f' % r['joules_per_sample'] if 'joules_per_sample' in r else '-')
+            rows.append(row)
+    print('\n' + bench_util.format_table(header, rows))
+    if FLAGS.trace:
+        traces = [trace_file(m, v) for m in models for v in benchmark_variants()]
+        traces = [t for t in traces if os.path.exists(t)]
+        if traces:
+            os.system('python Benchmark/trace_report.py %s' % ' '.join(traces))
+    exit()
+elif FLAGS.benchmark is not None:
+    print('[ERROR]: can\'t find the model %s to benchmark.' % FLAGS.benchmark)
+    exit()
+
+# Compare versions
+if FLAGS.compare in bench_util.BENCHMARK_SCRIPTS:
+    cmd = 'python Benchmark/compare.py --network %s --warmup %d --iterations %d' % \
+        (FLAGS.compare, FLAGS.warmup, FLAGS.iterations)
+    if FLAGS.batch_size is not None:
+        cmd += ' --batch_size %d' % FLAGS.batch_size
+    if FLAGS.num_point is not None:
+        cmd += ' --num_point %d' % FLAGS.num_point
+    if FLAGS.energy_backend is not None:
+        cmd += ' --energy_backend %s' % FLAGS.energy_backend
+    os.system(cmd)
+    exit()
+elif FLAGS.compare is not None:
+    print('[ERROR]: can\'t find the model %s to compare.' % FLAGS.compare)
+    exit()
+
+# Serve models
+if FLAGS.serve == 'all' or FLAGS.serve in bench_util.BENCHMARK_SCRIPTS:
+    if FLAGS.serve == 'all':
+        models = sorted(bench_util.BENCHMARK_SCRIPTS.keys())
+    else:
+        models = [FLAGS.serve]
+    preload = ['%s:%s' % (m, v) for m in models for v in benchmark_variants() \
+        if v in bench_util.BENCHMARK_VARIANTS[m]]
+    cmd = 'python Serving/server.py --preload %s' % ','.join(preload)
+    if FLAGS.batch_size is not None:
+        cmd += ' --batch_size %d' % FLAGS.batch_size
+    if FLAGS.num_point is not None:
+        cmd += ' --num_point %d' % FLAGS.num_point
+    if FLAGS.port is not None:
+        cmd += ' --port %d' % FLAGS.port
+    os.system(cmd)
+    exit()
+elif FLAGS.serve is not None:
+    print('[ERROR]: can\'t find the model %s to serve.' % FLAGS.serve)
+    exit()
+
+
 '''
     Evaluate models
 '''